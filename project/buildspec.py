@@ -0,0 +1,177 @@
+"""Builds the buildspec CodeBuild runs from a component definition.
+
+See https://docs.aws.amazon.com/codebuild/latest/userguide/build-spec-ref.html
+
+The rendered string is canonical (sorted keys), so callers can hash it once
+to tell whether the buildspec changed.
+"""
+import re
+import json
+import hashlib
+import functools
+
+from extutil import remove_none_attributes
+
+PHASES = ["install", "pre_build", "build", "post_build"]
+ON_FAILURE_VALUES = ["ABORT", "CONTINUE"]
+BATCH_KINDS = ["build-graph", "build-list", "build-matrix"]
+FORMATS = ["json", "yaml"]
+BATCH_IDENTIFIER_REGEX = re.compile(r"^[A-Za-z0-9_]+$")
+
+# Component definition keys the buildspec is rendered from
+FIELDS = [
+    "environment_variables", "parameter_store", "secrets_manager", "exported_variables",
+    "buildspec_shell", "runtime_versions", "install_commands", "pre_build_commands",
+    "build_commands", "post_build_commands", "finally_commands", "on_failure",
+    "buildspec_reports", "buildspec_cache_paths", "buildspec_artifacts", "buildspec_batch"
+]
+
+def buildspec_fields(cdef):
+    """Picks the buildspec inputs out of a component definition, dropping empty ones"""
+    return {k: cdef[k] for k in FIELDS if cdef.get(k)}
+
+@functools.lru_cache(maxsize=64)
+def buildspec_digest(rendered):
+    """The MD5 of a rendered buildspec. Memoized, so the handler and the
+    applied spec snapshot share one hash of the same string."""
+    return hashlib.md5(rendered.encode("utf-8")).hexdigest()
+
+def render_buildspec(fields, buildspec_format="json"):
+    """Returns the buildspec for these fields as a JSON or YAML string.
+
+    Raises ValueError if the fields do not describe a valid buildspec.
+    """
+    if buildspec_format not in FORMATS:
+        raise ValueError(f"buildspec_format must be one of {FORMATS}")
+
+    spec = build_buildspec(fields)
+    if buildspec_format == "yaml":
+        return to_yaml(spec) + "\n"
+    return json.dumps(spec, sort_keys=True)
+
+def build_buildspec(fields):
+    finally_commands = fields.get("finally_commands") or {}
+    on_failure = fields.get("on_failure") or {}
+    if isinstance(on_failure, str):
+        on_failure = {phase: on_failure for phase in PHASES}
+    for phase, value in on_failure.items():
+        if phase not in PHASES or value not in ON_FAILURE_VALUES:
+            raise ValueError(f"on_failure must map phases {PHASES} to one of {ON_FAILURE_VALUES}")
+    for phase in finally_commands:
+        if phase not in PHASES:
+            raise ValueError(f"finally_commands keys must be phases {PHASES}")
+
+    batch = fields.get("buildspec_batch")
+    if batch:
+        validate_batch(batch)
+
+    def phase(name, **attrs):
+        return remove_none_attributes({
+            **attrs,
+            "commands": fields.get(f"{name}_commands"),
+            "finally": finally_commands.get(name),
+            "on-failure": on_failure.get(name)
+        }) or None
+
+    return remove_none_attributes({
+        "version": 0.2,
+        "env": remove_none_attributes({
+            "shell": fields.get("buildspec_shell"),
+            "variables": fields.get("environment_variables"),
+            "parameter-store": fields.get("parameter_store"),
+            "secrets-manager": fields.get("secrets_manager"),
+            "exported-variables": fields.get("exported_variables")
+        }) or None,
+        "phases": remove_none_attributes({
+            "install": phase("install", **{"runtime-versions": fields.get("runtime_versions")}),
+            "pre_build": phase("pre_build"),
+            "build": phase("build"),
+            "post_build": phase("post_build")
+        }),
+        "reports": fields.get("buildspec_reports"),
+        "artifacts": fields.get("buildspec_artifacts"),
+        "cache": remove_none_attributes({
+            "paths": fields.get("buildspec_cache_paths")
+        }) or None,
+        "batch": batch
+    })
+
+def validate_batch(batch):
+    """Raises ValueError if a buildspec batch section cannot run: it must set
+    exactly one kind, identifiers must be unique, and a build graph's
+    dependencies must exist and not form a cycle."""
+    kinds = [k for k in BATCH_KINDS if k in batch]
+    if len(kinds) != 1:
+        raise ValueError(f"buildspec_batch must set exactly one of {BATCH_KINDS}")
+    kind = kinds[0]
+
+    if kind == "build-matrix":
+        matrix = batch[kind]
+        if not isinstance(matrix, dict) or not (matrix.get("static") or matrix.get("dynamic")):
+            raise ValueError("build-matrix must set static or dynamic")
+        return
+
+    entries = batch[kind]
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{kind} must be a non-empty list of builds")
+    identifiers = [e.get("identifier") for e in entries]
+    invalid = [i for i in identifiers if not isinstance(i, str) or not BATCH_IDENTIFIER_REGEX.match(i)]
+    if invalid:
+        raise ValueError(f"{kind} identifiers must be letters, numbers and underscores, not {invalid}")
+    if len(set(identifiers)) != len(identifiers):
+        raise ValueError(f"{kind} identifiers must be unique")
+
+    if kind == "build-graph":
+        depends_on = {e["identifier"]: e.get("depend-on") or [] for e in entries}
+        unknown = sorted({d for deps in depends_on.values() for d in deps if d not in depends_on})
+        if unknown:
+            raise ValueError(f"build-graph depends on unknown builds {unknown}")
+        # Kahn's algorithm: whatever cannot be ordered is on a cycle
+        remaining = dict(depends_on)
+        while remaining:
+            ready = [i for i, deps in remaining.items() if not any(d in remaining for d in deps)]
+            if not ready:
+                raise ValueError(f"build-graph has a dependency cycle among {sorted(remaining)}")
+            for i in ready:
+                del remaining[i]
+
+def batch_fan_out(batch):
+    """How many builds a valid buildspec batch section starts"""
+    if "build-matrix" not in batch:
+        return len(next(batch[k] for k in BATCH_KINDS if k in batch))
+    dynamic = batch["build-matrix"].get("dynamic") or {}
+    env = dynamic.get("env") or {}
+    count = len(dynamic.get("buildspec") or [None])
+    for values in [env.get("image"), env.get("compute-type"), *(env.get("variables") or {}).values()]:
+        if isinstance(values, list):
+            count *= len(values) or 1
+    return count
+
+def to_yaml(value, indent=0):
+    """Block-style YAML with sorted keys. Strings are emitted as JSON strings,
+    which are valid YAML double-quoted scalars, so no YAML library is needed.
+    Non-ASCII characters are kept as is rather than escaped.
+    """
+    pad = "  " * indent
+    if isinstance(value, dict):
+        if not value:
+            return "{}"
+        lines = []
+        for k in sorted(value):
+            v = value[k]
+            if isinstance(v, (dict, list)) and v:
+                lines.append(f"{pad}{json.dumps(k, ensure_ascii=False)}:\n{to_yaml(v, indent + 1)}")
+            else:
+                lines.append(f"{pad}{json.dumps(k, ensure_ascii=False)}: {to_yaml(v)}")
+        return "\n".join(lines)
+    elif isinstance(value, list):
+        if not value:
+            return "[]"
+        lines = []
+        for v in value:
+            if isinstance(v, (dict, list)) and v:
+                lines.append(f"{pad}- {to_yaml(v, indent + 1).lstrip()}")
+            else:
+                lines.append(f"{pad}- {to_yaml(v)}")
+        return "\n".join(lines)
+    return json.dumps(value, ensure_ascii=False)
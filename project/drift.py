@@ -0,0 +1,164 @@
+import re
+import json
+
+from buildspec import buildspec_digest
+
+# Top-level fields CodeBuild fills in on its own; a spec never sets these
+SERVER_POPULATED_FIELDS = [
+    "arn", "created", "lastModified", "badge", "webhook",
+    "projectVisibility", "publicProjectAlias", "resourceAccessRole"
+]
+
+# What CodeBuild reports for settings a spec leaves out, by field name
+DEFAULTS = {
+    "privilegedMode": False,
+    "imagePullCredentialsType": "CODEBUILD",
+    "insecureSsl": False,
+    "reportBuildStatus": False,
+    "namespaceType": "NONE",
+    "packaging": "NONE",
+    "encryptionDisabled": False,
+    "overrideArtifactName": False,
+    "combineArtifacts": False,
+    "gitCloneDepth": 0,
+    "environmentVariables": [],
+    "secondarySources": [],
+    "secondaryArtifacts": [],
+    "secondarySourceVersions": [],
+    "fileSystemLocations": [],
+    "tags": [],
+    "cache": {"type": "NO_CACHE"},
+    "timeoutInMinutes": 60,
+    "queuedTimeoutInMinutes": 480
+}
+
+# Top-level fields that stay set on the project when dropped from the spec,
+# and the value update_project needs to clear them
+RESET_VALUES = {
+    "cache": {"type": "NO_CACHE"},
+    "secondarySources": [],
+    "secondarySourceVersions": [],
+    "secondaryArtifacts": [],
+    # An empty version builds the latest one again
+    "sourceVersion": "",
+    "vpcConfig": {},
+    "fileSystemLocations": [],
+    # An empty config turns batch builds off
+    "buildBatchConfig": {},
+    # -1 removes the limit
+    "concurrentBuildLimit": -1
+}
+
+MISSING = object()
+
+def diff_project(project, spec):
+    """Returns the semantic differences between a project and a desired spec.
+
+    Each difference is a dict with the dotted "path" of the field, the
+    "current" and "desired" values, and the kind of "change" ("changed" or
+    "removed"). Only fields present in the spec are compared, so extra keys
+    CodeBuild adds are ignored, and missing keys equal their defaults. Fields
+    listed in RESET_VALUES are also reported when they were dropped from the
+    spec but are still set on the project.
+    """
+    diffs = []
+    for k, v in spec.items():
+        if k in SERVER_POPULATED_FIELDS:
+            continue
+        _diff(project.get(k, MISSING), v, k, k, diffs)
+
+    for k, reset in RESET_VALUES.items():
+        # Compared both ways, as an empty reset value matches anything one way
+        if k not in spec and k in project and not (equal(project[k], reset, k) and equal(reset, project[k], k)):
+            diffs.append({"path": k, "current": project[k], "desired": None, "change": "removed"})
+    return diffs
+
+def reset_values(diffs):
+    """Returns the fields update_project must clear for the "removed" diffs"""
+    return {d["path"]: RESET_VALUES[d["path"]] for d in diffs if d["change"] == "removed"}
+
+def changed_sections(diffs):
+    """The top-level spec fields the diffs fall under, without repeats"""
+    return list(dict.fromkeys(re.split(r"[.\[]", d["path"], 1)[0] for d in diffs))
+
+def update_payload(spec, sections, reset=None):
+    """The update_project arguments that apply just the given top-level
+    sections of spec, plus the reset values clearing dropped fields.
+    CodeBuild leaves the fields an update leaves out as they are."""
+    payload = {"name": spec["name"]}
+    payload.update({k: spec[k] for k in sections if k in spec})
+    payload.update(reset or {})
+    return payload
+
+def applied_snapshot(spec):
+    """spec as kept in state: the rendered buildspec, compared whole anyway,
+    is replaced by its digest so state stays small"""
+    source = spec.get("source") or {}
+    if not isinstance(source.get("buildspec"), str):
+        return spec
+    return {**spec, "source": {**source, "buildspec": buildspec_digest(source["buildspec"])}}
+
+def stamp_applied(spec, applied_spec, applied_at, now, sections=()):
+    """Returns applied_at, the time each top-level field of spec was last
+    applied, given the previously applied spec and its timestamps. Both specs
+    are applied_snapshot ones. Fields in
+    sections, or that differ from applied_spec, are stamped with now."""
+    applied_spec, applied_at = applied_spec or {}, applied_at or {}
+    return {
+        k: now if k in sections or k not in applied_at or applied_spec.get(k) != v else applied_at[k]
+        for k, v in spec.items()
+    }
+
+def equal(current, desired, key=None):
+    diffs = []
+    _diff(current, desired, key, key or "", diffs)
+    return not diffs
+
+def _diff(current, desired, key, path, diffs):
+    if key == "tags":
+        current, desired = normalize_tags(current), normalize_tags(desired)
+    elif key == "buildspec":
+        current, desired = normalize_buildspec(current), normalize_buildspec(desired)
+
+    if _is_unset(desired, key) and _is_unset(current, key):
+        return
+
+    if key == "buildspec" and isinstance(desired, dict) and isinstance(current, dict):
+        # The buildspec is generated whole, so a section it dropped is drift too
+        if current != desired:
+            diffs.append({"path": path, "current": current, "desired": desired, "change": "changed"})
+    elif isinstance(desired, dict) and isinstance(current, dict):
+        for k, v in desired.items():
+            _diff(current.get(k, MISSING), v, k, f"{path}.{k}", diffs)
+    elif isinstance(desired, list) and isinstance(current, list) and len(desired) == len(current):
+        for i, (c, d) in enumerate(zip(current, desired)):
+            _diff(c, d, key, f"{path}[{i}]", diffs)
+    elif current != desired:
+        diffs.append({
+            "path": path,
+            "current": None if current is MISSING else current,
+            "desired": desired,
+            "change": "changed"
+        })
+
+def _is_unset(value, key):
+    if value is MISSING or value is None or value == {} or value == []:
+        return True
+    if key in DEFAULTS and value == DEFAULTS[key]:
+        return True
+    return False
+
+def normalize_tags(tags):
+    """CodeBuild uses lowercase key/value tag entries; accept either casing"""
+    if not isinstance(tags, list):
+        return tags
+    return {t.get("key", t.get("Key")): t.get("value", t.get("Value")) for t in tags}
+
+def normalize_buildspec(buildspec):
+    """Parses a JSON buildspec so formatting and key order do not count as drift"""
+    if not isinstance(buildspec, str):
+        return buildspec
+    try:
+        return json.loads(buildspec)
+    except ValueError:
+        return buildspec
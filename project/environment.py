@@ -0,0 +1,99 @@
+"""Which CodeBuild environment types, compute types and fleets go together.
+
+See https://docs.aws.amazon.com/codebuild/latest/userguide/build-env-ref-compute-types.html
+
+Every environment type lists the compute types it accepts and what it needs
+or forbids, so an invalid combination is reported when the component is
+deployed rather than when CodeBuild rejects the project or the first build.
+"""
+GENERAL_COMPUTE_TYPES = [
+    "BUILD_GENERAL1_SMALL", "BUILD_GENERAL1_MEDIUM", "BUILD_GENERAL1_LARGE",
+    "BUILD_GENERAL1_XLARGE", "BUILD_GENERAL1_2XLARGE"
+]
+LAMBDA_COMPUTE_TYPES = [
+    "BUILD_LAMBDA_1GB", "BUILD_LAMBDA_2GB", "BUILD_LAMBDA_4GB",
+    "BUILD_LAMBDA_8GB", "BUILD_LAMBDA_10GB"
+]
+# Reserved capacity fleets can also size instances by attributes
+FLEET_COMPUTE_TYPES = GENERAL_COMPUTE_TYPES + ["ATTRIBUTE_BASED_COMPUTE"]
+
+ENVIRONMENT_TYPES = {
+    "LINUX_CONTAINER": {
+        "architecture": "x86_64", "compute": "container",
+        "compute_types": GENERAL_COMPUTE_TYPES, "fleet": "optional"
+    },
+    "ARM_CONTAINER": {
+        "architecture": "aarch64", "compute": "container",
+        "compute_types": GENERAL_COMPUTE_TYPES, "fleet": "optional"
+    },
+    "LINUX_LAMBDA_CONTAINER": {
+        "architecture": "x86_64", "compute": "lambda",
+        "compute_types": LAMBDA_COMPUTE_TYPES, "fleet": "forbidden"
+    },
+    "ARM_LAMBDA_CONTAINER": {
+        "architecture": "aarch64", "compute": "lambda",
+        "compute_types": LAMBDA_COMPUTE_TYPES, "fleet": "forbidden"
+    },
+    "LINUX_EC2": {
+        "architecture": "x86_64", "compute": "ec2",
+        "compute_types": FLEET_COMPUTE_TYPES, "fleet": "required",
+        "default_image": "aws/codebuild/ami/amazonlinux-x86_64-base:latest"
+    },
+    "ARM_EC2": {
+        "architecture": "aarch64", "compute": "ec2",
+        "compute_types": FLEET_COMPUTE_TYPES, "fleet": "required",
+        "default_image": "aws/codebuild/ami/amazonlinux-arm-base:latest"
+    }
+}
+
+DEFAULT_COMPUTE_TYPES = {
+    "container": "BUILD_GENERAL1_LARGE",
+    "lambda": "BUILD_LAMBDA_2GB",
+    "ec2": "BUILD_GENERAL1_LARGE"
+}
+
+def environment_info(environment_type):
+    """The ENVIRONMENT_TYPES entry for environment_type. Raises ValueError
+    for unknown types, including the GPU types, which are not supported."""
+    info = ENVIRONMENT_TYPES.get(environment_type)
+    if not info:
+        raise ValueError(f"environment_type must be one of {list(ENVIRONMENT_TYPES)}")
+    return info
+
+def is_lambda_compute(compute_type):
+    return compute_type in LAMBDA_COMPUTE_TYPES
+
+def infer_environment_type(container_image, compute_type):
+    """The environment type for an image and compute type when none is given"""
+    arm = "aarch64" in container_image or "-arm-" in container_image
+    if is_lambda_compute(compute_type):
+        return "ARM_LAMBDA_CONTAINER" if arm else "LINUX_LAMBDA_CONTAINER"
+    return "ARM_CONTAINER" if arm else "LINUX_CONTAINER"
+
+def validate_environment(environment_type, compute_type, fleet_arn=None, privileged_mode=False, cache=None):
+    """Raises ValueError if the combination cannot run on CodeBuild"""
+    info = environment_info(environment_type)
+    if compute_type not in info["compute_types"]:
+        raise ValueError(f"{environment_type} supports compute types {info['compute_types']}, not {compute_type}")
+    if info["fleet"] == "required" and not fleet_arn:
+        raise ValueError(f"{environment_type} runs on a reserved capacity fleet, so fleet_arn is required")
+    if info["fleet"] == "forbidden" and fleet_arn:
+        raise ValueError(f"{environment_type} cannot run on a reserved capacity fleet")
+    if info["compute"] == "lambda":
+        if privileged_mode:
+            raise ValueError("Lambda compute does not support privileged_mode")
+        if (cache or {}).get("type") == "LOCAL":
+            raise ValueError("Lambda compute does not support LOCAL caching")
+
+def build_environment(environment_type, container_image, compute_type, privileged_mode=False, fleet_arn=None):
+    """The environment section of a project spec"""
+    environment = {
+        "type": environment_type,
+        "image": container_image,
+        "computeType": compute_type,
+        "imagePullCredentialsType": "CODEBUILD",
+        "privilegedMode": privileged_mode
+    }
+    if fleet_arn:
+        environment["fleet"] = {"fleetArn": fleet_arn}
+    return environment
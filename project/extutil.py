@@ -2,91 +2,28 @@ import time
 import json
 import datetime
 import re
-import base64
 import hashlib
-import uuid
 import os
-import boto3
-import botocore
-import zipfile
-import fastjsonschema
+import random
+import contextvars
+import botocore.exceptions
+import threading
+import struct
+import zlib
 
+from collections import OrderedDict
 from urllib.parse import quote
 
-NAME_REGEX = r"^[a-zA-Z0-9\-\_]+$"
-LOWERCASE_NAME_REGEX = r"^[a-z0-9\-\_]+$"
-NO_UNDERSCORE_NAME_REGEX = r"^[a-zA-Z0-9\-]+$"
-NO_UNDERSCORE_LOWERCASE_NAME_REGEX = r"^[a-z0-9\-]+$"
-
-def safe_encode(string):
-    return base64.b32encode(string.encode("ascii")).decode("ascii").replace("=", "8")
-
-def safeval(string, no_underscores, no_uppercase):
-    if no_uppercase and no_underscores:
-        the_regex=NO_UNDERSCORE_LOWERCASE_NAME_REGEX
-    elif no_uppercase:
-        the_regex=LOWERCASE_NAME_REGEX
-    elif no_underscores:
-        the_regex=NO_UNDERSCORE_NAME_REGEX
-    else:
-        the_regex=NAME_REGEX
-
-    if not re.match(the_regex, string):
-        string = safe_encode(string).lower()
-
-    return string
-    
-def process_repo_id(repo_id, no_underscores, no_uppercase):
-    if "<" in repo_id:
-        base_repo_id, folder = repo_id.split("<")
-    else:
-        base_repo_id = repo_id
-        folder = None
-    repo_provider = None
-    if base_repo_id.startswith("github.com/"):
-        _, owner_name, repo_name = base_repo_id.split("/")
-        repo_provider = "g"
-        
-    elif base_repo_id.startswith("bitbucket."):
-        _, owner_name, repo_name = base_repo_id.split("/")
-        repo_provider = "b"
-
-    elif base_repo_id.startswith("gitlab.com/"):
-        _, owner_name, repo_name = base_repo_id.split("/")
-        repo_provider = "l"
-
-    elif len(base_repo_id.split("/")) == 5:
-        # We assume it is a Bitbucket Server Repo
-        _, _, owner_name, _, repo_name = base_repo_id.split("/")
-        repo_name = repo_name.lower()
-        repo_provider = "bs"
-
-    owner_name = safeval(owner_name, no_underscores, no_uppercase)
-    repo_name = safeval(repo_name, no_underscores, no_uppercase)
-    folder = safeval(folder.replace("/", ""), no_underscores, no_uppercase) if folder else None
-
-    return repo_provider, owner_name, repo_name, folder
-
-def component_safe_name(project_code, repo_id, component_name, no_underscores=False, no_uppercase=False, max_chars=64):
-    provider, owner, repo, folder = process_repo_id(repo_id, no_underscores, no_uppercase)
-    component_name = safeval(component_name, no_underscores, no_uppercase)
-
-    if folder:
-        full_name = f"ck-{project_code}-{provider}-{owner}-{repo}-{folder}-{component_name}"
-    else:
-        full_name = f"ck-{project_code}-{provider}-{owner}-{repo}-{component_name}"
-    
-    if len(full_name) > max_chars:
-        full_name = f"ck-{hashlib.md5(full_name.encode()).hexdigest()}"
-        if len(full_name) > max_chars:
-            full_name = full_name[:max_chars]
-    return full_name
+# Name derivation lives in naming.py; these names are kept importable from here
+from naming import NAME_REGEX, LOWERCASE_NAME_REGEX, NO_UNDERSCORE_NAME_REGEX, \
+    NO_UNDERSCORE_LOWERCASE_NAME_REGEX, safe_encode, safeval, process_repo_id, component_safe_name
 
 def remove_none_attributes(payload):
     """Assumes dict"""
     return {k: v for k, v in payload.items() if not v is None}
 
 def random_id():
+    import uuid
     return str(uuid.uuid4())
 
 def current_epoch_time_usec_num():
@@ -98,15 +35,390 @@ def lambda_env(key):
     except Exception as e:
         raise e
 
-def create_zip(file_name, path):
-    ziph=zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED)
-    # ziph is zipfile handle
+ZIP_CHUNK_SIZE = 1 << 20
+# Sizes and offsets from ZIP64_LIMIT on go in zip64 fields, and the 32-bit
+# field holds ZIP64_MARKER. Lowering the limit exercises zip64 on small trees.
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# Every entry gets this timestamp (1980-01-01 00:00:00, the earliest a zip can
+# hold) so archives depend only on file names, modes and contents
+ZIP_DOS_DATE = (1 << 5) | 1
+ZIP_DOS_TIME = 0
+# Already compressed formats gain nothing from deflate, so they are stored
+STORED_EXTENSIONS = [
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".jar", ".war", ".whl", ".egg",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4", ".woff", ".woff2"
+]
+
+def create_zip(file_name, path, excludes=None, use_gitignore=False, compression_level=6,
+        compression_levels=None, max_workers=None, chunk_size=ZIP_CHUNK_SIZE, max_in_flight_bytes=64 << 20):
+    """Zips the directory at path into file_name and returns its content hash.
+
+    The archive is reproducible: entries are sorted, timestamps are fixed, and
+    modes are normalized to 644 or 755, so the same tree always produces the
+    same bytes. excludes are .gitignore-style patterns, and use_gitignore adds
+    the patterns in path/.gitignore. compression_levels maps patterns to a
+    zlib level for matching files, where 0 stores them; STORED_EXTENSIONS are
+    stored unless a pattern says otherwise.
+
+    Files are read in chunk_size pieces and deflated in parallel on a thread
+    pool (zlib releases the GIL), each chunk primed with the end of the one
+    before it as pigz does, and at most max_in_flight_bytes are held at once.
+    The content hash is that of hash_tree, so callers can compare it to a
+    previous upload, or call hash_tree first and skip zipping entirely.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+
+    names = _zip_names(path, excludes, use_gitignore)
+    level_for = _compile_levels(compression_level, compression_levels)
+    tree_hash = hashlib.sha256()
+    pending = deque()
+    in_flight = 0
+
+    with open(file_name, "wb") as f, ThreadPoolExecutor(max_workers or min(8, os.cpu_count() or 1)) as pool:
+        writer = _ZipWriter(f)
+
+        def write_pending(limit):
+            nonlocal in_flight
+            while pending and in_flight > limit:
+                kind, entry, future, size = pending.popleft()
+                if kind == "start":
+                    writer.start(entry)
+                elif kind == "chunk":
+                    data, entry.method = future.result()
+                    writer.write(entry, data)
+                    in_flight -= size
+                else:
+                    writer.finish(entry)
+
+        for name in names:
+            full_path = os.path.join(path, *name.split("/"))
+            with open(full_path, "rb") as source:
+                stat = os.fstat(source.fileno())
+                level = level_for(name)
+                entry = _ZipEntry(name, 0o755 if stat.st_mode & 0o111 else 0o644, level, stat.st_size)
+                pending.append(("start", entry, None, 0))
+                file_hash = hashlib.sha256()
+                previous, data = None, source.read(chunk_size)
+                first = True
+                while True:
+                    following = source.read(chunk_size)
+                    last = not following
+                    entry.crc = zlib.crc32(data, entry.crc)
+                    entry.size += len(data)
+                    file_hash.update(data)
+                    zdict = previous[-32768:] if previous else None
+                    pending.append(("chunk", entry, pool.submit(_deflate_chunk, data, level, zdict, first, last), len(data)))
+                    in_flight += len(data)
+                    write_pending(max_in_flight_bytes)
+                    if last:
+                        break
+                    previous, data, first = data, following, False
+                pending.append(("end", entry, None, 0))
+            tree_hash.update(f"{name}\0{entry.mode:o}\0{file_hash.hexdigest()}\n".encode("utf-8"))
+
+        write_pending(-1)
+        writer.close()
+    return tree_hash.hexdigest()
+
+def hash_tree(path, excludes=None, use_gitignore=False):
+    """The content hash create_zip returns for this tree, without zipping it"""
+    tree_hash = hashlib.sha256()
+    for name in _zip_names(path, excludes, use_gitignore):
+        file_hash = hashlib.sha256()
+        with open(os.path.join(path, *name.split("/")), "rb") as source:
+            mode = 0o755 if os.fstat(source.fileno()).st_mode & 0o111 else 0o644
+            for data in iter(lambda: source.read(ZIP_CHUNK_SIZE), b""):
+                file_hash.update(data)
+        tree_hash.update(f"{name}\0{mode:o}\0{file_hash.hexdigest()}\n".encode("utf-8"))
+    return tree_hash.hexdigest()
+
+def compile_excludes(patterns):
+    """Turns .gitignore-style patterns into a function of (path, is_dir) that
+    says whether the path, relative to the root with / separators, is excluded.
+
+    Supports comments, ! negation, directory-only patterns ending in /,
+    patterns anchored by a leading or inner /, and the *, ?, [...] and **
+    wildcards. As in git, the last matching pattern wins, and nothing inside
+    an excluded directory can be re-included.
+    """
+    rules = []
+    for line in patterns:
+        line = line.rstrip("\r\n").rstrip(" ")
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        regex = _glob_to_regex(line.lstrip("/"))
+        rules.append((re.compile(("^" if anchored else "^(?:.*/)?") + regex + "$"), negate, dir_only))
+
+    def excluded(path, is_dir=False):
+        result = False
+        for regex, negate, dir_only in rules:
+            if (is_dir or not dir_only) and regex.match(path):
+                result = not negate
+        return result
+    return excluded
+
+def _glob_to_regex(pattern):
+    out, i = [], 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end].replace("\\", "\\\\")
+            out.append("[" + ("^" + body[1:] if body.startswith("!") else body) + "]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(out)
+
+def _zip_names(path, excludes=None, use_gitignore=False):
+    """The sorted, /-separated relative paths of the files create_zip includes"""
+    patterns = list(excludes or [])
+    gitignore = os.path.join(path, ".gitignore")
+    if use_gitignore and os.path.isfile(gitignore):
+        with open(gitignore) as f:
+            patterns = f.read().splitlines() + patterns
+    excluded = compile_excludes(patterns)
+
+    names = []
     for root, dirs, files in os.walk(path):
-        for file in files:
-            ziph.write(os.path.join(root, file), 
-                       os.path.relpath(os.path.join(root, file), 
-                                       os.path.join(path, '')))
-    ziph.close()
+        prefix = os.path.relpath(root, path).replace(os.sep, "/")
+        prefix = "" if prefix == "." else prefix + "/"
+        dirs[:] = [d for d in dirs if not excluded(prefix + d, True)]
+        names.extend(prefix + f for f in files if not excluded(prefix + f))
+    return sorted(names)
+
+def _compile_levels(default_level, compression_levels):
+    rules = [(p, 0) for p in STORED_EXTENSIONS] + list((compression_levels or {}).items())
+    compiled = [
+        (re.compile("^(?:.*/)?" + (_glob_to_regex(p.lstrip("/")) if not p.startswith(".") else ".*" + re.escape(p)) + "$", re.IGNORECASE), level)
+        for p, level in rules
+    ]
+
+    def level_for(name):
+        level = default_level
+        for regex, rule_level in compiled:
+            if regex.match(name):
+                level = rule_level
+        return level
+    return level_for
+
+def _deflate_chunk(data, level, zdict, first, last):
+    """Deflates one chunk of a file as raw deflate blocks. Chunks other than
+    the last end in a sync flush, so their output can simply be concatenated.
+    Returns the data and the zip method; a file that fits in one chunk is
+    stored if deflate would only make it bigger."""
+    if level == 0:
+        return data, ZIP_STORED
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    if first and last and len(compressed) >= len(data):
+        return data, ZIP_STORED
+    return compressed, ZIP_DEFLATED
+
+class _ZipEntry:
+    __slots__ = ["name", "mode", "method", "crc", "size", "compressed_size", "offset", "zip64"]
+
+    def __init__(self, name, mode, level, expected_size):
+        self.name = name
+        self.mode = mode
+        self.method = ZIP_STORED if level == 0 else ZIP_DEFLATED
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+        self.offset = 0
+        # Sized before reading, with room for deflate's worst case growth
+        self.zip64 = expected_size + (expected_size >> 7) + 65536 >= ZIP64_LIMIT
+
+class _ZipWriter:
+    """Writes a zip whose entries arrive already compressed. Each local
+    header is written with placeholder sizes and patched once the entry ends."""
+
+    def __init__(self, f):
+        self.f = f
+        self.entries = []
+
+    def _local_header(self, entry):
+        name = entry.name.encode("utf-8")
+        extra = struct.pack("<HHQQ", 1, 16, entry.size, entry.compressed_size) if entry.zip64 else b""
+        sizes = (ZIP64_MARKER, ZIP64_MARKER) if entry.zip64 else (entry.compressed_size, entry.size)
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, 45 if entry.zip64 else 20, self._flags(entry), entry.method,
+            ZIP_DOS_TIME, ZIP_DOS_DATE, entry.crc, *sizes, len(name), len(extra)
+        ) + name + extra
+
+    @staticmethod
+    def _flags(entry):
+        # Bit 11 marks the name as UTF-8
+        return 0 if entry.name.isascii() else 0x800
+
+    def start(self, entry):
+        entry.offset = self.f.tell()
+        self.f.write(self._local_header(entry))
+
+    def write(self, entry, data):
+        entry.compressed_size += len(data)
+        self.f.write(data)
+
+    def finish(self, entry):
+        if not entry.zip64 and max(entry.size, entry.compressed_size) >= ZIP64_LIMIT:
+            raise ValueError(f"{entry.name} grew past 4 GiB while it was being zipped")
+        end = self.f.tell()
+        self.f.seek(entry.offset)
+        self.f.write(self._local_header(entry))
+        self.f.seek(end)
+        self.entries.append(entry)
+
+    def close(self):
+        start = self.f.tell()
+        for entry in self.entries:
+            name = entry.name.encode("utf-8")
+            values, fields = [entry.size, entry.compressed_size, entry.offset], []
+            for i, value in enumerate(values):
+                if value >= ZIP64_LIMIT:
+                    fields.append(value)
+                    values[i] = ZIP64_MARKER
+            extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields), *fields) if fields else b""
+            version = 45 if fields or entry.zip64 else 20
+            self.f.write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, self._flags(entry), entry.method,
+                ZIP_DOS_TIME, ZIP_DOS_DATE, entry.crc, values[1], values[0], len(name), len(extra), 0, 0, 0,
+                ((0o100000 | entry.mode) << 16), values[2]
+            ) + name + extra)
+        end = self.f.tell()
+        count, size = len(self.entries), end - start
+        if count >= 0xFFFF or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            self.f.write(struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+            self.f.write(struct.pack("<IIQI", 0x07064b50, 0, end, 1))
+            count = min(count, 0xFFFF)
+            size, start = [ZIP64_MARKER if v >= ZIP64_LIMIT else v for v in (size, start)]
+        self.f.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, count, count, size, start, 0))
+
+class TTLCache:
+    """A size-bounded LRU cache whose entries expire after ttl seconds.
+
+    Meant to live at module level so entries survive across warm invocations
+    of the same container. A ttl of None disables expiry.
+    """
+
+    def __init__(self, maxsize=256, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry and self.ttl is not None and entry[0] + self.ttl < time.monotonic():
+                del self.data[key]
+                entry = None
+            if not entry:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic(), value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.data)}
+
+# Tuned for Lambda: fail fast on connect, and leave room for concurrent calls
+CLIENT_CONFIG = {
+    "connect_timeout": 5,
+    "read_timeout": 60,
+    "max_pool_connections": 25,
+    "tcp_keepalive": True
+}
+
+_clients = {}
+_client_lock = threading.Lock()
+_session = None
+# Stand-in clients by service, for running handlers offline
+_client_overrides = {}
+
+def override_client(service, client=None):
+    """Makes get_client return client for service in every region, or with
+    client None, go back to real clients. Meant for local harnesses."""
+    if client is None:
+        _client_overrides.pop(service, None)
+    else:
+        _client_overrides[service] = client
+
+def get_client(service, region=None, **config):
+    """Returns a boto3 client for service, created on first use.
+
+    Clients are memoized per service, region and config overrides, and all of
+    them share one botocore session, so credentials and endpoint data are only
+    loaded once per container. boto3 itself is imported on the first call.
+    """
+    if service in _client_overrides:
+        return _client_overrides[service]
+    key = (service, region, json.dumps(config, sort_keys=True))
+    client = _clients.get(key)
+    if client:
+        return client
+
+    with _client_lock:
+        if key not in _clients:
+            import boto3
+            from botocore.config import Config
+            global _session
+            if not _session:
+                _session = boto3.session.Session()
+            client = _session.client(
+                service, region_name=region, config=Config(**{**CLIENT_CONFIG, **config})
+            )
+            client.meta.events.register("after-call", _record_api_rate)
+            client.meta.events.register_first("before-call", _start_aws_span)
+            client.meta.events.register("after-call", _end_aws_span)
+            client.meta.events.register("after-call-error", _end_aws_span)
+            _clients[key] = client
+        return _clients[key]
 
 def account_context(context):
     vals = context.invoked_function_arn.split(':')
@@ -115,6 +427,139 @@ def account_context(context):
         "region": vals[3]
     }
 
+_current_span = contextvars.ContextVar("current_span", default=None)
+_active_tracer = None
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+class Tracer:
+    """Records timing spans for one invocation.
+
+    Spans nest through a context variable, so ops run by run_concurrently and
+    the AWS calls they make still point at the right parent span.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def start_span(self, name, kind, **attrs):
+        parent = _current_span.get()
+        span = {
+            "id": len(self.spans),
+            "parent": parent["id"] if parent else None,
+            "name": name,
+            "kind": kind,
+            "start_usec": current_epoch_time_usec_num(),
+            "duration_ms": None,
+            "outcome": None,
+            **attrs
+        }
+        span["_start"] = time.monotonic()
+        with self.lock:
+            span["id"] = len(self.spans)
+            self.spans.append(span)
+        return span
+
+    def end_span(self, span, outcome="ok", **attrs):
+        span["duration_ms"] = round((time.monotonic() - span.pop("_start")) * 1000, 2)
+        span["outcome"] = outcome
+        span.update(attrs)
+
+    def span(self, name, kind="op", **attrs):
+        import contextlib
+
+        @contextlib.contextmanager
+        def the_span():
+            span = self.start_span(name, kind, **attrs)
+            token = _current_span.set(span)
+            try:
+                yield span
+            except Exception as e:
+                span["outcome"] = type(e).__name__
+                raise
+            finally:
+                _current_span.reset(token)
+                self.end_span(span, span["outcome"] or "ok")
+
+        return the_span()
+
+    def stats(self):
+        durations = {}
+        for span in self.spans:
+            if span["duration_ms"] is not None:
+                durations.setdefault((span["kind"], span["name"]), []).append(span)
+        return {
+            key: {
+                "count": len(spans),
+                "total_ms": round(sum(s["duration_ms"] for s in spans), 2),
+                "p50_ms": percentile([s["duration_ms"] for s in spans], 50),
+                "p95_ms": percentile([s["duration_ms"] for s in spans], 95),
+                "retries": sum(s.get("retries") or 0 for s in spans),
+                "errors": len([s for s in spans if s["outcome"] != "ok"])
+            } for key, spans in durations.items()
+        }
+
+    def summary(self):
+        """A compact per-op and per-AWS-operation timing summary"""
+        summary = {"total_ms": round((time.monotonic() - self.started) * 1000, 2)}
+        for (kind, name), stats in self.stats().items():
+            summary.setdefault(kind, {})[name] = stats
+        summary["spans"] = [
+            [s["id"], s["parent"], s["name"], s["duration_ms"], s["outcome"]] for s in self.spans
+        ]
+        return summary
+
+    def emit_emf(self, namespace="CloudKommand/Extensions"):
+        """Prints p50/p95 latency per op in CloudWatch Embedded Metric Format.
+
+        Lambda ships stdout to CloudWatch Logs, which turns these lines into
+        metrics, so no network call is needed.
+        """
+        function_name = lambda_env("AWS_LAMBDA_FUNCTION_NAME") or "local"
+        for (kind, name), stats in self.stats().items():
+            print(json.dumps({
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": namespace,
+                        "Dimensions": [["Extension", "Kind", "Op"]],
+                        "Metrics": [
+                            {"Name": "LatencyP50", "Unit": "Milliseconds"},
+                            {"Name": "LatencyP95", "Unit": "Milliseconds"},
+                            {"Name": "Count", "Unit": "Count"}
+                        ]
+                    }]
+                },
+                "Extension": function_name,
+                "Kind": kind,
+                "Op": name,
+                "LatencyP50": stats["p50_ms"],
+                "LatencyP95": stats["p95_ms"],
+                "Count": stats["count"]
+            }))
+
+def _start_aws_span(model=None, context=None, **kwargs):
+    if _active_tracer and context is not None:
+        context["ck_span"] = _active_tracer.start_span(
+            f"{model.service_model.service_name}.{model.name}", "aws", aws_operation=model.name
+        )
+
+def _end_aws_span(context=None, parsed=None, exception=None, **kwargs):
+    span = (context or {}).pop("ck_span", None)
+    if not span or not _active_tracer:
+        return
+    if exception is not None:
+        outcome = type(exception).__name__
+    else:
+        outcome = ((parsed or {}).get("Error") or {}).get("Code") or "ok"
+    retries = ((parsed or {}).get("ResponseMetadata") or {}).get("RetryAttempts") or 0
+    _active_tracer.end_span(span, outcome, retries=retries)
+
 def gen_log(title, details, is_error=False, link=None):
     return {
         "title": title,
@@ -128,6 +573,65 @@ def defaultconverter(o):
     if isinstance(o, datetime.datetime):
         return o.__str__()
 
+def jsonable(o):
+    """Returns o with datetimes turned into strings, without a dumps/loads round trip"""
+    if isinstance(o, dict):
+        return {k if isinstance(k, str) else str(k): jsonable(v) for k, v in o.items()}
+    elif isinstance(o, (list, tuple)):
+        return [jsonable(v) for v in o]
+    elif o is None or isinstance(o, (str, int, float, bool)):
+        return o
+    return defaultconverter(o)
+
+def jsonable_with_size(o):
+    """Like jsonable, but also returns roughly how many bytes o serializes to"""
+    if isinstance(o, dict):
+        converted, size = {}, 2
+        for k, v in o.items():
+            k = k if isinstance(k, str) else str(k)
+            converted[k], vsize = jsonable_with_size(v)
+            size += len(k) + vsize + 4
+        return converted, size
+    elif isinstance(o, (list, tuple)):
+        converted, size = [], 2
+        for v in o:
+            cv, vsize = jsonable_with_size(v)
+            converted.append(cv)
+            size += vsize + 2
+        return converted, size
+    elif isinstance(o, str):
+        return o, len(o) + 2
+    elif o is None or isinstance(o, (int, float, bool)):
+        return o, len(str(o))
+    o = defaultconverter(o)
+    return o, len(str(o)) + 2
+
+def summarize_details(details, max_str=256):
+    """Keeps the shape of oversized log details but not their bulk"""
+    if not isinstance(details, dict):
+        return f"<{type(details).__name__}>"
+    summary = {}
+    for k, v in details.items():
+        if isinstance(v, dict):
+            summary[k] = f"<dict with {len(v)} keys>"
+        elif isinstance(v, (list, tuple)):
+            summary[k] = f"<list of {len(v)} items>"
+        elif isinstance(v, str) and len(v) > max_str:
+            summary[k] = v[:max_str] + f"... <{len(v)} chars>"
+        else:
+            summary[k] = v
+    return summary
+
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "ERROR": 40}
+# How much goes to stdout; logs returned to CloudKommand are not affected
+PRINT_LEVEL = LOG_LEVELS.get((lambda_env("log_level") or "INFO").upper(), LOG_LEVELS["INFO"])
+
+def debug(message):
+    """Prints message at DEBUG. message may be a function returning it, so
+    messages that format whole props or state are only built when printed."""
+    if PRINT_LEVEL <= LOG_LEVELS["DEBUG"]:
+        print(message() if callable(message) else message)
+
 def creturn(status_code, progress, success=None, error=None, logs=None, pass_back_data=None, state=None, props=None, links=None, callback_sec=2, error_details={}):
     
     assembled = remove_none_attributes({
@@ -143,28 +647,205 @@ def creturn(status_code, progress, success=None, error=None, logs=None, pass_bac
         "logs": logs,
         "callback_sec":callback_sec
     })
-    print(f'assembled = {assembled}')
+    # Logs are converted as they are added, so only the rest needs a pass here
+    logs = assembled.pop("logs", None)
+    assembled = jsonable(assembled)
+    if PRINT_LEVEL <= LOG_LEVELS["DEBUG"]:
+        print(f'assembled = {assembled}, logs = {logs}')
+    else:
+        print(f'assembled = {summarize_details(assembled)}, logs = <{len(logs or [])} entries>')
+    if logs is not None:
+        assembled["logs"] = logs
+    return assembled
+
+THROTTLING_ERROR_CODES = [
+    "Throttling", "ThrottlingException", "ThrottledException", "TooManyRequestsException",
+    "RequestLimitExceeded", "RequestThrottled", "RequestThrottledException",
+    "ProvisionedThroughputExceededException", "SlowDown"
+]
+TRANSIENT_ERROR_CODES = [
+    "RequestTimeout", "RequestTimeoutException", "InternalError", "InternalFailure",
+    "InternalServerError", "ServiceUnavailable", "ServiceUnavailableException"
+]
+CONFLICT_ERROR_CODES = [
+    "ResourceConflictException", "ConflictException", "OperationAbortedException",
+    "ResourceInUseException"
+]
+
+# (base, cap) callback delays in seconds, by error code
+ERROR_CODE_DELAYS = {
+    **{code: (5, 300) for code in THROTTLING_ERROR_CODES},
+    **{code: (2, 60) for code in TRANSIENT_ERROR_CODES},
+    **{code: (3, 90) for code in CONFLICT_ERROR_CODES}
+}
+
+class RateEstimator:
+    """Estimates the request rate an API will accept, across warm invocations.
+
+    The estimate grows additively with every successful call and halves on
+    every throttle. A token bucket refilled at the estimated rate says how long
+    a caller should wait before its next call is likely to succeed. The bucket
+    never goes below empty, so a burst of throttles lowers the rate but does
+    not pile up a debt every later caller has to wait out.
+    """
+
+    def __init__(self, initial_rate=10.0, min_rate=0.2, max_rate=100.0, increase=0.5, clock=time.monotonic):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.clock = clock
+        self.tokens = initial_rate
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def record_success(self):
+        with self.lock:
+            self._refill()
+            self.tokens = max(0, self.tokens - 1)
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def record_throttle(self):
+        with self.lock:
+            self._refill()
+            self.tokens = max(0, self.tokens - 1)
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def wait_time(self):
+        """Seconds until the bucket holds a token again"""
+        with self.lock:
+            self._refill()
+            return max(0, (1 - self.tokens) / self.rate)
+
+# Keyed by service name, kept for the life of the container
+rate_estimators = {}
+
+def get_rate_estimator(service):
+    if service not in rate_estimators:
+        rate_estimators[service] = RateEstimator()
+    return rate_estimators[service]
 
-    return json.loads(json.dumps(assembled, default=defaultconverter))
+def _record_api_rate(http_response=None, parsed=None, model=None, **kwargs):
+    service = model.service_model.service_name if model else None
+    if not service:
+        return
+    code = ((parsed or {}).get("Error") or {}).get("Code")
+    if code in THROTTLING_ERROR_CODES:
+        get_rate_estimator(service).record_throttle()
+    elif not code:
+        get_rate_estimator(service).record_success()
 
-def handle_common_errors(error, extension_handler, text, progress, perm_errors=[]):
-    if error.response['Error']['Code'] in perm_errors:
-        extension_handler.add_log(f"{text}: {error.response['Error']['Code']}", {"error": str(error)}, True)
+class BackoffPolicy:
+    """Computes callback delays for retried errors.
+
+    strategy is one of:
+      "full": uniform between 0 and min(cap, base * 2**(attempt-1))
+      "decorrelated": uniform between base and min(cap, 3 * previous delay)
+      "exponential": min(cap, base * 2**(attempt-1)) with no jitter
+    Base delays and caps come from ERROR_CODE_DELAYS, overridable per code.
+    A Retry-After hint from the service is honored as a lower bound. With
+    rate_floor, throttled calls also wait at least as long as the service's
+    RateEstimator says, jittered so callers given the same wait do not all
+    come back together. It is off by default, as jittered backoff alone
+    converges as fast or faster in tools/bench_throttling.py.
+    """
+
+    def __init__(self, strategy="full", base=2, cap=120, error_code_delays=None, rng=None, rate_floor=False):
+        if strategy not in ["full", "decorrelated", "exponential"]:
+            raise Exception(f"Unknown backoff strategy {strategy}")
+        self.strategy = strategy
+        self.base = base
+        self.cap = cap
+        self.error_code_delays = {**ERROR_CODE_DELAYS, **(error_code_delays or {})}
+        self.rng = rng or random.Random()
+        self.rate_floor = rate_floor
+
+    def delay(self, attempt, error_code=None, prev_delay=None, retry_after=None, service=None):
+        base, cap = self.error_code_delays.get(error_code, (self.base, self.cap))
+        ceiling = min(cap, base * 2 ** max(attempt - 1, 0))
+        if self.strategy == "full":
+            delay = self.rng.uniform(0, ceiling)
+        elif self.strategy == "decorrelated":
+            delay = self.rng.uniform(base, min(cap, max(prev_delay or base, base) * 3))
+        else:
+            delay = ceiling
+
+        if retry_after:
+            delay = max(delay, retry_after)
+        if self.rate_floor and service and error_code in THROTTLING_ERROR_CODES:
+            wait = get_rate_estimator(service).wait_time()
+            if wait > delay:
+                delay = self.rng.uniform(wait, 2 * wait)
+        return max(1, int(round(delay)))
+
+def retry_after_hint(error):
+    """Returns the Retry-After header of a ClientError in seconds, if any"""
+    headers = error.response.get("ResponseMetadata", {}).get("HTTPHeaders") or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def handle_common_errors(error, extension_handler, text, progress, perm_errors=[], service=None):
+    code = error.response['Error']['Code']
+    if code in perm_errors:
+        extension_handler.add_log(f"{text}: {code}", {"error": str(error)}, True)
         extension_handler.perm_error(f"{text}: {str(error)}", progress)
         print(f"Permanent Error: {text}: {str(error)}")
     else:
-        extension_handler.add_log(f"{text}: {error.response['Error']['Code']}", {"error": str(error)}, True)
-        extension_handler.retry_error(f"{text}: {str(error)}", progress)
+        extension_handler.add_log(f"{text}: {code}", {"error": str(error)}, True)
+        extension_handler.retry_error(
+            f"{text}: {str(error)}", progress, error_code=code,
+            retry_after=retry_after_hint(error), service=service
+        )
         print(f"Retry Error: {text}: {str(error)}")
 
 
+INVOKE_EXTENSION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "arn": {"type": "string"},
+        "component_def": {"type": "object"},
+        "child_key": {"type": "string"},
+        "progress_start": {"type": "number"},
+        "progress_end": {"type": "number"},
+        "object_name": {"type": ["string", "null"]},
+        "op": {"type": ["string", "null"]},
+        "merge_props": {"type": ["boolean", "null"]},
+        "links_prefix": {"type": ["string", "null"]},
+        "ignore_props_links": {"type": ["boolean", "null"]},
+        "synchronous": {"type": ["boolean", "null"]},
+        "timeout": {"type": ["number", "null"]}
+    },
+    "required": ["arn", "component_def", "child_key", "progress_start", "progress_end"]
+}
+
+_invoke_extension_validator = None
+
+def validate_invoke_extension_params(params):
+    # Compiling the schema is far more expensive than running it, so only do it once
+    global _invoke_extension_validator
+    if not _invoke_extension_validator:
+        import fastjsonschema
+        _invoke_extension_validator = fastjsonschema.compile(INVOKE_EXTENSION_SCHEMA)
+    return _invoke_extension_validator(params)
+
 # def sort_f(td):
 #     return td['timestamp_usec']
 
 class ExtensionHandler:
 
     def refresh(self):
+        global _active_tracer
+        self.tracer = _active_tracer = Tracer()
         self.logs = []
+        self.log_bytes = 0
+        self.log_link = None
         self.ops = {}
         self.retries = {}
         self.ret = False
@@ -178,6 +859,11 @@ class ExtensionHandler:
         self.state = {}
         self.callback = None
         self.error_details = None
+        self.error_code = None
+        self.retry_after = None
+        self.error_service = None
+        self.waiting = False
+        self.prev_callback_sec = None
         self.children = {}
         self.op = None
         self.project_code = None
@@ -185,10 +871,17 @@ class ExtensionHandler:
         self.bucket = None
         self.component_name = None
     
-    def __init__(self, ignore_undeclared_return=True, max_retries_per_error_code=6):
+    def __init__(self, ignore_undeclared_return=True, max_retries_per_error_code=6, backoff_policy=None,
+            log_budget_bytes=1000000, log_detail_max_bytes=32768):
+        self.log_budget_bytes = log_budget_bytes
+        self.log_detail_max_bytes = log_detail_max_bytes
         self.refresh()
         self.ignore_undelared_return = ignore_undeclared_return
         self.max_retries_per_error_code = max_retries_per_error_code
+        self.backoff_policy = backoff_policy or BackoffPolicy()
+        # Per-thread record of whether the running op declared a return,
+        # so ops run by run_concurrently complete independently
+        self.op_state = threading.local()
 
     def capture_event(self, event):
         self.refresh()
@@ -207,146 +900,194 @@ class ExtensionHandler:
         self.props = pbd.pop("props", {}) or {}
         self.links = pbd.pop("links", {}) or {}
         self.state = pbd.pop("state", {}) or {}
-        print(f"Ops = {self.ops}, Retries = {self.retries}, Links = {self.links}, Props = {self.props}")
+        self.prev_callback_sec = pbd.pop("last_callback_sec", None)
+        print(f"Ops = {self.ops}, Retries = {self.retries}")
+        self.debug(lambda: f"Links = {self.links}, Props = {self.props}")
         self.children = pbd
         if pbd:
-            print(f"Set Children {self.children}")
+            self.debug(lambda: f"Set Children {self.children}")
 
     def invoke_extension(self, arn, component_def, child_key, 
             progress_start, progress_end, object_name=None, 
             op=None, merge_props=False, links_prefix=None,
-            ignore_props_links=False, synchronous=True):
-
-        schema = {
-            "type": "object",
-            "properties": {
-                "arn": {"type": "string"},
-                "component_def": {"type": "object"},
-                "child_key": {"type": "string"},
-                "progress_start": {"type": "number"},
-                "progress_end": {"type": "number"},
-                "object_name": {"type": ["string", "null"]},
-                "op": {"type": ["string", "null"]},
-                "merge_props": {"type": ["boolean", "null"]},
-                "links_prefix": {"type": ["string", "null"]},
-                "ignore_props_links": {"type": ["boolean", "null"]},
-                "synchronous": {"type": ["boolean", "null"]}
-            },
-            "required": ["arn", "component_def", "child_key", "progress_start", "progress_end"]
-        }
+            ignore_props_links=False, synchronous=True, timeout=None):
+
+        return self.invoke_extensions([{
+            "arn": arn,
+            "component_def": component_def,
+            "child_key": child_key,
+            "progress_start": progress_start,
+            "progress_end": progress_end,
+            "object_name": object_name,
+            "op": op,
+            "merge_props": merge_props,
+            "links_prefix": links_prefix,
+            "ignore_props_links": ignore_props_links,
+            "synchronous": synchronous,
+            "timeout": timeout
+        }])
+
+    def invoke_extensions(self, children, max_workers=8):
+        """Invokes several child extensions at once on a bounded thread pool.
+
+        children is a list of dicts holding the keyword arguments of
+        invoke_extension, including an optional per-invoke timeout in seconds.
+        Results are merged in list order, so logs, props, links and child
+        pass back data come out the same whichever child finishes first.
+        Progress is aggregated across the children's progress ranges. Returns
+        True only if every child succeeded.
+        """
+        calls = [self._prepare_child_invoke(child) for child in children]
+
+        if len(calls) == 1:
+            outcomes = [self._invoke_child(calls[0])]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as pool:
+                # Copy the context so each invoke's spans nest under the caller's span
+                contexts = [contextvars.copy_context() for _ in calls]
+                outcomes = list(pool.map(lambda ctx, call: ctx.run(self._invoke_child, call), contexts, calls))
+
+        merged = [self._merge_child_outcome(call, outcome) for call, outcome in zip(calls, outcomes)]
 
+        progress = int(min(c["progress_start"] for c in calls) + sum(
+            fraction * (c["progress_end"] - c["progress_start"]) for c, (_, fraction, _, _, _) in zip(calls, merged)
+        ))
+        perm_errors = [m for m in merged if m[0] == "perm"]
+        retry_errors = [m for m in merged if m[0] == "retry"]
+        if perm_errors:
+            self.perm_error("; ".join(m[2] for m in perm_errors), progress)
+            return False
+        elif retry_errors:
+            callback_secs = [m[3] for m in retry_errors if m[3]]
+            self.retry_error(
+                "; ".join(m[2] for m in retry_errors), progress,
+                callback_sec=min(callback_secs) if callback_secs else 0,
+                error_code=retry_errors[0][4], service="lambda"
+            )
+            return False
+        return True
+
+    def _prepare_child_invoke(self, child):
+        params = {
+            "object_name": None, "op": None, "merge_props": False, "links_prefix": None,
+            "ignore_props_links": False, "synchronous": True, "timeout": None,
+            **child
+        }
         try:
-            fastjsonschema.validate(schema, {
-                "arn": arn,
-                "component_def": component_def,
-                "child_key": child_key,
-                "progress_start": progress_start,
-                "progress_end": progress_end,
-                "object_name": object_name,
-                "op": op,
-                "merge_props": merge_props,
-                "links_prefix": links_prefix,
-                "ignore_props_links": ignore_props_links,
-                "synchronous": synchronous
-            })
+            validate_invoke_extension_params(params)
         except:
             raise Exception("Invalid invoke_extension parameters")
 
-        if merge_props:
+        if params["merge_props"]:
             raise Exception("Cannot Merge Props")
-        if child_key in ['ops', 'retries', 'props', 'links']:
-            raise Exception(f"Child key cannot be set to {child_key}. Please choose another key")
-        
-        l_client = boto3.client("lambda")
-        child_key = child_key or arn
-        op = op or self.op
-        
-        payload = bytes(json.dumps(remove_none_attributes({
-            "component_def": component_def,
+        if params["child_key"] in ['ops', 'retries', 'props', 'links', 'state', 'last_retry', 'last_callback_sec']:
+            raise Exception(f"Child key cannot be set to {params['child_key']}. Please choose another key")
+
+        child_key = params["child_key"] = params["child_key"] or params["arn"]
+        op = params["op"] = params["op"] or self.op
+
+        params["payload"] = bytes(json.dumps(remove_none_attributes({
+            "component_def": params["component_def"],
             "component_name": self.component_name,
             "op": op,
-            "s3_object_name": object_name,
+            "s3_object_name": params["object_name"],
             "pass_back_data": self.children.get(child_key),
             "prev_state": {"props": self.props.get(child_key)} if self.props.get(child_key) else None,
             "bucket": self.bucket,
             "repo_id": self.repo_id,
             "project_code": self.project_code
         })), "utf-8")
+        return params
 
-        ################################
-        # NEED TIMER ON THIS
-        ################################
+    def _invoke_child(self, call):
+        """Runs in a worker thread, so it only talks to Lambda and never touches self"""
+        with self.tracer.span(f"invoke {call['child_key']}", "child"):
+            return self._invoke_child_lambda(call)
+
+    def _invoke_child_lambda(self, call):
+        if call["timeout"]:
+            l_client = get_client(
+                "lambda", read_timeout=call["timeout"],
+                retries={"mode": "standard", "total_max_attempts": 1}
+            )
+        else:
+            l_client = get_client("lambda")
 
         try:
             response = l_client.invoke(
-                FunctionName=arn,
-                InvocationType="RequestResponse" if synchronous else "Event",
+                FunctionName=call["arn"],
+                InvocationType="RequestResponse" if call["synchronous"] else "Event",
                 LogType="None",
-                Payload=payload
+                Payload=call["payload"]
             )
+        except botocore.exceptions.ClientError as e:
+            return {"client_error": e}
+        except botocore.exceptions.ReadTimeoutError as e:
+            return {"timeout": str(e)}
+
+        if response.get("StatusCode") not in [200,202,204]:
+            print(f'Error = {response["Payload"].read()}')
+            raise Exception(f'Function Error = {response.get("FunctionError")}')
+
+        if not call["synchronous"]:
+            return {}
+        result = json.loads(response["Payload"].read())
+        debug(lambda: f"Invoke Result = {result}")
+        return {"result": result}
+
+    def _merge_child_outcome(self, call, outcome):
+        """Returns (status, progress fraction, error, callback_sec, error_code)"""
+        child_key = call["child_key"]
+
+        if outcome.get("client_error"):
+            e = outcome["client_error"]
+            code = e.response['Error']['Code']
+            self.add_log(f"Error Invoking {child_key}", {"error": str(e)}, True)
+            self.add_log(code, {"error": str(e)}, True)
+            if code in ["ResourceNotFoundException", "InvalidRequestContentException", "RequestTooLargeException"]:
+                return ("perm", 0, str(e), 0, code)
+            return ("retry", 0, str(e), 0, code)
 
-            if response.get("StatusCode") not in [200,202,204]:
-                print(f'Error = {response["Payload"].read()}')
-                raise Exception(f'Function Error = {response.get("FunctionError")}')
-
-            if synchronous:
-                result = json.loads(response["Payload"].read())
-                print(f"Invoke Result = {result}")
-
-                logs = result.get("logs") or []
-                progress = result.get("progress") or 0
-                success = result.get("success")
-                error = result.get("error")
-                props = result.get("props") or {}
-                # state = result.get("state") Not Handling child state ATM
-                links = result.get("links") or {}
-                
-                true_progress = int(progress_start + (progress/100 * (progress_end - progress_start)))
-                self.logs.extend(logs)
-                if error:
-                    self.perm_error(error, true_progress)
-                    return False
+        if outcome.get("timeout"):
+            self.add_log(f"Timed Out Invoking {child_key}", {"error": outcome["timeout"], "timeout": call["timeout"]}, True)
+            return ("retry", 0, f"{child_key} timed out after {call['timeout']} seconds", 0, "RequestTimeout")
+
+        if "result" not in outcome:
+            return ("ok", 1, None, 0, None)
+
+        result = outcome["result"]
+        logs = result.get("logs") or []
+        fraction = (result.get("progress") or 0) / 100
+        success = result.get("success")
+        error = result.get("error")
+        props = result.get("props") or {}
+        # state = result.get("state") Not Handling child state ATM
+        links = result.get("links") or {}
+
+        self.logs.extend(logs)
+        if error:
+            return ("perm", fraction, error, 0, None)
+
+        if call["op"] == "upsert" and not call["ignore_props_links"]:
+            if call["links_prefix"]:
+                links = {f"{call['links_prefix']} {k}":v for k,v in links.items()} 
+            self.links.update(links)
+            if props:
+                if isinstance(self.props.get(child_key), dict):
+                    self.props[child_key].update(props)
                 else:
-                    if op == "upsert":
-                        if not ignore_props_links:
-                            if links_prefix:
-                                links = {f"{links_prefix} {k}":v for k,v in links.items()} 
-                            self.links.update(links)
-                            if props:
-                                if isinstance(self.props.get(child_key), dict):
-                                    self.props[child_key].update(props)
-                                else:
-                                    self.props[child_key] = props
-                                if merge_props:
-                                    self.props.update(props)
-
-                    if not success:
-                        pass_back_data = result.get("pass_back_data") or {}
-                        self.children[child_key] = pass_back_data
-                        self.retry_error(f'{child_key} {pass_back_data.get("last_retry")}', true_progress, callback_sec=result['callback_sec'])
-                        proceed=False
-
-                    else:
-                        if child_key in self.children:
-                            del self.children[child_key]
-                        proceed= True
-            else:
-                proceed=True
+                    self.props[child_key] = props
 
-        except botocore.exceptions.ClientError as e:
-            proceed=False
-            if e.response['Error']['Code'] in ["ResourceNotFoundException", "InvalidRequestContentException", "RequestTooLargeException"]:
-                self.add_log(f"Error Invoking {child_key}", {"error": str(e)}, True)
-                self.add_log(e.response['Error']['Code'], {"error": str(e)}, True)
-                self.perm_error(str(e), progress_start)
-            else:
-                self.add_log(f"Error Invoking {child_key}", {"error": str(e)}, True)
-                self.add_log(e.response['Error']['Code'], {"error": str(e)}, True)
-                self.retry_error(str(e), progress_start)
-        
-        return proceed
+        if not success:
+            pass_back_data = result.get("pass_back_data") or {}
+            self.children[child_key] = pass_back_data
+            return ("retry", fraction, f'{child_key} {pass_back_data.get("last_retry")}', result['callback_sec'], None)
+
+        if child_key in self.children:
+            del self.children[child_key]
+        return ("ok", 1, None, 0, None)
 
-        
     def add_op(self, opkey, opvalue=True):
         print(f'add op {opkey} with value {opvalue}')
         self.ops[opkey] = opvalue
@@ -375,16 +1116,51 @@ class ExtensionHandler:
         return self.links
         
     def add_log(self, title, details={}, is_error=False):
-        link = gen_log_link()
-        print(f"{title}: {details}")
-        self.logs.append(gen_log(title, details, is_error, link))
+        """Adds a log entry, keeping the invocation's logs within budget.
+
+        Details bigger than log_detail_max_bytes, or that would push the
+        invocation past log_budget_bytes, are replaced by a summary.
+        """
+        if not self.log_link:
+            self.log_link = gen_log_link()
+
+        details, size = jsonable_with_size(details)
+        if size > self.log_detail_max_bytes or self.log_bytes + size > self.log_budget_bytes:
+            if self.log_bytes + 1024 > self.log_budget_bytes:
+                details = {"truncated": True, "size_bytes": size}
+            else:
+                details = {"truncated": True, "size_bytes": size, "summary": summarize_details(details)}
+            _, size = jsonable_with_size(details)
+        self.log_bytes += size
+
+        if PRINT_LEVEL <= LOG_LEVELS["DEBUG"] or (is_error and PRINT_LEVEL <= LOG_LEVELS["ERROR"]):
+            print(f"{title}: {details}")
+        elif PRINT_LEVEL <= LOG_LEVELS["INFO"]:
+            print(title)
+        self.logs.append(gen_log(title, details, is_error, self.log_link))
+
+    def debug(self, message):
+        debug(message)
 
     def perm_error(self, error, progress=0):
         return self.declare_return(200, progress, error_code=error, callback=False)
 
-    def retry_error(self, error, progress=0, callback_sec=0):
+    def retry_error(self, error, progress=0, callback_sec=0, error_code=None, retry_after=None, service=None):
+        """error_code, retry_after and service feed the backoff policy when no callback_sec is given"""
+        self.error_code = error_code
+        self.retry_after = retry_after
+        self.error_service = service
         return self.declare_return(200, progress, error_code=error, callback_sec=callback_sec)
 
+    def wait(self, reason, progress=0, callback_sec=5):
+        """Calls back after callback_sec to check on something still in progress.
+
+        Unlike retry_error, waiting does not count against the retry limit,
+        so long-running work such as a build can be polled until it ends.
+        """
+        self.waiting = True
+        return self.declare_return(200, progress, error_code=reason, callback_sec=max(1, int(callback_sec)))
+
     def declare_return(self, status_code, progress, success=None, props=None, links=None, error_code=None, error_details=None, callback=True, callback_sec=0):
         print(f"Calling back to CK, success = {success}, error_code = {error_code}")
         self.status_code = status_code
@@ -397,25 +1173,32 @@ class ExtensionHandler:
         self.callback_sec = callback_sec
         self.error_details = error_details
         self.ret = True
+        self.op_state.declared_return = True
         
     def finish(self):
         pass_back_data = {}
         if self.error:
             pass_back_data['ops'] = self.ops
             pass_back_data['retries'] = self.retries
-            this_retries = pass_back_data['retries'].get(self.error, 0) + 1
-            pass_back_data['retries'][self.error] = this_retries
+            this_retries = pass_back_data['retries'].get(self.error, 0)
+            if not self.waiting:
+                this_retries += 1
+                pass_back_data['retries'][self.error] = this_retries
             pass_back_data['props'] = self.props
             pass_back_data['links'] = self.links
             pass_back_data['state'] = self.state
             if self.children:
                 pass_back_data.update(self.children)
-            if this_retries < self.max_retries_per_error_code and self.callback:
+            if (self.waiting or this_retries < self.max_retries_per_error_code) and self.callback:
                 pass_back_data['last_retry'] = self.error
                 self.error = None
                 self.error_details = None
                 if not self.callback_sec:
-                    self.callback_sec = 2**this_retries                
+                    self.callback_sec = self.backoff_policy.delay(
+                        this_retries, self.error_code, self.prev_callback_sec,
+                        self.retry_after, self.error_service
+                    )
+                pass_back_data['last_callback_sec'] = self.callback_sec
 
         elif not self.success and not self.ignore_undelared_return:
             self.error = "no_success_or_error"
@@ -426,6 +1209,11 @@ class ExtensionHandler:
             self.progress=100
 
 #       self.logs.sort(key=sort_f, reverse=True)
+
+        if self.tracer.spans:
+            self.add_log("Timing Summary", self.tracer.summary())
+            if lambda_env("emit_latency_metrics"):
+                self.tracer.emit_emf()
             
         return creturn(
             self.status_code, self.progress, self.success, self.error, self.logs, 
@@ -458,14 +1246,47 @@ def ext(f=None, handler=None, op=None, complete_op=True):
         except:
             raise Exception(f"Must pass handler of type ExtensionHandler to ext decorator")
 
-        result = f(*args, **kwargs)
-        if complete_op and not handler.ret:
+        handler.op_state.declared_return = False
+        with handler.tracer.span(op or f.__name__, "op", attempt=sum(handler.retries.values())) as span:
+            result = f(*args, **kwargs)
+            if handler.op_state.declared_return:
+                span["outcome"] = "error" if handler.error else "returned"
+        if complete_op and not handler.op_state.declared_return:
             handler.complete_op(op)
         return result
 
     return the_wrapper_around_the_original_function
 
+def run_concurrently(calls, max_concurrency=4):
+    """Runs independent @ext ops at the same time on an asyncio event loop.
+
+    calls is a list of (function, args) pairs, and each function runs in a
+    worker thread, at most max_concurrency at a time. Ops keep their normal
+    semantics: one that declares an error stays in handler.ops for the retry,
+    while ops that finished cleanly are completed. Ops that have not started
+    when another op errors are skipped, as they would be when run in order.
+    """
+    import asyncio
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(f, args):
+            async with semaphore:
+                return await asyncio.to_thread(f, *args)
+
+        return await asyncio.gather(*[run_one(f, args) for f, args in calls], return_exceptions=True)
+
+    results = asyncio.run(run_all())
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
 def gen_log_link():
+    """Links to this invocation's logs, or None outside of Lambda"""
+    if not lambda_env("AWS_LAMBDA_LOG_STREAM_NAME") or not lambda_env("AWS_LAMBDA_FUNCTION_NAME"):
+        return None
     log_event_encoded = quote(quote(lambda_env("AWS_LAMBDA_LOG_STREAM_NAME"), safe=''), safe='').replace("%", "$")
     region = lambda_env("AWS_DEFAULT_REGION")
     # Get milliseconds since epoch
@@ -0,0 +1,103 @@
+"""Resolves the CodeBuild container image for a set of runtime versions.
+
+The image catalog lives in images.json so it can be refreshed without code
+changes. It can be scraped from
+https://docs.aws.amazon.com/codebuild/latest/userguide/build-env-ref-available.html
+
+At import time the catalog is turned into an inverted index from runtime
+token (e.g. "python3.9") to a bitset of the images that support it, so a
+lookup is one AND per requested runtime.
+"""
+import json
+import os
+import functools
+
+from extutil import remove_none_attributes
+
+IMAGES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images.json")
+
+def runtime_tokens(runtime_versions):
+    """{"nodejs": 12, "python": 3.9} -> ("nodejs12", "python3.9")"""
+    return tuple(sorted(f"{k}{v}" for k, v in runtime_versions.items()))
+
+class ImageIndex:
+
+    def __init__(self, catalog):
+        self.version = catalog.get("version")
+        self.architecture_preference = catalog.get("architecture_preference") or []
+        self.family_preference = catalog.get("family_preference") or []
+
+        # Bit i stands for self.images[i], which is kept in preference order:
+        # preferred architecture, then preferred family, then newest release.
+        # Architecture comes first so an image never silently changes the
+        # CPU architecture of a build.
+        self.images = sorted(catalog["images"], key=lambda i: (i.get("released") or "", i["name"]), reverse=True)
+        self.images.sort(key=lambda i: (
+            self._rank(self.architecture_preference, i.get("architecture")),
+            self._rank(self.family_preference, i.get("family"))
+        ))
+        self.runtime_index = {}
+        self.compute_index = {}
+        self.architecture_index = {}
+        for position, image in enumerate(self.images):
+            for token in image["runtimes"]:
+                self.runtime_index[token] = self.runtime_index.get(token, 0) | (1 << position)
+            for index, value in [(self.compute_index, image.get("compute") or "container"), (self.architecture_index, image.get("architecture"))]:
+                index[value] = index.get(value, 0) | (1 << position)
+
+    @staticmethod
+    def _rank(preference, value):
+        return preference.index(value) if value in preference else len(preference)
+
+    def candidates(self, tokens, compute="container", architecture=None):
+        bits = self.compute_index.get(compute, 0)
+        if architecture:
+            bits &= self.architecture_index.get(architecture, 0)
+        for token in tokens:
+            bits &= self.runtime_index.get(token, 0)
+            if not bits:
+                break
+        return bits
+
+    def resolve(self, runtime_versions, compute="container", architecture=None):
+        """Returns the name of the preferred image supporting every runtime, or None.
+
+        compute is "container" or "lambda", and architecture optionally limits
+        the result to x86_64 or aarch64 images.
+        """
+        return self._resolve_tokens(runtime_tokens(runtime_versions), compute, architecture)
+
+    @functools.lru_cache(maxsize=1024)
+    def _resolve_tokens(self, tokens, compute, architecture):
+        bits = self.candidates(tokens, compute, architecture)
+        if not bits:
+            return None
+        # Lowest set bit is the most preferred image
+        return self.images[(bits & -bits).bit_length() - 1]["name"]
+
+    def explain(self, runtime_versions, compute="container", architecture=None):
+        """Says why each image was chosen or rejected for these runtime versions"""
+        tokens = runtime_tokens(runtime_versions)
+        bits = self.candidates(tokens, compute, architecture)
+        candidates = [img["name"] for i, img in enumerate(self.images) if bits >> i & 1]
+        return {
+            "catalog_version": self.version,
+            "runtimes": list(tokens),
+            "unknown_runtimes": [t for t in tokens if t not in self.runtime_index],
+            "chosen": candidates[0] if candidates else None,
+            "candidates_in_preference_order": candidates,
+            "rejected": {
+                img["name"]: remove_none_attributes({
+                    "missing_runtimes": [t for t in tokens if t not in img["runtimes"]] or None,
+                    "compute": img.get("compute") if (img.get("compute") or "container") != compute else None,
+                    "architecture": img.get("architecture") if architecture and img.get("architecture") != architecture else None
+                })
+                for i, img in enumerate(self.images) if not bits >> i & 1
+            }
+        }
+
+def load_index(path=IMAGES_FILE):
+    with open(path) as f:
+        return ImageIndex(json.load(f))
+
+IMAGE_INDEX = load_index()
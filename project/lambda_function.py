@@ -1,80 +1,220 @@
-import boto3
 import botocore
 # import jsonschema
 import json
 import traceback
-import zipfile
-import os
+import datetime
 import hashlib
+from urllib.parse import quote
 
 from botocore.exceptions import ClientError
 
 from extutil import remove_none_attributes, account_context, ExtensionHandler, ext, \
     current_epoch_time_usec_num, component_safe_name, lambda_env, random_id, \
-    handle_common_errors, create_zip
+    handle_common_errors, TTLCache, get_client, run_concurrently
+from naming import find_name_collisions
+from drift import diff_project, reset_values, changed_sections, update_payload, stamp_applied, applied_snapshot
+from images import IMAGE_INDEX
+from buildspec import render_buildspec, buildspec_digest, buildspec_fields, validate_batch, batch_fan_out
+from sizing import recommend, record_build
+from sources import resolve_secondary_sources, resolve_secondary_artifacts, artifact_location
+from webhooks import compile_webhook, webhook_op
+from reports import resolve_report_groups, buildspec_reports, report_group_ops
+from network import resolve_vpc_config, resolve_file_system_locations, resolve_concurrent_build_limit
+from environment import ENVIRONMENT_TYPES, GENERAL_COMPUTE_TYPES, LAMBDA_COMPUTE_TYPES, DEFAULT_COMPUTE_TYPES, \
+    environment_info, is_lambda_compute, infer_environment_type, validate_environment, build_environment
 
 eh = ExtensionHandler()
 
-codebuild = boto3.client('codebuild')
+# Project descriptions fetched by this warm container, keyed by (region, name).
+# A value of None records that the project did not exist.
+project_cache = TTLCache(
+    maxsize=int(lambda_env("project_cache_size") or 512),
+    ttl=float(lambda_env("project_cache_ttl_sec") or 30)
+)
+NOT_CACHED = object()
 
 ## REFER TO
 ## https://docs.aws.amazon.com/codebuild/latest/userguide/available-runtimes.html
 ## for a list of available runtimes and their matching images
 
+# The most names batch_get_projects accepts in a single call
+BATCH_GET_PROJECTS_LIMIT = 100
+
+# How many of the most recent builds to read when build_container_size is "auto"
+BUILD_HISTORY_SAMPLE = 10
+
+# The most ids batch_get_builds accepts in a single call
+BATCH_GET_BUILDS_LIMIT = 100
+
+# The most ARNs batch_get_report_groups accepts in a single call
+BATCH_GET_REPORT_GROUPS_LIMIT = 100
+
+# Build phases in the order CodeBuild runs them, with how often to check on a
+# build in each. Short phases are checked often, long ones less so.
+BUILD_PHASE_CALLBACK_SEC = {
+    "SUBMITTED": 2,
+    "QUEUED": 5,
+    "PROVISIONING": 5,
+    "DOWNLOAD_SOURCE": 3,
+    "INSTALL": 10,
+    "PRE_BUILD": 10,
+    "BUILD": 15,
+    "POST_BUILD": 10,
+    "UPLOAD_ARTIFACTS": 3,
+    "FINALIZING": 2,
+    "COMPLETED": 2
+}
+BUILD_PHASES = list(BUILD_PHASE_CALLBACK_SEC)
+MAX_BUILD_CALLBACK_SEC = 60
+
+LOCAL_CACHE_MODES = ["LOCAL_DOCKER_LAYER_CACHE", "LOCAL_SOURCE_CACHE", "LOCAL_CUSTOM_CACHE"]
+
+# Where each runtime's package manager keeps its downloads, by runtime_versions key
+DEFAULT_CACHE_PATHS = {
+    "nodejs": ["/root/.npm/**/*"],
+    "python": ["/root/.cache/pip/**/*"],
+    "java": ["/root/.m2/**/*", "/root/.gradle/caches/**/*", "/root/.gradle/wrapper/**/*"],
+    "golang": ["/go/pkg/mod/**/*", "/root/.cache/go-build/**/*"],
+    "dotnet": ["/root/.nuget/packages/**/*"],
+    "php": ["/root/.composer/cache/**/*"]
+}
+
 def lambda_handler(event, context):
+    if event.get("components") is not None:
+        return batch_lambda_handler(event, context)
+    return reconcile_component(event, context)
+
+def batch_lambda_handler(event, context):
+    """Reconciles many components in a single invocation.
+
+    The event carries the shared fields (project_code, repo_id, bucket) and a
+    "components" list. Each entry holds what a single component event would:
+    component_name, component_def, op, prev_state and pass_back_data.
+    Current project state is fetched with batch_get_projects when the first
+    component needs it, and results are returned keyed by component_name.
+    """
+    print(f"batch event with {len(event['components'])} components")
+    shared = {k: v for k, v in event.items() if k != "components"}
+    component_events = [{**shared, **component} for component in event["components"]]
+
+    # Invalid name strategies are reported by reconcile_component. Any other
+    # failure fails just that component, so the rest of the batch still runs.
+    names, invalid = {}, {}
+    for ce in component_events:
+        try:
+            names[ce.get("component_name")] = resolve_project_name(ce)
+        except ValueError:
+            pass
+        except Exception as e:
+            invalid[ce.get("component_name")] = str(e)
+    collisions = find_name_collisions({
+        ce.get("component_name"): names[ce.get("component_name")] for ce in component_events
+        if ce.get("op") == "upsert" and ce.get("component_name") in names
+    })
+    colliding = {c: name for name, components in collisions.items() for c in components}
+
+    lookup_names = [
+        names[ce.get("component_name")] for ce in component_events
+        if needs_project_lookup(ce) and ce.get("component_name") in names
+    ]
+    region = account_context(context)['region']
+    known_projects = ProjectPrefetch(lookup_names, region)
+    pending_ops = [(ce.get("pass_back_data") or {}).get("ops") or {} for ce in component_events]
+    known_builds = {
+        **fetch_codebuild_builds([ops["check_build"] for ops in pending_ops if ops.get("check_build")]),
+        **fetch_codebuild_builds(
+            [ops["check_build_batch"] for ops in pending_ops if ops.get("check_build_batch")], build_batches=True
+        )
+    }
+
+    results = {}
+    for component_event in component_events:
+        cname = component_event.get("component_name")
+        if cname in invalid:
+            results[cname] = reject_component(component_event, "Invalid Component", {
+                "error": invalid[cname], "repo_id": component_event.get("repo_id")
+            })
+            continue
+        if cname in colliding:
+            results[cname] = reject_component(component_event, "Project Name Collision", {
+                "name": colliding[cname], "components": collisions[colliding[cname]]
+            })
+            continue
+        results[cname] = reconcile_component(component_event, context, known_projects, known_builds)
+        known_projects.discard(names.get(cname))
+
+    return {
+        "statusCode": 200,
+        "components": results
+    }
+
+def reconcile_component(event, context, known_projects=None, known_builds=None):
     try:
-        print(f"event = {event}")
+        eh.debug(lambda: f"event = {event}")
         account_number = account_context(context)['number']
         region = account_context(context)['region']
         eh.capture_event(event)
 
         prev_state = event.get("prev_state") or {}
-        project_code = event.get("project_code")
         repo_id = event.get("repo_id")
         cdef = event.get("component_def")
         cname = event.get("component_name")
 
-        name = cdef.get("name") or component_safe_name(
-            project_code, repo_id, cname, max_chars=255
-        )
+        try:
+            name = resolve_project_name(event)
+        except ValueError as e:
+            eh.add_log("Invalid Name Strategy", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Name Strategy: {str(e)}", 0)
+            return eh.finish()
         trust_level = cdef.get("trust_level")
 
+        if not event.get("pass_back_data"):
+            # Carry state such as build history forward between deploys
+            eh.add_state(prev_state.get("state") or {})
+
         role_arn = lambda_env("codebuild_role_arn")
         
         description = f"Codebuild project for component {cname} in app {repo_id}"
         build_container_size = cdef.get("build_container_size")
         runtime_versions = cdef.get("runtime_versions") or None
-        environment_variables = cdef.get("environment_variables") or None
-        install_commands = cdef.get("install_commands") or None
-        pre_build_commands = cdef.get("pre_build_commands") or None
-        build_commands = cdef.get("build_commands") or None
-        post_build_commands = cdef.get("post_build_commands") or None
-        buildspec_artifacts = cdef.get("buildspec_artifacts") or None
 
         privileged_mode = cdef.get("privileged_mode") or False
 
+        run_build = cdef.get("run_build")
+        if run_build:
+            run_build = run_build if isinstance(run_build, dict) else {}
+        else:
+            run_build = None
+
         artifacts = cdef.get("artifacts") or {"type": "NO_ARTIFACTS"}
 
-        container_image = cdef.get("container_image") or get_container_image(runtime_versions or {})
+        environment_type = (cdef.get("environment_type") or "").upper() or None
+        fleet_arn = cdef.get("fleet_arn")
+        try:
+            environment = environment_info(environment_type) if environment_type else {}
+        except ValueError as e:
+            eh.add_log("Invalid Environment", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Environment: {str(e)}", 0)
+            return eh.finish()
+        if not environment and is_lambda_compute(build_container_size):
+            environment = ENVIRONMENT_TYPES["LINUX_LAMBDA_CONTAINER"]
+
+        container_image = cdef.get("container_image") or get_container_image(runtime_versions or {}, environment)
         if not container_image:
-            eh.add_log("No container image found", {"runtime_versions": runtime_versions}, is_error=True)
+            eh.add_log("No container image found", IMAGE_INDEX.explain(
+                runtime_versions or {}, environment.get("compute") or "container", environment.get("architecture")
+            ), is_error=True)
             eh.perm_error("No container image found", 0)
             return eh.finish()
 
-        if event.get("pass_back_data"):
-            print(f"pass_back_data found")
-        elif event.get("op") == "upsert":
-            if trust_level == "full":
-                eh.add_op("compare_defs")
-            else:
-                eh.add_op("get_codebuild_project")
-
-        elif event.get("op") == "delete":
-            eh.add_op("remove_codebuild_project", {"create_and_remove": False, "name": name})
-            
-        compare_defs(event)
-
-        if build_container_size:
+        auto_compute = isinstance(build_container_size, str) and build_container_size.lower() == "auto"
+        if auto_compute:
+            compute = choose_compute(
+                cdef, container_image, runtime_versions or {}, privileged_mode, bool(event.get("pass_back_data"))
+            )
+            build_container_size = compute["compute_type"]
+            container_image = compute["image"]
+        elif build_container_size:
             if isinstance(build_container_size, str):
                 if build_container_size.lower() == "small":
                     build_container_size = "BUILD_GENERAL1_SMALL"
@@ -84,7 +224,9 @@ def lambda_handler(event, context):
                     build_container_size = "BUILD_GENERAL1_LARGE"
                 elif (build_container_size.lower() == "2xlarge") or (build_container_size.lower() == "xxlarge"):
                     build_container_size = "BUILD_GENERAL1_2XLARGE"
-                elif build_container_size in ["BUILD_GENERAL1_SMALL", "BUILD_GENERAL1_MEDIUM", "BUILD_GENERAL1_LARGE", "BUILD_GENERAL1_2XLARGE"]:
+                elif build_container_size.lower() == "xlarge":
+                    build_container_size = "BUILD_GENERAL1_XLARGE"
+                elif build_container_size in GENERAL_COMPUTE_TYPES + LAMBDA_COMPUTE_TYPES + ["ATTRIBUTE_BASED_COMPUTE"]:
                     pass
                 else:
                     eh.add_log("Invalid build_container_size, using LARGE", {"build_container_size": build_container_size})
@@ -102,57 +244,145 @@ def lambda_handler(event, context):
                     eh.add_log("Invalid build_container_size, using LARGE", {"build_container_size": build_container_size})
                     build_container_size = "BUILD_GENERAL1_LARGE"
         else:
-            build_container_size = "BUILD_GENERAL1_LARGE"
+            build_container_size = DEFAULT_COMPUTE_TYPES[environment.get("compute") or "container"]
+
+        try:
+            cache, cache_paths = resolve_cache(cdef, name, runtime_versions or {}, privileged_mode)
+        except ValueError as e:
+            eh.add_log("Invalid Cache Configuration", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Cache Configuration: {str(e)}", 0)
+            return eh.finish()
+
+        environment_type = environment_type or infer_environment_type(container_image, build_container_size)
+        try:
+            if auto_compute and fleet_arn:
+                raise ValueError("build_container_size auto cannot pick sizes for a reserved capacity fleet")
+            validate_environment(environment_type, build_container_size, fleet_arn, privileged_mode, cache)
+        except ValueError as e:
+            eh.add_log("Invalid Environment", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Environment: {str(e)}", 0)
+            return eh.finish()
+
+        try:
+            build_batch_config = resolve_build_batch(cdef, role_arn, environment_type)
+        except ValueError as e:
+            eh.add_log("Invalid Batch Build Configuration", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Batch Build Configuration: {str(e)}", 0)
+            return eh.finish()
+
+        try:
+            report_groups = resolve_report_groups(cdef, name, region, account_number)
+        except ValueError as e:
+            eh.add_log("Invalid Report Groups", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Report Groups: {str(e)}", 0)
+            return eh.finish()
 
         sourced_from_s3 = cdef.get("sourced_from_s3", True)
         if sourced_from_s3:
+            fields = buildspec_fields(cdef)
+            reports = buildspec_reports(report_groups, fields.get("buildspec_reports"))
+            if reports:
+                fields["buildspec_reports"] = reports
+            if is_lambda_compute(build_container_size):
+                # Lambda compute images ship a single runtime and reject runtime-versions
+                fields.pop("runtime_versions", None)
+            if cache_paths and not fields.get("buildspec_cache_paths"):
+                fields["buildspec_cache_paths"] = cache_paths
+            try:
+                buildspec = render_buildspec(fields, cdef.get("buildspec_format") or "json")
+            except ValueError as e:
+                eh.add_log("Invalid Buildspec", {"error": str(e)}, is_error=True)
+                eh.perm_error(f"Invalid Buildspec: {str(e)}", 0)
+                return eh.finish()
+            digest = buildspec_digest(buildspec)
+
             source = {
                 "type": "S3",
                 "location": f"{cdef['s3_bucket']}/{cdef['s3_object']}",
-                "buildspec": json.dumps(remove_none_attributes({
-                    "version": 0.2,
-                    "env": remove_none_attributes({
-                        "variables": environment_variables
-                    }) or None,
-                    "phases": remove_none_attributes({
-                        "install": remove_none_attributes({
-                            "runtime-versions": runtime_versions,
-                            "commands": install_commands
-                        }) or None,
-                        "pre_build": remove_none_attributes({
-                            "commands": pre_build_commands
-                        }) or None,
-                        "build": remove_none_attributes({
-                            "commands": build_commands
-                        }) or None,
-                        "post_build": remove_none_attributes({
-                            "commands": post_build_commands
-                        }) or None
-                    }), 
-                    "artifacts": buildspec_artifacts or None
-                }), sort_keys=True)
+                "buildspec": buildspec
             }
+            # Pinning the object version lets a new upload reuse the same key
+            source_version = cdef.get("s3_object_version")
         else:
             source = cdef.get("source")
+            source_version = cdef.get("source_version")
+            digest = None
+
+        try:
+            secondary_sources, secondary_source_versions = resolve_secondary_sources(cdef)
+            secondary_artifacts = resolve_secondary_artifacts(cdef)
+        except ValueError as e:
+            eh.add_log("Invalid Sources or Artifacts", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Sources or Artifacts: {str(e)}", 0)
+            return eh.finish()
+
+        try:
+            vpc_config = resolve_vpc_config(cdef)
+            file_system_locations = resolve_file_system_locations(
+                cdef, vpc_config, is_lambda_compute(build_container_size)
+            )
+        except ValueError as e:
+            eh.add_log("Invalid Network Configuration", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Network Configuration: {str(e)}", 0)
+            return eh.finish()
+
+        try:
+            concurrent_build_limit = resolve_concurrent_build_limit(cdef)
+        except ValueError as e:
+            eh.add_log("Invalid Concurrent Build Limit", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Concurrent Build Limit: {str(e)}", 0)
+            return eh.finish()
+
+        try:
+            webhook = compile_webhook(cdef.get("webhook"), source, build_batch_config)
+        except ValueError as e:
+            eh.add_log("Invalid Webhook", {"error": str(e)}, is_error=True)
+            eh.perm_error(f"Invalid Webhook: {str(e)}", 0)
+            return eh.finish()
 
-        codebuild_environment_type = "ARM_CONTAINER" if "aarch64" in container_image else "LINUX_CONTAINER"
         codebuild_spec = {
             "name": name,
             "description": description,
             "source": source,
             "artifacts": artifacts,
-            "environment": {
-                "type": codebuild_environment_type,
-                "image": container_image,
-                "computeType": build_container_size,
-                "imagePullCredentialsType": "CODEBUILD",
-                "privilegedMode": privileged_mode
-            },
+            "environment": build_environment(
+                environment_type, container_image, build_container_size, privileged_mode, fleet_arn
+            ),
             "serviceRole": role_arn
         }
-        print(f"params = {codebuild_spec}")
+        if source_version:
+            codebuild_spec["sourceVersion"] = source_version
+        if secondary_sources:
+            codebuild_spec["secondarySources"] = secondary_sources
+        if secondary_source_versions:
+            codebuild_spec["secondarySourceVersions"] = secondary_source_versions
+        if secondary_artifacts:
+            codebuild_spec["secondaryArtifacts"] = secondary_artifacts
+        if cache:
+            codebuild_spec["cache"] = cache
+        if build_batch_config:
+            codebuild_spec["buildBatchConfig"] = build_batch_config
+        if vpc_config:
+            codebuild_spec["vpcConfig"] = vpc_config
+        if file_system_locations:
+            codebuild_spec["fileSystemLocations"] = file_system_locations
+        if concurrent_build_limit:
+            codebuild_spec["concurrentBuildLimit"] = concurrent_build_limit
+        eh.debug(lambda: f"params = {codebuild_spec}")
 
-        codebuild_spec_hash = hashlib.md5(json.dumps(codebuild_spec, sort_keys=True).encode("utf-8")).hexdigest()
+        # The webhook and report groups are not part of the project spec, but
+        # a change to them must not be skipped
+        hashed_spec = codebuild_spec
+        if digest:
+            # The rendered buildspec is hashed once rather than serialized again with the spec
+            hashed_spec = {**hashed_spec, "source": {**hashed_spec["source"], "buildspec": digest}}
+        if webhook:
+            hashed_spec = {**hashed_spec, "webhook": webhook}
+        if report_groups:
+            hashed_spec = {**hashed_spec, "report_groups": {
+                k: {"type": g["type"], "exportConfig": g["exportConfig"]} for k, g in report_groups.items()
+            }}
+        codebuild_spec_hash = hashlib.md5(json.dumps(hashed_spec, sort_keys=True).encode("utf-8")).hexdigest()
 
         if artifacts and artifacts.get("packaging") == "ZIP":
            eh.add_props({
@@ -161,14 +391,72 @@ def lambda_handler(event, context):
                   artifacts.get("path") else artifacts.get("name")
            })
 
-        eh.add_props({
-            "buildspec_hash": codebuild_spec_hash
-        })
+        eh.add_props(remove_none_attributes({
+            "buildspec_hash": codebuild_spec_hash,
+            "source_version": source_version,
+            "secondary_sources": {
+                s["sourceIdentifier"]: s.get("location") for s in secondary_sources
+            } or None,
+            "secondary_source_versions": {
+                v["sourceIdentifier"]: v["sourceVersion"] for v in secondary_source_versions
+            } or None,
+            "secondary_artifacts": {
+                a["artifactIdentifier"]: artifact_location(a) for a in secondary_artifacts if artifact_location(a)
+            } or None,
+            "report_group_arns": {k: g["arn"] for k, g in report_groups.items()} or None
+        }))
 
-        get_codebuild_project(name, codebuild_spec, prev_state, region, account_number)
-        create_codebuild_project(name, codebuild_spec)
-        update_codebuild_project(name, codebuild_spec)
-        remove_codebuild_project()
+        if event.get("pass_back_data"):
+            eh.debug("pass_back_data found")
+        elif event.get("op") == "upsert":
+            if prev_spec_matches(prev_state, name, codebuild_spec_hash, cdef.get("verify_every_n_deploys")):
+                eh.add_op("reuse_prev_state")
+            elif trust_level == "full":
+                eh.add_op("compare_defs")
+            else:
+                eh.add_op("get_codebuild_project")
+
+            if auto_compute:
+                eh.add_op("sync_build_history")
+            if run_build is not None:
+                eh.add_op("start_build_batch" if run_build.get("batch") else "start_build")
+
+        elif event.get("op") == "delete":
+            eh.add_op("remove_codebuild_project", {"create_and_remove": False, "name": name})
+            prev_report_group_arns = list(((prev_state.get("props") or {}).get("report_group_arns") or {}).values())
+            if prev_report_group_arns:
+                eh.add_op("delete_report_groups", prev_report_group_arns)
+
+        reuse_prev_state(prev_state)
+        compare_defs(event)
+        get_codebuild_project(name, codebuild_spec, webhook, report_groups, prev_state, region, account_number, known_projects)
+        if cdef.get("concurrent_ops"):
+            # Removing a renamed project does not depend on creating its replacement
+            run_concurrently([
+                (create_codebuild_project, (name, codebuild_spec, region)),
+                (update_codebuild_project, (name, codebuild_spec, region)),
+                (remove_codebuild_project, (region,))
+            ], max_concurrency=int(cdef.get("max_concurrent_ops") or 4))
+        else:
+            create_codebuild_project(name, codebuild_spec, region)
+            update_codebuild_project(name, codebuild_spec, region)
+            remove_codebuild_project(region)
+        # Each of these falls back to the other when the webhook is not as
+        # expected, so update runs again after create
+        update_webhook(name, webhook, region)
+        create_webhook(name, webhook, region)
+        update_webhook(name, webhook, region)
+        delete_webhook(name, region)
+        get_report_groups(report_groups, prev_state)
+        # A group whose type changed is deleted before it is created again
+        delete_report_groups()
+        create_report_groups(report_groups)
+        update_report_groups(report_groups)
+        sync_build_history(name)
+        start_build(name, run_build)
+        check_build(name, known_builds)
+        start_build_batch(name, run_build)
+        check_build_batch(name, known_builds)
             
         return eh.finish()
 
@@ -179,6 +467,38 @@ def lambda_handler(event, context):
         eh.declare_return(200, 0, error_code=str(e))
         return eh.finish()
 
+def reject_component(event, error, details):
+    """Fails a component without touching AWS"""
+    eh.capture_event(event)
+    eh.add_log(error, details, is_error=True)
+    eh.perm_error(error, 0)
+    return eh.finish()
+
+def prev_spec_matches(prev_state, name, codebuild_spec_hash, verify_every_n_deploys=None):
+    """True when the last deploy applied this exact spec to this project.
+
+    If verify_every_n_deploys is set, every Nth matching deploy returns False
+    so the project is described again and drift gets caught.
+    """
+    prev_props = prev_state.get("props") or {}
+    if not prev_props.get("arn") or prev_props.get("name") != name:
+        return False
+    if prev_props.get("buildspec_hash") != codebuild_spec_hash:
+        return False
+    if verify_every_n_deploys:
+        deploys_since_verify = (prev_state.get("state") or {}).get("deploys_since_verify") or 0
+        if deploys_since_verify + 1 >= int(verify_every_n_deploys):
+            return False
+    return True
+
+@ext(handler=eh, op="reuse_prev_state")
+def reuse_prev_state(prev_state):
+    deploys_since_verify = (prev_state.get("state") or {}).get("deploys_since_verify") or 0
+    eh.add_links(prev_state.get("links") or {})
+    eh.add_props(prev_state.get("props") or {})
+    eh.add_state({"deploys_since_verify": deploys_since_verify + 1})
+    eh.add_log("Spec Unchanged Since Last Deploy; Exiting", {"buildspec_hash": prev_state["props"]["buildspec_hash"]})
+
 @ext(handler=eh, op="compare_defs")
 def compare_defs(event):
     old_rendef = event.get("prev_state", {}).get("rendef", {})
@@ -195,47 +515,138 @@ def compare_defs(event):
         eh.add_props(event.get("prev_state", {}).get('props'))
         eh.add_log("Full Trust, No Change: Exiting", {"old": old_rendef, "new": new_rendef})
 
+def resolve_project_name(event):
+    cdef = event.get("component_def")
+    return cdef.get("name") or component_safe_name(
+        event.get("project_code"), event.get("repo_id"), event.get("component_name"), max_chars=255,
+        strategy=cdef.get("name_strategy") or "hash"
+    )
+
+def needs_project_lookup(event):
+    if event.get("op") != "upsert":
+        return False
+    if event.get("pass_back_data"):
+        return "get_codebuild_project" in (event["pass_back_data"].get("ops") or {})
+    return True
+
+def fetch_codebuild_projects(names, region):
+    """Returns a dict of project name to project description.
+
+    Names CodeBuild reports as not found map to None. Chunks that fail are
+    left out entirely, so those components fall back to their own lookup.
+    Cached descriptions are reused and fresh ones are added to the cache.
+    """
+    projects = {}
+    for n in dict.fromkeys(names):
+        cached = project_cache.get((region, n), NOT_CACHED)
+        if cached is not NOT_CACHED:
+            projects[n] = cached
+    names = [n for n in dict.fromkeys(names) if n not in projects]
+    for i in range(0, len(names), BATCH_GET_PROJECTS_LIMIT):
+        chunk = names[i:i + BATCH_GET_PROJECTS_LIMIT]
+        try:
+            response = get_client("codebuild").batch_get_projects(names=chunk)
+        except ClientError as e:
+            print(f"Batch Get Codebuild Projects Failed: {str(e)}")
+            continue
+        fetched = {n: None for n in response.get("projectsNotFound") or []}
+        fetched.update({p["name"]: p for p in response.get("projects") or []})
+        for n, project in fetched.items():
+            project_cache.set((region, n), project)
+        projects.update(fetched)
+    return projects
+
+class ProjectPrefetch:
+    """The project descriptions a batch may need, fetched together with
+    batch_get_projects the first time any component asks for one.
+
+    Components whose spec hash is unchanged take reuse_prev_state and never
+    ask, so a batch of them makes no calls. Components that have already
+    reconciled are discarded, so they are not fetched for the rest.
+    """
+
+    def __init__(self, names, region):
+        self.names = list(dict.fromkeys(names))
+        self.region = region
+        self.projects = None
+
+    def discard(self, name):
+        if self.projects is None and name in self.names:
+            self.names.remove(name)
+
+    def _fetch(self):
+        if self.projects is None:
+            self.projects = fetch_codebuild_projects(self.names, self.region)
+        return self.projects
+
+    def __contains__(self, name):
+        return name in self.names and name in self._fetch()
+
+    def __getitem__(self, name):
+        return self._fetch()[name]
+
 @ext(handler=eh, op="get_codebuild_project")
-def get_codebuild_project(name, codebuild_spec, prev_state, region, account_number):
+def get_codebuild_project(name, codebuild_spec, webhook, report_groups, prev_state, region, account_number, known_projects=None):
 
     if prev_state and prev_state.get("props") and prev_state.get("props").get("name"):
         prev_name = prev_state.get("props").get("name")
         if name != prev_name:
             eh.add_op("remove_codebuild_project", {"create_and_remove": True, "name": prev_name})
 
+    if report_groups or (prev_state.get("props") or {}).get("report_group_arns"):
+        eh.add_op("get_report_groups")
+
+    eh.add_state({"deploys_since_verify": 0})
     # arn = gen_codebuild_arn(name, region, account_number)
 
     try:
-        response = codebuild.batch_get_projects(names=[name])
-        if response.get("projects"):
-            eh.add_log("Found Codebuild Project", response.get("projects")[0])
-            project = response.get("projects")[0]
-            for k, v in codebuild_spec.items():
-                if k == "tags":
-                    desired_tags_dict = unformat_tags(v)
-                    current_tags_dict = unformat_tags(project.get("tags"))
-                    if desired_tags_dict != current_tags_dict:
-                        eh.add_log("Tags Don't Match, Updating", {"desired": desired_tags_dict, "current": current_tags_dict})
-                        eh.add_op("update_codebuild_project", {"name": name, "tags": v})
-                        break
-                if project.get(k) != v:
-                    eh.add_op("update_codebuild_project")
-                    break
-
-            if not eh.ops.get("update_codebuild_project"):
-                eh.add_log("Codebuild Project Matches; Exiting", {"project": project, "spec": codebuild_spec})
+        if known_projects is not None and name in known_projects:
+            project = known_projects[name]
+        else:
+            project = project_cache.get((region, name), NOT_CACHED)
+            if project is NOT_CACHED:
+                response = get_client("codebuild").batch_get_projects(names=[name])
+                project = (response.get("projects") or [None])[0]
+                project_cache.set((region, name), project)
+        eh.add_log("Project Cache", project_cache.stats())
+        if project:
+            diffs = diff_project(project, codebuild_spec)
+            if diffs:
+                eh.add_log("Codebuild Project Drift Found, Updating", {"diff": diffs})
+                eh.add_op("update_codebuild_project", {
+                    "reset": reset_values(diffs), "sections": changed_sections(diffs)
+                })
+            else:
+                eh.add_log("Codebuild Project Matches; Exiting", project_summary(project))
+                record_applied(codebuild_spec)
+                eh.add_props({
+                    "arn": project['arn'],
+                    "name": project['name']
+                })
+                eh.add_links({"Codebuild Project": gen_codebuild_link(name)})
+
+            op = webhook_op(project.get("webhook"), webhook)
+            if op:
+                eh.add_log("Webhook Drift Found", {"current": project.get("webhook"), "desired": webhook})
+                eh.add_op(op)
+            elif webhook:
+                eh.add_props(webhook_props(project["webhook"]))
         else:
             eh.add_op("create_codebuild_project")
+            if webhook:
+                eh.add_op("create_webhook")
 
     except botocore.exceptions.ClientError as e:
-        handle_common_errors(e, eh, "Get Codebuild Project Failed", 10)
+        handle_common_errors(e, eh, "Get Codebuild Project Failed", 10, service="codebuild")
 
 @ext(handler=eh, op="create_codebuild_project")
-def create_codebuild_project(name, codebuild_spec):
+def create_codebuild_project(name, codebuild_spec, region):
 
     try:
-        response = codebuild.create_project(**codebuild_spec).get("project")
-        eh.add_log("Created Codebuild Project", response)
+        response = get_client("codebuild").create_project(**codebuild_spec).get("project")
+        project_cache.invalidate((region, name))
+        eh.add_log("Created Codebuild Project", project_summary(response))
+        record_applied(codebuild_spec, list(codebuild_spec))
         eh.add_props({
             "arn": response['arn'],
             "name": response['name']
@@ -244,14 +655,25 @@ def create_codebuild_project(name, codebuild_spec):
     except ClientError as e:
         handle_common_errors(
             e, eh, "Create Codebuild Project Failed", 20,
-            perm_errors=["InvalidInputException", "AccountLimitExceededException"]
+            perm_errors=["InvalidInputException", "AccountLimitExceededException"],
+            service="codebuild"
         )
 
 @ext(handler=eh, op="update_codebuild_project")
-def update_codebuild_project(name, codebuild_spec):
+def update_codebuild_project(name, codebuild_spec, region):
+    op_value = eh.ops["update_codebuild_project"]
+    op_value = op_value if isinstance(op_value, dict) else {}
+    reset = op_value.get("reset") or {}
+    # Only the drifted sections are sent, so unchanged settings are not rewritten
+    sections = op_value.get("sections")
+    if sections is None:
+        sections = list(codebuild_spec)
     try:
-        response = codebuild.update_project(**codebuild_spec).get("project")
-        eh.add_log("Updated Codebuild Project", response)
+        payload = update_payload(codebuild_spec, sections, reset)
+        response = get_client("codebuild").update_project(**payload).get("project")
+        project_cache.invalidate((region, name))
+        eh.add_log("Updated Codebuild Project", {**project_summary(response), "sections": list(payload)})
+        record_applied(codebuild_spec, sections)
         eh.add_props({
             "arn": response['arn'],
             "name": response['name']
@@ -260,21 +682,511 @@ def update_codebuild_project(name, codebuild_spec):
     except ClientError as e:
         handle_common_errors(
             e, eh, "Update Codebuild Project Failed", 20,
-            perm_errors=["InvalidInputException", "ResourceNotFoundException"]
+            perm_errors=["InvalidInputException", "ResourceNotFoundException"],
+            service="codebuild"
+        )
+
+@ext(handler=eh, op="create_webhook")
+def create_webhook(name, webhook, region):
+    try:
+        response = get_client("codebuild").create_webhook(projectName=name, **webhook).get("webhook")
+        project_cache.invalidate((region, name))
+        eh.add_log("Created Webhook", {"name": name, **webhook})
+        eh.add_props(webhook_props(response))
+    except ClientError as e:
+        if e.response['Error']['Code'] == "ResourceAlreadyExistsException":
+            eh.add_log("Webhook Already Exists, Updating", {"name": name})
+            eh.add_op("update_webhook")
+        else:
+            handle_common_errors(
+                e, eh, "Create Webhook Failed", 60,
+                perm_errors=["InvalidInputException", "OAuthProviderException"],
+                service="codebuild"
+            )
+
+@ext(handler=eh, op="update_webhook")
+def update_webhook(name, webhook, region):
+    try:
+        response = get_client("codebuild").update_webhook(projectName=name, **webhook).get("webhook")
+        project_cache.invalidate((region, name))
+        eh.add_log("Updated Webhook", {"name": name, **webhook})
+        eh.add_props(webhook_props(response))
+    except ClientError as e:
+        if e.response['Error']['Code'] == "ResourceNotFoundException":
+            eh.add_log("Webhook Not Found, Creating", {"name": name})
+            eh.add_op("create_webhook")
+            return
+        handle_common_errors(
+            e, eh, "Update Webhook Failed", 60,
+            perm_errors=["InvalidInputException", "OAuthProviderException"],
+            service="codebuild"
         )
 
+@ext(handler=eh, op="delete_webhook")
+def delete_webhook(name, region):
+    try:
+        get_client("codebuild").delete_webhook(projectName=name)
+        project_cache.invalidate((region, name))
+        eh.add_log("Deleted Webhook", {"name": name})
+    except ClientError as e:
+        if e.response['Error']['Code'] == "ResourceNotFoundException":
+            eh.add_log("Webhook Already Deleted", {"name": name})
+        else:
+            handle_common_errors(e, eh, "Delete Webhook Failed", 60, service="codebuild")
+
+@ext(handler=eh, op="get_report_groups")
+def get_report_groups(report_groups, prev_state):
+    prev_arns = list(((prev_state.get("props") or {}).get("report_group_arns") or {}).values())
+    arns = list(dict.fromkeys([g["arn"] for g in report_groups.values()] + prev_arns))
+    try:
+        found = {}
+        for i in range(0, len(arns), BATCH_GET_REPORT_GROUPS_LIMIT):
+            response = get_client("codebuild").batch_get_report_groups(
+                reportGroupArns=arns[i:i + BATCH_GET_REPORT_GROUPS_LIMIT]
+            )
+            found.update({g["arn"]: g for g in response.get("reportGroups") or [] if g.get("status") != "DELETING"})
+    except ClientError as e:
+        handle_common_errors(e, eh, "Get Report Groups Failed", 10, service="codebuild")
+        return
+
+    create, update, delete = report_group_ops(found, report_groups, prev_arns)
+    if create:
+        # Groups whose type changed are deleted and created again under the
+        # same name, which CodeBuild holds until the deletion finishes
+        replaced = [k for k in create if report_groups[k]["arn"] in delete]
+        eh.add_op("create_report_groups", {"keys": create, "replaced": replaced})
+    if update:
+        eh.add_op("update_report_groups", update)
+    if delete:
+        eh.add_op("delete_report_groups", delete)
+    eh.add_log("Compared Report Groups", {"create": create, "update": update, "delete": delete})
+
+@ext(handler=eh, op="create_report_groups")
+def create_report_groups(report_groups):
+    remaining = list(eh.ops["create_report_groups"]["keys"])
+    replaced = list(eh.ops["create_report_groups"]["replaced"])
+
+    def retry_later():
+        # Only what is left is tried again
+        eh.add_op("create_report_groups", {"keys": remaining, "replaced": [k for k in replaced if k in remaining]})
+
+    if replaced:
+        try:
+            response = get_client("codebuild").batch_get_report_groups(
+                reportGroupArns=[report_groups[k]["arn"] for k in replaced]
+            )
+        except ClientError as e:
+            retry_later()
+            handle_common_errors(e, eh, "Get Report Groups Failed", 60, service="codebuild")
+            return
+        deleting = [g["arn"] for g in response.get("reportGroups") or []]
+        if deleting:
+            retry_later()
+            eh.add_log("Waiting for Report Group Deletion", {"arns": deleting})
+            eh.retry_error("Waiting for Report Group Deletion", 60, callback_sec=10)
+            return
+
+    while remaining:
+        key = remaining[0]
+        group = report_groups[key]
+        try:
+            get_client("codebuild").create_report_group(
+                name=group["name"], type=group["type"], exportConfig=group["exportConfig"]
+            )
+            eh.add_log("Created Report Group", {"name": group["name"], "type": group["type"]})
+        except ClientError as e:
+            if e.response['Error']['Code'] == "ResourceAlreadyExistsException" and key in replaced:
+                # The group deleted in this deploy still holds the name
+                retry_later()
+                eh.add_log("Waiting for Report Group Deletion", {"name": group["name"]})
+                eh.retry_error("Waiting for Report Group Deletion", 60, callback_sec=10)
+                return
+            elif e.response['Error']['Code'] == "ResourceAlreadyExistsException":
+                eh.add_log("Report Group Already Exists", {"name": group["name"]})
+            else:
+                retry_later()
+                handle_common_errors(
+                    e, eh, "Create Report Group Failed", 60,
+                    perm_errors=["InvalidInputException", "AccountLimitExceededException"],
+                    service="codebuild"
+                )
+                return
+        remaining.pop(0)
+
+@ext(handler=eh, op="update_report_groups")
+def update_report_groups(report_groups):
+    remaining = list(eh.ops["update_report_groups"])
+    while remaining:
+        group = report_groups[remaining[0]]
+        try:
+            get_client("codebuild").update_report_group(arn=group["arn"], exportConfig=group["exportConfig"])
+            eh.add_log("Updated Report Group", {"name": group["name"], "exportConfig": group["exportConfig"]})
+        except ClientError as e:
+            eh.add_op("update_report_groups", remaining)
+            handle_common_errors(
+                e, eh, "Update Report Group Failed", 60,
+                perm_errors=["InvalidInputException", "ResourceNotFoundException"],
+                service="codebuild"
+            )
+            return
+        remaining.pop(0)
+
+@ext(handler=eh, op="delete_report_groups")
+def delete_report_groups():
+    """Deletes report groups this component no longer defines, and their reports"""
+    remaining = list(eh.ops["delete_report_groups"])
+    while remaining:
+        try:
+            get_client("codebuild").delete_report_group(arn=remaining[0], deleteReports=True)
+            eh.add_log("Deleted Report Group", {"arn": remaining[0]})
+        except ClientError as e:
+            if e.response['Error']['Code'] != "ResourceNotFoundException":
+                eh.add_op("delete_report_groups", remaining)
+                handle_common_errors(e, eh, "Delete Report Group Failed", 60, service="codebuild")
+                return
+            eh.add_log("Report Group Already Deleted", {"arn": remaining[0]})
+        remaining.pop(0)
+
+def webhook_props(webhook):
+    """The webhook's URLs; its secret is never exposed"""
+    return remove_none_attributes({
+        "webhook_url": (webhook or {}).get("url"),
+        "webhook_payload_url": (webhook or {}).get("payloadUrl")
+    })
+
+def record_applied(codebuild_spec, sections=()):
+    """Keeps the spec the project now matches in state as applied_spec, with
+    the buildspec as its digest, and applied_at holding when each of its
+    top-level fields was applied"""
+    snapshot = applied_snapshot(codebuild_spec)
+    eh.add_state({
+        "applied_spec": snapshot,
+        "applied_at": stamp_applied(
+            snapshot, eh.state.get("applied_spec"), eh.state.get("applied_at"),
+            current_epoch_time_usec_num(), sections
+        )
+    })
+
 @ext(handler=eh, op="remove_codebuild_project")
-def remove_codebuild_project():
+def remove_codebuild_project(region):
     codebuild_project_name = eh.ops['remove_codebuild_project'].get("name")
     car = eh.ops['remove_codebuild_project'].get("create_and_remove")
 
     try:
-        _ = codebuild.delete_project(name=codebuild_project_name)
+        _ = get_client("codebuild").delete_project(name=codebuild_project_name)
+        project_cache.invalidate((region, codebuild_project_name))
         eh.add_log("Deleted Project if it Existed", {"name": codebuild_project_name})
     except botocore.exceptions.ClientError as e:
         eh.add_log("Remove Codebuild Error", {"error": str(e)}, True)
-        eh.retry_error(str(e), 60 if car else 15)
+        eh.retry_error(str(e), 60 if car else 15, error_code=e.response['Error']['Code'], service="codebuild")
+
+@ext(handler=eh, op="sync_build_history")
+def sync_build_history(name):
+    """Records the project's latest finished builds in state for build_container_size "auto".
+
+    The history only informs sizing, so failing to read it never fails the deploy.
+    """
+    try:
+        ids = get_client("codebuild").list_builds_for_project(
+            projectName=name, sortOrder="DESCENDING"
+        ).get("ids", [])[:BUILD_HISTORY_SAMPLE]
+        builds = get_client("codebuild").batch_get_builds(ids=ids).get("builds", []) if ids else []
+    except ClientError as e:
+        eh.add_log("Could Not Read Build History", {"error": str(e)})
+        return
+
+    history = eh.state.get("build_history") or []
+    for build in reversed(builds):
+        if build.get("buildComplete") and build.get("startTime") and build.get("endTime"):
+            history = record_build(history, build_history_entry(build))
+    eh.add_state({"build_history": history})
+    eh.add_log("Synced Build History", {"builds": len(history)})
 
+def build_params(name, run_build):
+    """The start_build / start_build_batch parameters for run_build"""
+    overrides = [
+        {"name": k, **(v if isinstance(v, dict) else {"value": str(v)})}
+        for k, v in (run_build.get("environment_variables") or {}).items()
+    ]
+    return remove_none_attributes({
+        "projectName": name,
+        "sourceVersion": run_build.get("source_version"),
+        "environmentVariablesOverride": [{"type": "PLAINTEXT", **o} for o in overrides] or None
+    })
+
+@ext(handler=eh, op="start_build")
+def start_build(name, run_build):
+    try:
+        build = get_client("codebuild").start_build(**build_params(name, run_build))["build"]
+    except ClientError as e:
+        handle_common_errors(
+            e, eh, "Start Build Failed", 60,
+            perm_errors=["InvalidInputException", "ResourceNotFoundException", "AccountLimitExceededException"],
+            service="codebuild"
+        )
+        return
+
+    eh.add_log("Started Build", build_summary(build))
+    eh.add_props({"build_id": build["id"], "build_status": build.get("buildStatus")})
+    eh.add_links({"Codebuild Build": gen_build_link(name, build["id"])})
+    if run_build.get("wait", True):
+        eh.add_op("check_build", build["id"])
+
+@ext(handler=eh, op="check_build")
+def check_build(name, known_builds=None):
+    build_id = eh.ops["check_build"]
+    build = (known_builds or {}).get(build_id)
+    if not build:
+        try:
+            build = (get_client("codebuild").batch_get_builds(ids=[build_id]).get("builds") or [None])[0]
+        except ClientError as e:
+            handle_common_errors(e, eh, "Check Build Failed", 70, service="codebuild")
+            return
+    if not build:
+        eh.add_log("Build Not Found", {"build_id": build_id}, is_error=True)
+        eh.perm_error("Build Not Found", 70)
+        return
+
+    phase = build.get("currentPhase")
+    if not build.get("buildComplete"):
+        eh.add_log(f"Build {phase}", build_summary(build))
+        eh.wait("Waiting for Build", build_progress(phase), build_callback_sec(build))
+        return
+
+    status = build.get("buildStatus")
+    entry = build_history_entry(build)
+    eh.add_state({"build_history": record_build(eh.state.get("build_history"), entry)})
+    eh.add_props(remove_none_attributes({
+        "build_id": build_id,
+        "build_status": status,
+        "build_duration_sec": entry["duration_sec"],
+        "build_artifact_location": (build.get("artifacts") or {}).get("location")
+    }))
+    if status == "SUCCEEDED":
+        eh.add_log("Build Succeeded", build_summary(build))
+    else:
+        eh.add_log(f"Build {status}", {
+            **build_summary(build),
+            "failed_phases": [
+                remove_none_attributes({"phase": p.get("phaseType"), "status": p.get("phaseStatus"), "contexts": p.get("contexts")})
+                for p in build.get("phases") or [] if p.get("phaseStatus") not in [None, "SUCCEEDED"]
+            ]
+        }, is_error=True)
+        eh.perm_error(f"Build {status}", 95)
+
+@ext(handler=eh, op="start_build_batch")
+def start_build_batch(name, run_build):
+    try:
+        build_batch = get_client("codebuild").start_build_batch(**build_params(name, run_build))["buildBatch"]
+    except ClientError as e:
+        handle_common_errors(
+            e, eh, "Start Batch Build Failed", 60,
+            perm_errors=["InvalidInputException", "ResourceNotFoundException", "AccountLimitExceededException"],
+            service="codebuild"
+        )
+        return
+
+    eh.add_log("Started Batch Build", build_batch_summary(build_batch))
+    eh.add_props({"build_batch_id": build_batch["id"], "build_batch_status": build_batch.get("buildBatchStatus")})
+    eh.add_links({"Codebuild Batch Build": gen_build_batch_link(name, build_batch["id"])})
+    if run_build.get("wait", True):
+        eh.add_op("check_build_batch", build_batch["id"])
+
+@ext(handler=eh, op="check_build_batch")
+def check_build_batch(name, known_builds=None):
+    build_batch_id = eh.ops["check_build_batch"]
+    build_batch = (known_builds or {}).get(build_batch_id)
+    if not build_batch:
+        try:
+            build_batch = (get_client("codebuild").batch_get_build_batches(ids=[build_batch_id]).get("buildBatches") or [None])[0]
+        except ClientError as e:
+            handle_common_errors(e, eh, "Check Batch Build Failed", 70, service="codebuild")
+            return
+    if not build_batch:
+        eh.add_log("Batch Build Not Found", {"build_batch_id": build_batch_id}, is_error=True)
+        eh.perm_error("Batch Build Not Found", 70)
+        return
+
+    summary = build_batch_summary(build_batch)
+    if not build_batch.get("complete"):
+        eh.add_log(f"Batch Build {build_batch.get('currentPhase')}", summary)
+        groups = summary.get("builds") or {}
+        done = len([s for s in groups.values() if s not in [None, "IN_PROGRESS"]])
+        eh.wait("Waiting for Batch Build", 60 + int(35 * done / max(len(groups), 1)), build_callback_sec(build_batch))
+        return
+
+    status = build_batch.get("buildBatchStatus")
+    eh.add_props(remove_none_attributes({
+        "build_batch_id": build_batch_id,
+        "build_batch_status": status,
+        "build_batch_duration_sec": round((build_batch["endTime"] - build_batch["startTime"]).total_seconds())
+            if build_batch.get("endTime") and build_batch.get("startTime") else None,
+        "build_batch_artifact_location": (build_batch.get("artifacts") or {}).get("location"),
+        "build_batch_builds": summary.get("builds")
+    }))
+    if status == "SUCCEEDED":
+        eh.add_log("Batch Build Succeeded", summary)
+    else:
+        eh.add_log(f"Batch Build {status}", summary, is_error=True)
+        eh.perm_error(f"Batch Build {status}", 95)
+
+def fetch_codebuild_builds(build_ids, build_batches=False):
+    """Returns a dict of build (or batch build) id to its description, fetched
+    with as few batch_get_builds / batch_get_build_batches calls as possible.
+    Builds that could not be fetched are left out, so those components fall
+    back to their own lookup."""
+    builds = {}
+    build_ids = list(dict.fromkeys(build_ids))
+    for i in range(0, len(build_ids), BATCH_GET_BUILDS_LIMIT):
+        chunk = build_ids[i:i + BATCH_GET_BUILDS_LIMIT]
+        try:
+            if build_batches:
+                found = get_client("codebuild").batch_get_build_batches(ids=chunk).get("buildBatches")
+            else:
+                found = get_client("codebuild").batch_get_builds(ids=chunk).get("builds")
+        except ClientError as e:
+            print(f"Batch Get Codebuild Builds Failed: {str(e)}")
+            continue
+        builds.update({b["id"]: b for b in found or []})
+    return builds
+
+def build_progress(phase):
+    """Spreads the build phases over progress 60-95"""
+    position = BUILD_PHASES.index(phase) if phase in BUILD_PHASES else 0
+    return 60 + int(35 * position / len(BUILD_PHASES))
+
+def build_callback_sec(build):
+    """How long to wait before checking on a running build again.
+
+    Uses the phase's interval, stretched during long phases: a phase that has
+    already run for a while is checked about every quarter of its elapsed
+    time, up to MAX_BUILD_CALLBACK_SEC.
+    """
+    phase = build.get("currentPhase")
+    callback_sec = BUILD_PHASE_CALLBACK_SEC.get(phase, 5)
+    current = [p for p in build.get("phases") or [] if p.get("phaseType") == phase and p.get("startTime")]
+    if current:
+        start = current[-1]["startTime"]
+        elapsed = (datetime.datetime.now(start.tzinfo) - start).total_seconds()
+        callback_sec = max(callback_sec, elapsed / 4)
+    return min(int(callback_sec), MAX_BUILD_CALLBACK_SEC)
+
+def build_summary(build):
+    """The parts of a build worth logging"""
+    return remove_none_attributes({
+        "id": build.get("id"),
+        "status": build.get("buildStatus"),
+        "phase": build.get("currentPhase"),
+        "computeType": (build.get("environment") or {}).get("computeType"),
+        "sourceVersion": build.get("resolvedSourceVersion") or build.get("sourceVersion")
+    })
+
+def build_batch_summary(build_batch):
+    """The parts of a batch build worth logging, with each build's status by identifier"""
+    return remove_none_attributes({
+        "id": build_batch.get("id"),
+        "status": build_batch.get("buildBatchStatus"),
+        "phase": build_batch.get("currentPhase"),
+        "builds": {
+            group.get("identifier"): (group.get("currentBuildSummary") or {}).get("buildStatus")
+            for group in build_batch.get("buildGroups") or []
+        } or None
+    })
+
+def resolve_build_batch(cdef, role_arn, environment_type):
+    """Returns the buildBatchConfig for cdef["build_batch"], or None.
+
+    The batch service role defaults to the project's role. Raises ValueError
+    if the allowed compute types do not fit the environment, or if the
+    buildspec batch section would start more builds than allowed.
+    """
+    build_batch = cdef.get("build_batch")
+    if not build_batch:
+        return None
+    build_batch = build_batch if isinstance(build_batch, dict) else {}
+    buildspec_batch = cdef.get("buildspec_batch")
+    if cdef.get("sourced_from_s3", True) and not buildspec_batch:
+        raise ValueError("build_batch needs buildspec_batch to describe the builds to run")
+
+    compute_types_allowed = build_batch.get("compute_types_allowed")
+    if compute_types_allowed:
+        invalid = [c for c in compute_types_allowed if c not in environment_info(environment_type)["compute_types"]]
+        if invalid:
+            raise ValueError(f"compute_types_allowed {invalid} cannot run on {environment_type}")
+
+    maximum_builds_allowed = build_batch.get("maximum_builds_allowed")
+    if maximum_builds_allowed is not None:
+        if not isinstance(maximum_builds_allowed, int) or maximum_builds_allowed < 1:
+            raise ValueError("maximum_builds_allowed must be a positive integer")
+        if buildspec_batch:
+            validate_batch(buildspec_batch)
+            fan_out = batch_fan_out(buildspec_batch)
+            if fan_out > maximum_builds_allowed:
+                raise ValueError(f"buildspec_batch starts {fan_out} builds but maximum_builds_allowed is {maximum_builds_allowed}")
+
+    return remove_none_attributes({
+        "serviceRole": build_batch.get("service_role") or role_arn,
+        "combineArtifacts": build_batch.get("combine_artifacts"),
+        "restrictions": remove_none_attributes({
+            "maximumBuildsAllowed": maximum_builds_allowed,
+            "computeTypesAllowed": compute_types_allowed
+        }) or None,
+        "timeoutInMins": build_batch.get("timeout_in_mins"),
+        "batchReportMode": build_batch.get("batch_report_mode")
+    })
+
+def build_history_entry(build):
+    return {
+        "id": build["id"],
+        "compute_type": (build.get("environment") or {}).get("computeType"),
+        "duration_sec": round((build["endTime"] - build["startTime"]).total_seconds()),
+        "status": build.get("buildStatus")
+    }
+
+def choose_compute(cdef, container_image, runtime_versions, privileged_mode, in_progress=False):
+    """Picks the compute type for build_container_size "auto" from the build
+    history in state. Returns the recommendation plus the image to use, which
+    is a Lambda compute image if the recommendation is Lambda compute.
+
+    Retries of an in-progress deploy, and deploys with no new build since
+    the last recommendation, reuse the recommendation already made.
+    """
+    architecture = "aarch64" if "aarch64" in container_image else "x86_64"
+    lambda_image = None
+    cache_type = cdef.get("cache") if isinstance(cdef.get("cache"), str) else (cdef.get("cache") or {}).get("type")
+    # Lambda compute cannot run privileged, cache locally or mount file systems
+    if cdef.get("auto_compute_allow_lambda") and not cdef.get("container_image") \
+            and not cdef.get("environment_type") and not cdef.get("fleet_arn") and not privileged_mode \
+            and (cache_type or "").upper() != "LOCAL" and not cdef.get("file_system_locations"):
+        lambda_image = IMAGE_INDEX.resolve(runtime_versions, compute="lambda", architecture=architecture)
+
+    history = eh.state.get("build_history") or []
+    # What the recommendation was made from; it is only made again once a
+    # build has been recorded or the settings changed
+    basis = {
+        "last_build_id": history[-1].get("id") if history else None,
+        "allow_lambda": bool(lambda_image),
+        "arm": architecture == "aarch64",
+        "settings": cdef.get("auto_compute_settings") or {}
+    }
+    previous = eh.state.get("auto_compute") or {}
+    if previous.get("compute_type") and (in_progress or previous.get("basis") == basis) \
+            and (lambda_image or not previous.get("lambda")):
+        recommendation = previous
+    else:
+        recommendation = {**recommend(
+            history,
+            current=previous.get("compute_type"),
+            allow_lambda=bool(lambda_image),
+            arm=basis["arm"],
+            **basis["settings"]
+        ), "basis": basis}
+        eh.add_state({"auto_compute": recommendation})
+        eh.add_log("Auto Compute Size", recommendation)
+    return {
+        **recommendation,
+        "image": lambda_image if recommendation["lambda"] else container_image
+    }
 
 def format_tags(tags_dict):
     return [{"Key": k, "Value": v} for k,v in tags_dict]
@@ -282,13 +1194,79 @@ def format_tags(tags_dict):
 def unformat_tags(tags_list):
     return {t["Key"]: t["Value"] for t in tags_list}
 
+def resolve_cache(cdef, name, runtime_versions, privileged_mode):
+    """Returns the project cache setting and default buildspec cache paths.
+
+    cdef["cache"] is "s3", "local", or an object with a type of S3 or LOCAL.
+    S3 caches default to a per-project prefix in the source bucket, and LOCAL
+    caches default to every mode the project can use (Docker layer caching
+    needs privileged mode). Raises ValueError for invalid settings.
+    """
+    cache = cdef.get("cache")
+    if not cache:
+        return None, None
+    if isinstance(cache, str):
+        cache = {"type": cache}
+    cache_type = (cache.get("type") or "").upper()
+
+    if cache_type == "S3":
+        location = cache.get("location")
+        if not location:
+            if not cdef.get("s3_bucket"):
+                raise ValueError("S3 caches need a location when s3_bucket is not set")
+            location = f"{cdef['s3_bucket']}/codebuild-cache/{name}"
+        settings = remove_none_attributes({
+            "type": "S3",
+            "location": location,
+            "cacheNamespace": cache.get("namespace")
+        })
+        custom_paths = True
+
+    elif cache_type == "LOCAL":
+        modes = cache.get("modes") or [
+            mode for mode in LOCAL_CACHE_MODES
+            if mode != "LOCAL_DOCKER_LAYER_CACHE" or privileged_mode
+        ]
+        invalid = [m for m in modes if m not in LOCAL_CACHE_MODES]
+        if invalid:
+            raise ValueError(f"Invalid cache modes {invalid}, must be in {LOCAL_CACHE_MODES}")
+        settings = {"type": "LOCAL", "modes": sorted(modes)}
+        custom_paths = "LOCAL_CUSTOM_CACHE" in modes
+
+    else:
+        raise ValueError("cache type must be S3 or LOCAL")
+
+    cache_paths = None
+    if custom_paths:
+        cache_paths = cache.get("paths") or [
+            path for runtime in sorted(runtime_versions) for path in DEFAULT_CACHE_PATHS.get(runtime, [])
+        ] or None
+    return settings, cache_paths
+
+def project_summary(project):
+    """The parts of a project description worth logging"""
+    environment = project.get("environment") or {}
+    return remove_none_attributes({
+        "name": project.get("name"),
+        "arn": project.get("arn"),
+        "image": environment.get("image"),
+        "computeType": environment.get("computeType"),
+        "lastModified": project.get("lastModified")
+    })
+
 def gen_codebuild_arn(codebuild_project_name, region, account_number):
     return f"arn:aws:codebuild:{region}:{account_number}:project/{codebuild_project_name}"
 
 def gen_codebuild_link(codebuild_project_name):
     return f"https://console.aws.amazon.com/codesuite/codebuild/projects/{codebuild_project_name}"
 
-def get_container_image(runtime_versions):
+def gen_build_batch_link(codebuild_project_name, build_batch_id):
+    return f"https://console.aws.amazon.com/codesuite/codebuild/projects/{codebuild_project_name}/batch/{quote(build_batch_id, safe='')}"
+
+def gen_build_link(codebuild_project_name, build_id):
+    return f"https://console.aws.amazon.com/codesuite/codebuild/projects/{codebuild_project_name}/build/{quote(build_id, safe='')}"
+
+def get_container_image(runtime_versions, environment=None):
     """Returns the container image for the given runtime versions.
 
     Runtime versions is a dict of runtime name to version. For example:
@@ -296,127 +1274,14 @@ def get_container_image(runtime_versions):
         "dotnet": 3.1,
         "nodejs": 12,
         }
+    The image catalog and preference order live in images.json. environment
+    is an ENVIRONMENT_TYPES entry, which limits the image to its compute and
+    architecture; EC2 environments use their base image.
     """
-    processed_runtime_versions = [f"{k}{v}" for k, v in runtime_versions.items()]
-
-    for image, runtimes in IMAGE_TO_RUNTIME_MAPPING.items():
-        if set(processed_runtime_versions).issubset(runtimes):
-            return image
-
-  
-# Can be scraped from https://docs.aws.amazon.com/codebuild/latest/userguide/build-env-ref-available.html
-IMAGE_TO_RUNTIME_MAPPING = {
-    "aws/codebuild/amazonlinux2-x86_64-standard:3.0": [
-        "android28",
-        "android29",
-        "dotnet3.1",
-        "golang1.12",
-        "golang1.13",
-        "golang1.14",
-        "javacorretto8",
-        "javacorretto11",
-        "nodejs10",
-        "nodejs12",
-        "php7.3",
-        "php7.4",
-        "python3.7",
-        "python3.8",
-        "python3.9",
-        "ruby2.6",
-        "ruby2.7",
-    ],
-    "aws/codebuild/amazonlinux2-x86_64-standard:4.0": [
-        "dotnet6.0",
-        "golang1.18",
-        "javacorretto17",
-        "nodejs16",
-        "php8.1",
-        "python3.9",
-        "ruby3.1",
-    ],
-    "aws/codebuild/amazonlinux2-aarch64-standard:1.0": [
-        "golang1.12",
-        "golang1.13",
-        "javacorretto8",
-        "javacorretto11",
-        "nodejs8",
-        "nodejs10",
-        "nodejs12",
-        "php7.3",
-        "python3.7",
-        "python3.8",
-        "ruby2.6",
-    ],
-    "aws/codebuild/amazonlinux2-x86_64-standard:2.0": [
-        "dotnet3.1",
-        "golang1.12",
-        "golang1.13",
-        "golang1.14",
-        "javacorretto8",
-        "javacorretto11",
-        "nodejs10",
-        "nodejs12",
-        "php7.3",
-        "php7.4",
-        "python3.7",
-        "python3.8",
-        "python3.9",
-        "ruby2.6",
-        "ruby2.7",
-    ],
-    "aws/codebuild/standard:4.0": [
-        "android28",
-        "android29",
-        "dotnet3.1",
-        "golang1.12",
-        "golang1.13",
-        "golang1.14",
-        "javacorretto8",
-        "javacorretto11",
-        "nodejs10",
-        "nodejs12",
-        "php7.3",
-        "php7.4",
-        "python3.7",
-        "python3.8",
-        "python3.9",
-        "ruby2.6",
-        "ruby2.7",
-    ],
-    "aws/codebuild/standard:5.0": [
-        "dotnet3.1",
-        "dotnet5.0",
-        "golang1.15",
-        "golang1.16",
-        "javacorretto8",
-        "javacorretto11",
-        "nodejs12",
-        "nodejs14",
-        "php7.3",
-        "php7.4",
-        "php8.0",
-        "python3.7",
-        "python3.8",
-        "python3.9",
-        "ruby2.6",
-        "ruby2.7",
-    ],
-    "aws/codebuild/standard:6.0": [
-        "dotnet6.0",
-        "golang1.18",
-        "javacorretto17",
-        "nodejs16",
-        "php8.1",
-        "python3.10",
-        "ruby3.1",
-    ],
-    "aws/codebuild/standard:7.0": [
-        "dotnet6.0",
-        "golang1.20",
-        "javacorretto17",
-        "nodejs18",
-        "php8.2",
-        "python3.11",
-        "ruby3.2",
-    ]
-}
+    environment = environment or {}
+    if environment.get("default_image"):
+        return environment["default_image"]
+    return IMAGE_INDEX.resolve(
+        runtime_versions, compute=environment.get("compute") or "container",
+        architecture=environment.get("architecture")
+    )
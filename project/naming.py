@@ -0,0 +1,117 @@
+"""Derives the AWS-safe resource names CloudKommand components get.
+
+Names are pure functions of their inputs, so derivations are memoized for the
+life of the container; extensions call these with the same arguments on every
+invocation. The patterns are compiled once at import.
+
+How a name longer than max_chars is shortened is a pluggable strategy:
+    hash: the original behavior, "ck-" plus an MD5 of the full name
+    hashed_suffix: the name cut short plus "-" and 8 hex digits of its MD5,
+        so it stays readable and names that share a long prefix stay distinct
+"""
+import re
+import base64
+import hashlib
+import functools
+
+NAME_REGEX = r"^[a-zA-Z0-9\-\_]+$"
+LOWERCASE_NAME_REGEX = r"^[a-z0-9\-\_]+$"
+NO_UNDERSCORE_NAME_REGEX = r"^[a-zA-Z0-9\-]+$"
+NO_UNDERSCORE_LOWERCASE_NAME_REGEX = r"^[a-z0-9\-]+$"
+
+# By (no_underscores, no_uppercase)
+NAME_PATTERNS = {
+    (False, False): re.compile(NAME_REGEX),
+    (False, True): re.compile(LOWERCASE_NAME_REGEX),
+    (True, False): re.compile(NO_UNDERSCORE_NAME_REGEX),
+    (True, True): re.compile(NO_UNDERSCORE_LOWERCASE_NAME_REGEX)
+}
+
+NAME_CACHE_SIZE = 4096
+
+def safe_encode(string):
+    return base64.b32encode(string.encode("ascii")).decode("ascii").replace("=", "8")
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def safeval(string, no_underscores, no_uppercase):
+    if not NAME_PATTERNS[(bool(no_underscores), bool(no_uppercase))].match(string):
+        string = safe_encode(string).lower()
+    return string
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def process_repo_id(repo_id, no_underscores, no_uppercase):
+    if "<" in repo_id:
+        base_repo_id, folder = repo_id.split("<")
+    else:
+        base_repo_id = repo_id
+        folder = None
+    repo_provider = None
+    if base_repo_id.startswith("github.com/"):
+        _, owner_name, repo_name = base_repo_id.split("/")
+        repo_provider = "g"
+
+    elif base_repo_id.startswith("bitbucket."):
+        _, owner_name, repo_name = base_repo_id.split("/")
+        repo_provider = "b"
+
+    elif base_repo_id.startswith("gitlab.com/"):
+        _, owner_name, repo_name = base_repo_id.split("/")
+        repo_provider = "l"
+
+    elif len(base_repo_id.split("/")) == 5:
+        # We assume it is a Bitbucket Server Repo
+        _, _, owner_name, _, repo_name = base_repo_id.split("/")
+        repo_name = repo_name.lower()
+        repo_provider = "bs"
+
+    owner_name = safeval(owner_name, no_underscores, no_uppercase)
+    repo_name = safeval(repo_name, no_underscores, no_uppercase)
+    folder = safeval(folder.replace("/", ""), no_underscores, no_uppercase) if folder else None
+
+    return repo_provider, owner_name, repo_name, folder
+
+def hash_strategy(full_name, max_chars):
+    full_name = f"ck-{hashlib.md5(full_name.encode()).hexdigest()}"
+    return full_name[:max_chars]
+
+def hashed_suffix_strategy(full_name, max_chars):
+    suffix = hashlib.md5(full_name.encode()).hexdigest()[:8]
+    if max_chars <= len(suffix) + 1:
+        return suffix[:max_chars]
+    return f"{full_name[:max_chars - len(suffix) - 1].rstrip('-')}-{suffix}"
+
+NAME_STRATEGIES = {
+    "hash": hash_strategy,
+    "hashed_suffix": hashed_suffix_strategy
+}
+
+def register_name_strategy(name, strategy):
+    """Adds a strategy, a function of (full_name, max_chars) returning a name
+    of at most max_chars, that component_safe_name can be asked to use"""
+    NAME_STRATEGIES[name] = strategy
+    component_safe_name.cache_clear()
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def component_safe_name(project_code, repo_id, component_name, no_underscores=False, no_uppercase=False, max_chars=64, strategy="hash"):
+    if strategy not in NAME_STRATEGIES:
+        raise ValueError(f"Unknown name strategy {strategy}, must be one of {list(NAME_STRATEGIES)}")
+    provider, owner, repo, folder = process_repo_id(repo_id, no_underscores, no_uppercase)
+    component_name = safeval(component_name, no_underscores, no_uppercase)
+
+    if folder:
+        full_name = f"ck-{project_code}-{provider}-{owner}-{repo}-{folder}-{component_name}"
+    else:
+        full_name = f"ck-{project_code}-{provider}-{owner}-{repo}-{component_name}"
+
+    if len(full_name) > max_chars:
+        full_name = NAME_STRATEGIES[strategy](full_name, max_chars)
+    return full_name
+
+def find_name_collisions(names):
+    """Takes a dict of component name to resource name and returns the
+    resource names claimed by more than one component, each with the sorted
+    list of components claiming it."""
+    claimed = {}
+    for component, name in names.items():
+        claimed.setdefault(name, []).append(component)
+    return {name: sorted(components) for name, components in claimed.items() if len(components) > 1}
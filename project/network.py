@@ -0,0 +1,93 @@
+"""VPC access and EFS file systems for builds that reach internal resources.
+
+Builds in a VPC can pull dependencies from mirrors inside it, and EFS file
+systems mounted into the build can hold a warm dependency cache shared by
+every build. EFS is reached over the VPC, so mounting one needs a VPC too.
+Builds sharing these capped resources can be limited with
+concurrent_build_limit.
+"""
+import re
+
+from extutil import remove_none_attributes
+
+# CodeBuild accepts at most this many of each
+MAX_SUBNETS = 16
+MAX_SECURITY_GROUPS = 5
+
+VPC_ID_REGEX = re.compile(r"^vpc-[0-9a-f]+$")
+SUBNET_ID_REGEX = re.compile(r"^subnet-[0-9a-f]+$")
+SECURITY_GROUP_ID_REGEX = re.compile(r"^sg-[0-9a-f]+$")
+# Identifiers become the CODEBUILD_<identifier> environment variable
+FILE_SYSTEM_IDENTIFIER_REGEX = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+# file-system-id.efs.region.amazonaws.com:/path
+EFS_LOCATION_REGEX = re.compile(r"^fs-[0-9a-f]+\.efs\.[a-z0-9-]+\.amazonaws\.com(\.cn)?:/.*$")
+
+def resolve_vpc_config(cdef):
+    """Returns vpcConfig for cdef["vpc_config"], or None. Subnets and security
+    groups are sorted, so reordering them is not a change. Raises ValueError
+    for invalid ids."""
+    vpc = cdef.get("vpc_config")
+    if not vpc:
+        return None
+    vpc_id = vpc.get("vpc_id")
+    if not isinstance(vpc_id, str) or not VPC_ID_REGEX.match(vpc_id):
+        raise ValueError(f"vpc_config vpc_id must be a VPC id like vpc-0123abcd, not {vpc_id}")
+    subnets = _check_ids(vpc.get("subnets"), SUBNET_ID_REGEX, "subnets", "subnet-0123abcd", MAX_SUBNETS)
+    security_group_ids = _check_ids(
+        vpc.get("security_group_ids"), SECURITY_GROUP_ID_REGEX, "security_group_ids", "sg-0123abcd", MAX_SECURITY_GROUPS
+    )
+    return {"vpcId": vpc_id, "subnets": subnets, "securityGroupIds": security_group_ids}
+
+def resolve_file_system_locations(cdef, vpc_config, lambda_compute=False):
+    """Returns fileSystemLocations for cdef["file_system_locations"]. Raises
+    ValueError for invalid entries, or if they cannot be mounted."""
+    entries = cdef.get("file_system_locations") or []
+    if not entries:
+        return []
+    if not vpc_config:
+        raise ValueError("file_system_locations are reached over a VPC, so vpc_config is required")
+    if lambda_compute:
+        raise ValueError("Lambda compute cannot mount file_system_locations")
+
+    identifiers = [e.get("identifier") for e in entries]
+    mount_points = [e.get("mount_point") for e in entries]
+    invalid = [i for i in identifiers if not isinstance(i, str) or not FILE_SYSTEM_IDENTIFIER_REGEX.match(i)]
+    if invalid:
+        raise ValueError(f"file_system_locations identifiers must start with a letter and be letters, numbers and underscores, not {invalid}")
+    if len(set(identifiers)) != len(identifiers):
+        raise ValueError("file_system_locations identifiers must be unique")
+    if not all(isinstance(m, str) and m.startswith("/") for m in mount_points):
+        raise ValueError("file_system_locations mount_point must be an absolute path")
+    if len(set(mount_points)) != len(mount_points):
+        raise ValueError("file_system_locations mount points must be unique")
+
+    locations = []
+    for entry in entries:
+        if not EFS_LOCATION_REGEX.match(entry.get("location") or ""):
+            raise ValueError(f"file system {entry['identifier']} location must look like fs-0123abcd.efs.us-east-1.amazonaws.com:/path")
+        locations.append(remove_none_attributes({
+            "type": "EFS",
+            "identifier": entry["identifier"],
+            "location": entry["location"],
+            "mountPoint": entry["mount_point"],
+            "mountOptions": entry.get("mount_options")
+        }))
+    return locations
+
+def resolve_concurrent_build_limit(cdef):
+    """Returns cdef["concurrent_build_limit"], or None. Raises ValueError
+    unless it is a positive integer."""
+    limit = cdef.get("concurrent_build_limit")
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 1):
+        raise ValueError(f"concurrent_build_limit must be a positive integer, not {limit}")
+    return limit
+
+def _check_ids(ids, regex, field, example, most):
+    ids = ids or []
+    invalid = [i for i in ids if not isinstance(i, str) or not regex.match(i)]
+    if invalid:
+        raise ValueError(f"vpc_config {field} must be ids like {example}, not {invalid}")
+    ids = sorted(set(ids))
+    if not ids or len(ids) > most:
+        raise ValueError(f"vpc_config needs between 1 and {most} {field}")
+    return ids
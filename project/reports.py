@@ -0,0 +1,124 @@
+"""Report groups that collect the test and coverage reports builds produce.
+
+    "report_groups": {
+        "unit": {
+            "format": "JUNITXML",
+            "files": ["**/*"],
+            "base_directory": "test-reports",
+            "export": {"s3_bucket": "reports-bucket", "s3_prefix": "unit", "packaging": "ZIP"}
+        }
+    }
+
+Each group is created as a resource of its own, named after the project and
+its key, and the buildspec reports section refers to it by ARN. The ARN is
+known before the group exists, so the buildspec can be rendered up front and
+builds report into the managed group rather than one CodeBuild would create.
+"""
+import re
+
+from naming import hashed_suffix_strategy
+from extutil import remove_none_attributes
+
+REPORT_FORMATS = {
+    "TEST": ["JUNITXML", "CUCUMBERJSON", "TESTNGXML", "NUNITXML", "NUNIT3XML", "VISUALSTUDIOTRX"],
+    "CODE_COVERAGE": ["JACOCOXML", "CLOVERXML", "COBERTURAXML", "SIMPLECOV"]
+}
+PACKAGING = ["NONE", "ZIP"]
+KEY_REGEX = re.compile(r"^[A-Za-z0-9_\-]+$")
+MAX_NAME_CHARS = 128
+
+def report_group_name(project_name, key):
+    name = f"{project_name}-{key}"
+    if len(name) > MAX_NAME_CHARS:
+        name = hashed_suffix_strategy(name, MAX_NAME_CHARS)
+    return name
+
+def report_group_arn(name, region, account_number):
+    return f"arn:aws:codebuild:{region}:{account_number}:report-group/{name}"
+
+def resolve_report_groups(cdef, project_name, region, account_number):
+    """Returns a dict of key to {"arn", "name", "type", "exportConfig",
+    "reports"} for cdef["report_groups"], where reports is the entry for the
+    buildspec reports section. Raises ValueError for invalid definitions."""
+    groups = {}
+    for key, definition in (cdef.get("report_groups") or {}).items():
+        if not KEY_REGEX.match(key):
+            raise ValueError(f"report group keys must be letters, numbers, hyphens and underscores, not {key}")
+        file_format = (definition.get("format") or "").upper()
+        report_type = next((t for t, formats in REPORT_FORMATS.items() if file_format in formats), None)
+        if not report_type:
+            raise ValueError(f"report group {key} format must be one of {REPORT_FORMATS}")
+        if not definition.get("files"):
+            raise ValueError(f"report group {key} needs files")
+
+        name = report_group_name(project_name, key)
+        groups[key] = {
+            "arn": report_group_arn(name, region, account_number),
+            "name": name,
+            "type": report_type,
+            "exportConfig": export_config(definition.get("export"), key),
+            "reports": remove_none_attributes({
+                "files": definition["files"],
+                "base-directory": definition.get("base_directory"),
+                "discard-paths": None if definition.get("discard_paths") is None else
+                    ("yes" if definition["discard_paths"] else "no"),
+                "file-format": file_format
+            })
+        }
+    return groups
+
+def export_config(export, key):
+    if not export:
+        return {"exportConfigType": "NO_EXPORT"}
+    if not export.get("s3_bucket"):
+        raise ValueError(f"report group {key} export needs an s3_bucket")
+    packaging = (export.get("packaging") or "NONE").upper()
+    if packaging not in PACKAGING:
+        raise ValueError(f"report group {key} export packaging must be one of {PACKAGING}")
+    return {
+        "exportConfigType": "S3",
+        "s3Destination": remove_none_attributes({
+            "bucket": export["s3_bucket"],
+            "path": export.get("s3_prefix"),
+            "packaging": packaging,
+            "encryptionKey": export.get("encryption_key"),
+            "encryptionDisabled": export.get("encryption_disabled")
+        })
+    }
+
+def buildspec_reports(groups, reports=None):
+    """The buildspec reports section: the managed groups by ARN, plus any
+    buildspec_reports passed through as is"""
+    return {**(reports or {}), **{g["arn"]: g["reports"] for g in groups.values()}} or None
+
+def report_group_ops(current, desired, prev_arns):
+    """Compares the report groups batch_get_report_groups found (by ARN)
+    with the desired ones and returns (create, update, delete): keys to
+    create, keys to update and ARNs to delete. A group whose type changed
+    is deleted and created again, as its type cannot be updated."""
+    create, update, delete = [], [], []
+    for key, group in desired.items():
+        found = current.get(group["arn"])
+        if not found:
+            create.append(key)
+        elif found.get("type") != group["type"]:
+            delete.append(group["arn"])
+            create.append(key)
+        elif not _same_export(found.get("exportConfig"), group["exportConfig"]):
+            update.append(key)
+    desired_arns = {g["arn"] for g in desired.values()}
+    delete.extend(arn for arn in prev_arns if arn not in desired_arns and arn in current)
+    return create, update, delete
+
+def _same_export(current, desired):
+    current = current or {"exportConfigType": "NO_EXPORT"}
+    if current.get("exportConfigType") != desired["exportConfigType"]:
+        return False
+    if desired["exportConfigType"] != "S3":
+        return True
+    found = current.get("s3Destination") or {}
+    wanted = desired["s3Destination"]
+    defaults = {"packaging": "NONE", "encryptionDisabled": False}
+    # CodeBuild fills in the default key when none is given
+    keys = ["bucket", "path", "packaging", "encryptionDisabled"] + (["encryptionKey"] if "encryptionKey" in wanted else [])
+    return all(found.get(k, defaults.get(k)) == wanted.get(k, defaults.get(k)) for k in keys)
@@ -0,0 +1,108 @@
+"""Picks a CodeBuild compute type from a project's recorded build history.
+
+Everything here is pure: history goes in, a recommendation comes out, and no
+AWS calls are made. The handler keeps the history in component state.
+
+A history entry is a dict with:
+    compute_type: the compute type the build ran on
+    duration_sec: how long the build took
+    status: the CodeBuild build status (SUCCEEDED, FAILED, TIMED_OUT, ...)
+    memory_pressure, cpu_pressure: optional 0-1 utilization peaks, when known
+"""
+
+GENERAL_LADDER = [
+    "BUILD_GENERAL1_SMALL", "BUILD_GENERAL1_MEDIUM",
+    "BUILD_GENERAL1_LARGE", "BUILD_GENERAL1_2XLARGE"
+]
+ARM_LADDER = ["BUILD_GENERAL1_SMALL", "BUILD_GENERAL1_LARGE"]
+LAMBDA_LADDER = [
+    "BUILD_LAMBDA_1GB", "BUILD_LAMBDA_2GB", "BUILD_LAMBDA_4GB",
+    "BUILD_LAMBDA_8GB", "BUILD_LAMBDA_10GB"
+]
+
+DEFAULTS = {
+    "window": 5,
+    # Builds faster than this with low pressure can step down a size
+    "fast_build_sec": 120,
+    # Builds slower than this, or under high pressure, step up a size
+    "slow_build_sec": 900,
+    "high_pressure": 0.85,
+    "low_pressure": 0.5,
+    # Lambda compute stops builds at 15 minutes; leave headroom
+    "lambda_max_sec": 600
+}
+
+def recommend(history, current=None, allow_lambda=False, arm=False, **settings):
+    """Returns {"compute_type", "lambda", "reason"} for the next build.
+
+    current is the compute type in use now. allow_lambda says Lambda compute
+    may be used (the caller has checked the image, privileged mode and cache
+    settings allow it), and arm says the build runs on ARM containers.
+    """
+    settings = {**DEFAULTS, **settings}
+    ladder = ARM_LADDER if arm else GENERAL_LADDER
+    recent = [h for h in (history or []) if h.get("duration_sec") is not None][-settings["window"]:]
+
+    if allow_lambda and recent and all(
+        h["duration_sec"] <= settings["lambda_max_sec"] and h.get("status") != "TIMED_OUT" for h in recent
+    ):
+        ladder = LAMBDA_LADDER
+        if current not in LAMBDA_LADDER:
+            current = "BUILD_LAMBDA_2GB"
+    elif current not in ladder:
+        current = None
+
+    if not recent:
+        compute_type = current or ladder[1]
+        return _result(compute_type, "No build history, starting one size above the smallest")
+
+    position = ladder.index(current) if current else 1
+    on_current = [h for h in recent if h.get("compute_type") == ladder[position]]
+    if not on_current:
+        # Builds on another size say nothing about this one
+        return _result(ladder[position], f"Keeping size: no builds on {ladder[position]} yet")
+    median, pressure, timed_out = _signals(on_current)
+
+    if timed_out or median > settings["slow_build_sec"] or (pressure is not None and pressure >= settings["high_pressure"]):
+        position = min(position + 1, len(ladder) - 1)
+        reason = f"Stepping up: median {median}s, peak pressure {pressure}, timed out {timed_out}"
+    elif median < settings["fast_build_sec"] and (pressure is None or pressure < settings["low_pressure"]) \
+            and position > 0 and not _struggled(history, ladder[position - 1], settings):
+        position -= 1
+        reason = f"Stepping down: median {median}s, peak pressure {pressure}"
+    else:
+        reason = f"Keeping size: median {median}s, peak pressure {pressure}"
+    return _result(ladder[position], reason)
+
+def _signals(entries):
+    durations = sorted(h["duration_sec"] for h in entries)
+    pressures = [
+        max(h.get("memory_pressure") or 0, h.get("cpu_pressure") or 0) for h in entries
+        if h.get("memory_pressure") is not None or h.get("cpu_pressure") is not None
+    ]
+    return (
+        durations[len(durations) // 2],
+        max(pressures) if pressures else None,
+        any(h.get("status") == "TIMED_OUT" for h in entries)
+    )
+
+def _struggled(history, compute_type, settings):
+    """True if builds on compute_type were too slow or pressured, so stepping
+    back down to it would just oscillate"""
+    entries = [h for h in (history or []) if h.get("compute_type") == compute_type and h.get("duration_sec") is not None]
+    if not entries:
+        return False
+    median, pressure, timed_out = _signals(entries[-settings["window"]:])
+    return timed_out or median > settings["slow_build_sec"] or (pressure is not None and pressure >= settings["high_pressure"])
+
+def _result(compute_type, reason):
+    return {
+        "compute_type": compute_type,
+        "lambda": compute_type in LAMBDA_LADDER,
+        "reason": reason
+    }
+
+def record_build(history, entry, max_entries=20):
+    """Returns history with entry added, keeping one entry per build id"""
+    history = [h for h in (history or []) if h.get("id") != entry.get("id") or not entry.get("id")]
+    return (history + [entry])[-max_entries:]
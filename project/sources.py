@@ -0,0 +1,75 @@
+"""Secondary sources and artifacts, and the props that describe build outputs.
+
+S3 sources can be pinned to an object version, so a new version of the same
+key is built by updating the project rather than by copying the object to a
+new key between pipeline stages.
+"""
+import re
+
+from extutil import remove_none_attributes
+
+# CodeBuild accepts at most this many secondary sources, and secondary artifacts
+MAX_SECONDARY = 12
+IDENTIFIER_REGEX = re.compile(r"^[A-Za-z][A-Za-z0-9_]{0,127}$")
+
+def resolve_secondary_sources(cdef):
+    """Returns (secondarySources, secondarySourceVersions) for cdef["secondary_sources"].
+
+    Each entry is either an S3 object ({"identifier", "s3_bucket",
+    "s3_object", "s3_object_version"}) or a CodeBuild source with a "type",
+    plus an optional "source_version". Raises ValueError for invalid entries.
+    """
+    entries = cdef.get("secondary_sources") or []
+    _check_identifiers(entries, "secondary_sources")
+
+    sources, versions = [], []
+    for entry in entries:
+        identifier = entry["identifier"]
+        if entry.get("type"):
+            source = {k: v for k, v in entry.items() if k not in ["identifier", "source_version"]}
+        elif entry.get("s3_bucket") and entry.get("s3_object"):
+            source = {"type": "S3", "location": f"{entry['s3_bucket']}/{entry['s3_object']}"}
+        else:
+            raise ValueError(f"secondary source {identifier} needs a type, or an s3_bucket and s3_object")
+        sources.append({**source, "sourceIdentifier": identifier})
+
+        version = entry.get("source_version") or entry.get("s3_object_version")
+        if version:
+            versions.append({"sourceIdentifier": identifier, "sourceVersion": version})
+    return sources, versions
+
+def resolve_secondary_artifacts(cdef):
+    """Returns secondaryArtifacts for cdef["secondary_artifacts"], a list of
+    CodeBuild artifacts each with an "identifier". Raises ValueError for
+    invalid entries."""
+    entries = cdef.get("secondary_artifacts") or []
+    _check_identifiers(entries, "secondary_artifacts")
+    artifacts = []
+    for entry in entries:
+        if not entry.get("type"):
+            raise ValueError(f"secondary artifact {entry['identifier']} needs a type")
+        artifact = {k: v for k, v in entry.items() if k != "identifier"}
+        artifacts.append({**artifact, "artifactIdentifier": entry["identifier"]})
+    return artifacts
+
+def _check_identifiers(entries, field):
+    if len(entries) > MAX_SECONDARY:
+        raise ValueError(f"{field} accepts at most {MAX_SECONDARY} entries")
+    identifiers = [e.get("identifier") for e in entries]
+    invalid = [i for i in identifiers if not isinstance(i, str) or not IDENTIFIER_REGEX.match(i)]
+    if invalid:
+        raise ValueError(f"{field} identifiers must start with a letter and be letters, numbers and underscores, not {invalid}")
+    if len(set(identifiers)) != len(identifiers):
+        raise ValueError(f"{field} identifiers must be unique")
+
+def artifact_location(artifact):
+    """Where an S3 artifact lands, as {"bucket", "key", "packaging"}, or None
+    for other artifact types. With packaging NONE the key is a prefix."""
+    if (artifact or {}).get("type") != "S3":
+        return None
+    key = "/".join(part for part in [artifact.get("path"), artifact.get("name")] if part)
+    return remove_none_attributes({
+        "bucket": artifact.get("location"),
+        "key": key or None,
+        "packaging": artifact.get("packaging") or "NONE"
+    })
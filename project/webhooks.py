@@ -0,0 +1,139 @@
+"""Compiles the webhook component definition into CodeBuild webhook settings.
+
+See https://docs.aws.amazon.com/codebuild/latest/userguide/github-webhook-events.html
+
+    "webhook": {
+        "build_type": "BUILD",
+        "filter_groups": [{
+            "events": ["PUSH"],
+            "branch": "main",
+            "file_path": "^src/",
+            "exclude": {"commit_message": "\\[skip ci\\]"}
+        }]
+    }
+
+Each filter group becomes a list of CodeBuild filters, and a build starts
+when every filter in any one group matches. A webhook of true builds every
+push. The webhook is managed with its own API calls, so it is compared with
+what the project reports and created, updated or deleted on its own.
+"""
+import re
+
+WEBHOOK_SOURCE_TYPES = ["GITHUB", "GITHUB_ENTERPRISE", "BITBUCKET", "GITLAB", "GITLAB_SELF_MANAGED"]
+BUILD_TYPES = ["BUILD", "BUILD_BATCH"]
+
+PULL_REQUEST_EVENTS = [
+    "PULL_REQUEST_CREATED", "PULL_REQUEST_UPDATED", "PULL_REQUEST_REOPENED",
+    "PULL_REQUEST_MERGED", "PULL_REQUEST_CLOSED"
+]
+EVENTS = ["PUSH", *PULL_REQUEST_EVENTS, "RELEASED", "PRERELEASED", "WORKFLOW_JOB_QUEUED"]
+
+# Group keys and the filter types they compile to. branch, base_branch and
+# tag take plain names; the rest are regular expressions.
+FILTER_TYPES = {
+    "head_ref": "HEAD_REF",
+    "base_ref": "BASE_REF",
+    "file_path": "FILE_PATH",
+    "actor_account_id": "ACTOR_ACCOUNT_ID",
+    "commit_message": "COMMIT_MESSAGE",
+    "release_name": "RELEASE_NAME",
+    "tag_name": "TAG_NAME",
+    "workflow_name": "WORKFLOW_NAME"
+}
+NAME_FILTERS = {
+    "branch": ("HEAD_REF", "refs/heads/"),
+    "tag": ("HEAD_REF", "refs/tags/"),
+    "base_branch": ("BASE_REF", "refs/heads/")
+}
+# Filter types CodeBuild only accepts alongside these events
+FILTER_EVENTS = {
+    "BASE_REF": PULL_REQUEST_EVENTS,
+    "COMMIT_MESSAGE": ["PUSH"],
+    "RELEASE_NAME": ["RELEASED", "PRERELEASED"],
+    "TAG_NAME": ["RELEASED", "PRERELEASED"],
+    "WORKFLOW_NAME": ["WORKFLOW_JOB_QUEUED"]
+}
+
+def compile_webhook(webhook, source=None, build_batch_config=None):
+    """Returns {"filterGroups", "buildType"} for the webhook component
+    definition, or None if there is none. Raises ValueError if it is
+    invalid or cannot work with the project's source or batch settings."""
+    if not webhook:
+        return None
+    if webhook is True:
+        webhook = {}
+
+    source_type = (source or {}).get("type")
+    if source_type not in WEBHOOK_SOURCE_TYPES:
+        raise ValueError(f"webhooks need a source of type {WEBHOOK_SOURCE_TYPES}, not {source_type or 'S3'}")
+
+    build_type = webhook.get("build_type") or "BUILD"
+    if build_type not in BUILD_TYPES:
+        raise ValueError(f"webhook build_type must be one of {BUILD_TYPES}")
+    if build_type == "BUILD_BATCH" and not build_batch_config:
+        raise ValueError("webhook build_type BUILD_BATCH needs build_batch to be enabled")
+
+    groups = webhook.get("filter_groups") or [{"events": ["PUSH"]}]
+    return {
+        "filterGroups": [_compile_group(group, i) for i, group in enumerate(groups)],
+        "buildType": build_type
+    }
+
+def _compile_group(group, index):
+    events = group.get("events")
+    if isinstance(events, str):
+        events = [events]
+    if not events:
+        raise ValueError(f"webhook filter group {index} needs events")
+    unknown = [e for e in events if e not in EVENTS]
+    if unknown:
+        raise ValueError(f"webhook filter group {index} has unknown events {unknown}, must be from {EVENTS}")
+
+    filters = [{"type": "EVENT", "pattern": ", ".join(events), "excludeMatchedPattern": False}]
+    for key, value in group.items():
+        if key in ["events", "exclude"]:
+            continue
+        filters.append(_compile_filter(key, value, False, index))
+    for key, value in (group.get("exclude") or {}).items():
+        filters.append(_compile_filter(key, value, True, index))
+
+    for f in filters:
+        allowed = FILTER_EVENTS.get(f["type"])
+        if allowed and not set(events) <= set(allowed):
+            raise ValueError(f"webhook filter group {index} uses {f['type']}, which only works with events {allowed}")
+    return filters
+
+def _compile_filter(key, value, exclude, index):
+    if key in NAME_FILTERS:
+        filter_type, prefix = NAME_FILTERS[key]
+        pattern = f"^{prefix}{re.escape(value)}$"
+    elif key in FILTER_TYPES:
+        filter_type, pattern = FILTER_TYPES[key], value
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"webhook filter group {index} has an invalid {key} pattern: {e}")
+    else:
+        raise ValueError(f"webhook filter group {index} has unknown key {key}, must be one of {list(NAME_FILTERS) + list(FILTER_TYPES)}")
+    return {"type": filter_type, "pattern": pattern, "excludeMatchedPattern": exclude}
+
+def webhook_op(current, desired):
+    """The op that makes the project's webhook, as batch_get_projects reports
+    it, match the compiled desired one: create_webhook, update_webhook,
+    delete_webhook, or None if they already match"""
+    if not current:
+        return "create_webhook" if desired else None
+    if not desired:
+        return "delete_webhook"
+    if (current.get("buildType") or "BUILD") != desired["buildType"]:
+        return "update_webhook"
+    if _normalize_groups(current.get("filterGroups")) != _normalize_groups(desired["filterGroups"]):
+        return "update_webhook"
+    return None
+
+def _normalize_groups(groups):
+    """Filter groups with the order of groups and filters ignored"""
+    return sorted(
+        sorted((f["type"], f["pattern"], bool(f.get("excludeMatchedPattern"))) for f in group)
+        for group in groups or []
+    )
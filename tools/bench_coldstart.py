@@ -0,0 +1,162 @@
+"""Measures the cold start of the extension: what a fresh Lambda container
+pays before and during its first invocation, here and in a baseline tree.
+
+Each run starts a fresh interpreter with dummy AWS credentials and Lambda
+environment variables, and times:
+    import_sec: importing lambda_function
+    client_sec: building the real botocore codebuild client, through
+        get_client where it exists; trees that build clients at import
+        pay for this in import_sec instead
+    cached_client_sec: a second get_client call, answered from its memo
+    ready_sec: import_sec plus client_sec, the time until a call can be made
+    first_invocation_sec, second_invocation_sec: lambda_handler calls with
+        a FakeCodeBuild standing in for the client, so no request is sent
+
+The baseline is the tree before get_client made clients lazy, extracted
+with git archive, unless --baseline-rev names another commit:
+
+    python tools/bench_coldstart.py --runs 10
+
+Times are real seconds, so they vary by machine and are never compared
+against a stored baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+PROJECT_DIR = os.path.join(REPO_DIR, "project")
+METRICS = ["import_sec", "client_sec", "cached_client_sec", "ready_sec", "first_invocation_sec", "second_invocation_sec"]
+
+class Context:
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:codebuild-extension"
+
+def measure(project_dir):
+    """Runs in the fresh interpreter; nothing from the project may be imported before this"""
+    for key, value in {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_LAMBDA_LOG_GROUP_NAME": "/aws/lambda/codebuild-extension",
+        "AWS_LAMBDA_LOG_STREAM_NAME": "2024/01/01/[$LATEST]0123456789abcdef",
+        "AWS_LAMBDA_FUNCTION_NAME": "codebuild-extension",
+        "codebuild_role_arn": "arn:aws:iam::123456789012:role/codebuild-role"
+    }.items():
+        os.environ.setdefault(key, value)
+    sys.path.insert(0, project_dir)
+    sys.path.insert(1, TOOLS_DIR)
+
+    start = time.perf_counter()
+    import lambda_function
+    import_sec = time.perf_counter() - start
+
+    import extutil
+    client_sec = cached_client_sec = 0.0
+    if hasattr(extutil, "get_client"):
+        start = time.perf_counter()
+        extutil.get_client("codebuild")
+        client_sec = time.perf_counter() - start
+        start = time.perf_counter()
+        extutil.get_client("codebuild")
+        cached_client_sec = time.perf_counter() - start
+
+    from benchmark import component_def
+    from fake_codebuild import FakeCodeBuild
+    backend = FakeCodeBuild(latency_sec=0)
+    if hasattr(extutil, "override_client"):
+        extutil.override_client("codebuild", backend)
+    else:
+        lambda_function.codebuild = backend
+
+    times = []
+    for index in range(2):
+        event = {
+            "project_code": "bench", "repo_id": "github.com/cloudkommand/bench", "bucket": "ck-bench-artifacts",
+            "component_name": f"build{index}", "component_def": component_def(index), "op": "upsert", "prev_state": {}
+        }
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lambda_function.lambda_handler(event, Context())
+        times.append(time.perf_counter() - start)
+
+    return {
+        "import_sec": import_sec,
+        "client_sec": client_sec,
+        "cached_client_sec": cached_client_sec,
+        "ready_sec": import_sec + client_sec,
+        "first_invocation_sec": times[0],
+        "second_invocation_sec": times[1],
+        "modules": len(sys.modules)
+    }
+
+def run_fresh(project_dir):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", project_dir],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def default_baseline_rev():
+    """The commit before get_client was added"""
+    commits = subprocess.run(
+        ["git", "log", "--format=%H", "-S", "def get_client", "--", "project/extutil.py"],
+        cwd=REPO_DIR, check=True, capture_output=True, text=True
+    ).stdout.split()
+    return f"{commits[-1]}^" if commits else None
+
+def extract(rev, path):
+    archive = subprocess.run(["git", "archive", rev, "project"], cwd=REPO_DIR, check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(path)
+    return os.path.join(path, "project")
+
+def summarize(runs):
+    return {
+        metric: round(statistics.median(r[metric] for r in runs), 6) for metric in METRICS
+    } | {"modules": runs[-1]["modules"]}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start per tree")
+    parser.add_argument("--baseline-rev", help="commit to compare against")
+    parser.add_argument("--no-baseline", action="store_true", help="only measure this tree")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--child", metavar="PROJECT_DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return 0
+
+    results = {"current": summarize([run_fresh(PROJECT_DIR) for _ in range(args.runs)])}
+    rev = None if args.no_baseline else args.baseline_rev or default_baseline_rev()
+    if rev:
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline_dir = extract(rev, tmp)
+            results["baseline"] = summarize([run_fresh(baseline_dir) for _ in range(args.runs)])
+        results["baseline"]["rev"] = rev
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print(f"medians of {args.runs} runs" + (f", baseline {rev}" if rev else ""))
+    print(f"{'metric':<24}{'current s':>12}" + (f"{'baseline s':>12}" if rev else ""))
+    for metric in METRICS:
+        row = f"{metric:<24}{results['current'][metric]:>12.6f}"
+        if rev:
+            row += f"{results['baseline'][metric]:>12.6f}"
+        print(row)
+    print(f"{'modules':<24}{results['current']['modules']:>12}" + (f"{results['baseline']['modules']:>12}" if rev else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Measures the extension on large project descriptions: many environment
+variables, long command lists, report groups and tags, with the build history
+and applied spec that grow in state alongside them.
+
+Each scenario runs at the INFO and DEBUG print levels and reports real time
+and the bytes printed to stdout, which CloudWatch Logs ingests and bills for:
+
+    python tools/bench_large_project.py --env-vars 500 --commands 200
+
+At INFO, printed bytes should stay flat as the description grows.
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+from benchmark import component_def
+from fake_codebuild import FakeCodeBuild
+from harness import Harness
+import extutil
+
+def large_component_def(args, index=0, **overrides):
+    commands = [f"python scripts/step_{i}.py --verbose --output build/step_{i}" for i in range(args.commands)]
+    return component_def(
+        index,
+        environment_variables={f"SETTING_{i}": f"value-{i}-" + "x" * 40 for i in range(args.env_vars)},
+        install_commands=commands[:args.commands // 4],
+        build_commands=commands,
+        post_build_commands=commands[:args.commands // 4],
+        report_groups={
+            f"suite-{i}": {"format": "JUNITXML", "files": ["**/*.xml"], "base_directory": f"reports/suite-{i}"}
+            for i in range(args.report_groups)
+        },
+        tags={f"team:tag-{i}": f"value-{i}" for i in range(args.tags)},
+        **overrides
+    )
+
+def create(harness, args):
+    return harness.deploy("build", large_component_def(args))
+
+def noop_redeploy(harness, args):
+    first = harness.deploy("build", large_component_def(args))
+    return harness.deploy("build", large_component_def(args), prev_state=first.prev_state)
+
+def update(harness, args):
+    first = harness.deploy("build", large_component_def(args))
+    changed = large_component_def(args, concurrent_build_limit=5)
+    return harness.deploy("build", changed, prev_state=first.prev_state)
+
+def build_and_wait(harness, args):
+    return harness.deploy("build", large_component_def(args, run_build=True))
+
+SCENARIOS = {
+    "create": create,
+    "noop_redeploy": noop_redeploy,
+    "update": update,
+    "build_and_wait": build_and_wait
+}
+LEVELS = ["INFO", "DEBUG"]
+
+def run_scenario(name, level, args):
+    default_level = extutil.PRINT_LEVEL
+    extutil.PRINT_LEVEL = extutil.LOG_LEVELS[level]
+    output = io.StringIO()
+    try:
+        with Harness(FakeCodeBuild(latency_sec=0), quiet=False) as harness, contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            # Setup deploys count towards the time and printed bytes too
+            outcome = SCENARIOS[name](harness, args)
+            real_sec = time.perf_counter() - start
+    finally:
+        extutil.PRINT_LEVEL = default_level
+
+    return {
+        "scenario": name,
+        "level": level,
+        "invocations": outcome.invocations,
+        "request_bytes": outcome.request_bytes,
+        "state_bytes": len(json.dumps(outcome.prev_state["state"], default=str)),
+        "printed_bytes": len(output.getvalue()),
+        "real_sec": round(real_sec, 4),
+        "error": outcome.error
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+        help=f"scenarios to run, all by default: {', '.join(SCENARIOS)}")
+    parser.add_argument("--env-vars", type=int, default=500, help="environment variables")
+    parser.add_argument("--commands", type=int, default=200, help="build commands")
+    parser.add_argument("--report-groups", type=int, default=20, help="report groups")
+    parser.add_argument("--tags", type=int, default=40, help="tags")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios {unknown}")
+
+    results = [run_scenario(name, level, args) for name in args.scenarios or SCENARIOS for level in LEVELS]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scenario':<16}{'level':>7}{'invocations':>12}{'sent bytes':>12}{'state bytes':>13}"
+            f"{'printed bytes':>15}{'real s':>9}  error")
+        for m in results:
+            print(f"{m['scenario']:<16}{m['level']:>7}{m['invocations']:>12}{m['request_bytes']:>12}{m['state_bytes']:>13}"
+                f"{m['printed_bytes']:>15}{m['real_sec']:>9.4f}  {m['error'] or ''}")
+    return 1 if any(m["error"] for m in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Micro-benchmarks the memoized name derivations in naming.py against the
+same functions with their caches bypassed.
+
+    python tools/bench_naming.py --number 20000
+
+memoized calls hit the lru_cache; unmemoized calls go through __wrapped__,
+which skips only the function's own cache, so component_safe_name still
+finds process_repo_id and safeval cached. cold calls clear every naming
+cache first, as a fresh container would.
+The batch rows derive the names of --components components once per
+invocation over --invocations invocations of one warm container, and show
+the cache hit rate. More components than NAME_CACHE_SIZE evict each other
+before they come round again, so every call misses and memoized calls are
+slower than unmemoized ones by the cache bookkeeping; the default rows
+include one such size to show it.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+import naming
+
+PROJECT_CODE = "bench"
+REPO_ID = "github.com/cloudkommand/codebuild-benchmarks"
+CACHED = [naming.safeval, naming.process_repo_id, naming.component_safe_name]
+
+def clear_caches():
+    for function in CACHED:
+        function.cache_clear()
+
+def cold_component_safe_name(*args):
+    clear_caches()
+    return naming.component_safe_name(*args)
+
+def per_call(stmt, number, setup=None):
+    """Best of five, in microseconds per call"""
+    if setup:
+        setup()
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+def single_calls(number):
+    name_args = (PROJECT_CODE, REPO_ID, "build-and-test")
+    long_args = (PROJECT_CODE, REPO_ID + "<services/payments/api", "integration-tests-" + "x" * 60)
+    rows = []
+    for label, args in [("component_safe_name", name_args), ("component_safe_name long", long_args)]:
+        rows.append((label, {
+            "memoized": per_call(lambda: naming.component_safe_name(*args), number, clear_caches),
+            "unmemoized": per_call(lambda: naming.component_safe_name.__wrapped__(*args), number),
+            "cold": per_call(lambda: cold_component_safe_name(*args), number)
+        }))
+    for label, value in [("safeval safe", "build-and-test"), ("safeval encoded", "build and test/v2")]:
+        rows.append((label, {
+            "memoized": per_call(lambda: naming.safeval(value, True, True), number),
+            "unmemoized": per_call(lambda: naming.safeval.__wrapped__(value, True, True), number),
+            "cold": per_call(lambda: (naming.safeval.cache_clear(), naming.safeval(value, True, True)), number)
+        }))
+    return rows
+
+def batch(components, invocations, use_cache):
+    derive = naming.component_safe_name if use_cache else naming.component_safe_name.__wrapped__
+    names = [f"component-{i}" for i in range(components)]
+    clear_caches()
+    seconds = min(timeit.repeat(
+        lambda: [derive(PROJECT_CODE, REPO_ID, name, True, True, 64) for name in names],
+        number=invocations, repeat=3
+    ))
+    info = naming.component_safe_name.cache_info()
+    hit_rate = info.hits / ((info.hits + info.misses) or 1) if use_cache else None
+    return seconds / (components * invocations) * 1e6, hit_rate
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="calls per timing")
+    parser.add_argument("--components", type=int, nargs="+", default=[100, 1000, naming.NAME_CACHE_SIZE + 1000],
+        help="components per invocation in the batch rows")
+    parser.add_argument("--invocations", type=int, default=20, help="invocations per batch row")
+    args = parser.parse_args(argv)
+
+    print(f"{'call':<28}{'memoized us':>13}{'unmemoized us':>15}{'cold us':>10}{'speedup':>9}")
+    for label, t in single_calls(args.number):
+        print(f"{label:<28}{t['memoized']:>13.3f}{t['unmemoized']:>15.3f}{t['cold']:>10.3f}"
+            f"{t['unmemoized'] / t['memoized']:>8.1f}x")
+
+    print()
+    print(f"{'batch components':<28}{'memoized us':>13}{'unmemoized us':>15}{'hit rate':>10}{'speedup':>9}")
+    for components in args.components:
+        memoized, hit_rate = batch(components, args.invocations, True)
+        unmemoized, _ = batch(components, args.invocations, False)
+        print(f"{components:<28}{memoized:>13.3f}{unmemoized:>15.3f}{hit_rate:>10.1%}{unmemoized / memoized:>8.1f}x")
+    clear_caches()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Runs the auto compute sizing loop in sizing.py against modelled projects,
+with no AWS calls, to show which size each settles on and how fast.
+
+    python tools/bench_sizing.py --runs 12
+
+Each profile models a project by the seconds its build takes on two vCPUs
+and the memory it peaks at. A build on a compute type takes that work
+divided by the type's vCPUs (a quarter of it never parallelizes), with
+--noise jitter, and reports memory pressure against the type's memory. A
+build running out of memory or past its timeout is TIMED_OUT.
+"""
+import argparse
+import os
+import random
+import sys
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+import sizing
+
+# vCPUs and memory in GB of each compute type
+COMPUTE = {
+    "BUILD_GENERAL1_SMALL": (2, 3),
+    "BUILD_GENERAL1_MEDIUM": (4, 7),
+    "BUILD_GENERAL1_LARGE": (8, 15),
+    "BUILD_GENERAL1_2XLARGE": (72, 145),
+    "BUILD_LAMBDA_1GB": (1, 1),
+    "BUILD_LAMBDA_2GB": (1, 2),
+    "BUILD_LAMBDA_4GB": (2, 4),
+    "BUILD_LAMBDA_8GB": (4, 8),
+    "BUILD_LAMBDA_10GB": (6, 10)
+}
+# Seconds on two vCPUs and peak memory in GB
+PROFILES = {
+    "lint": (60, 0.5),
+    "unit_tests": (400, 2),
+    "webpack": (900, 5),
+    "monorepo": (3000, 10),
+    "compile_heavy": (7200, 12)
+}
+TIMEOUT_SEC = 3600
+
+def simulate(build, runs, current=None, **kwargs):
+    """Runs the sizing loop: build(compute_type) returns a history entry for
+    one build on that compute type. Returns the compute type of each run."""
+    history, chosen = [], []
+    for _ in range(runs):
+        current = sizing.recommend(history, current, **kwargs)["compute_type"]
+        chosen.append(current)
+        history = sizing.record_build(history, {"compute_type": current, **build(current)})
+    return chosen
+
+def model(work_sec, memory_gb, noise, rng):
+    def build(compute_type):
+        vcpus, memory = COMPUTE[compute_type]
+        duration = work_sec * (0.25 + 0.75 * 2 / vcpus) * rng.uniform(1 - noise, 1 + noise)
+        pressure = min(memory_gb / memory, 1.0)
+        timed_out = pressure >= 1.0 or duration > TIMEOUT_SEC
+        return {
+            "duration_sec": int(min(duration, TIMEOUT_SEC)),
+            "status": "TIMED_OUT" if timed_out else "SUCCEEDED",
+            "memory_pressure": round(pressure, 2)
+        }
+    return build
+
+def short(compute_type):
+    return compute_type.rsplit("_", 1)[-1]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("profiles", nargs="*", metavar="profile",
+        help=f"profiles to run, all by default: {', '.join(PROFILES)}")
+    parser.add_argument("--runs", type=int, default=12, help="builds per profile")
+    parser.add_argument("--noise", type=float, default=0.1, help="relative jitter on build durations")
+    parser.add_argument("--allow-lambda", action="store_true", help="let short builds move to Lambda compute")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the jitter")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.profiles if name not in PROFILES]
+    if unknown:
+        parser.error(f"unknown profiles {unknown}")
+
+    print(f"{'profile':<16}{'settled on':>12}{'after runs':>12}  sizes")
+    for name in args.profiles or PROFILES:
+        build = model(*PROFILES[name], args.noise, random.Random(args.seed))
+        chosen = simulate(build, args.runs, allow_lambda=args.allow_lambda)
+        # The first run from which the size never changes again
+        settled = next(i for i in range(len(chosen)) if len(set(chosen[i:])) == 1)
+        print(f"{name:<16}{short(chosen[-1]):>12}{settled + 1:>12}  {' '.join(short(c) for c in chosen)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
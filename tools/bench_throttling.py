@@ -0,0 +1,129 @@
+"""Compares how quickly many components converge under throttling with each
+backoff strategy.
+
+Every component is deployed through lambda_handler on its own schedule: a
+component that is throttled calls back after the delay its BackoffPolicy
+chose, so jittered strategies spread retries out while exponential backoff
+sends them back together. FakeCodeBuild throttles at throttle_rate and above
+rate_limit calls per simulated second, and the codebuild RateEstimator is fed
+every call on the simulated clock, as the botocore hook would feed it on AWS.
+Each strategy runs with the default policy and with rate_floor, which makes
+throttled calls wait at least as long as the RateEstimator says.
+
+    python tools/bench_throttling.py --components 200 --throttle-rate 0.05 --rate-limit 20
+
+Convergence is the simulated time until the last component finished.
+"""
+import argparse
+import heapq
+import json
+import random
+import statistics
+import sys
+
+from botocore.exceptions import ClientError
+
+from benchmark import component_def
+from fake_codebuild import FakeCodeBuild
+from harness import Harness
+import extutil
+import lambda_function
+
+STRATEGIES = ["full", "decorrelated", "exponential"]
+
+class RecordingCodeBuild(FakeCodeBuild):
+    """Feeds every call to the codebuild RateEstimator"""
+
+    def _call(self, operation, params=None):
+        estimator = extutil.get_rate_estimator("codebuild")
+        try:
+            super()._call(operation, params)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in extutil.THROTTLING_ERROR_CODES:
+                estimator.record_throttle()
+            raise
+        estimator.record_success()
+
+def converge(strategy, args, estimator=False):
+    backend = RecordingCodeBuild(latency_sec=args.latency, throttle_rate=args.throttle_rate,
+        seed=args.seed, rate_limit=args.rate_limit)
+    default_policy = lambda_function.eh.backoff_policy
+    lambda_function.eh.backoff_policy = extutil.BackoffPolicy(strategy, rng=random.Random(args.seed), rate_floor=estimator)
+    extutil.rate_estimators["codebuild"] = extutil.RateEstimator(clock=lambda: backend.now)
+    try:
+        # Invocations due together run concurrently on AWS, so none waits on another here
+        with Harness(backend, invoke_overhead_sec=0) as harness:
+            events = {
+                f"build{i}": {**harness._shared(), **harness.component_event(f"build{i}", component_def(i))}
+                for i in range(args.components)
+            }
+            # Every component starts together, as a deploy of the whole project would
+            due = [(0.0, name) for name in events]
+            heapq.heapify(due)
+            finished, failed, invocations = {}, [], 0
+            while due:
+                at, name = heapq.heappop(due)
+                backend.now = max(backend.now, at)
+                result = harness._invoke(events[name])
+                invocations += 1
+                if result.get("success") or result.get("error"):
+                    finished[name] = backend.now
+                    if not result.get("success"):
+                        failed.append(name)
+                else:
+                    events[name]["pass_back_data"] = result["pass_back_data"]
+                    heapq.heappush(due, (backend.now + (result.get("callback_sec") or 0), name))
+    finally:
+        lambda_function.eh.backoff_policy = default_policy
+        extutil.rate_estimators.pop("codebuild", None)
+
+    times = sorted(finished.values())
+    return {
+        "strategy": strategy,
+        "estimator": estimator,
+        "converged_sec": round(times[-1], 1),
+        "median_sec": round(statistics.median(times), 1),
+        "p95_sec": round(times[int(0.95 * (len(times) - 1))], 1),
+        "invocations": invocations,
+        "api_calls": backend.api_calls,
+        "throttles": backend.throttles,
+        "failed": len(failed)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("strategies", nargs="*", metavar="strategy",
+        help=f"backoff strategies to compare, all by default: {', '.join(STRATEGIES)}")
+    parser.add_argument("--components", type=int, default=200, help="components deployed together")
+    parser.add_argument("--throttle-rate", type=float, default=0.05, help="fraction of API calls throttled at random")
+    parser.add_argument("--rate-limit", type=float, default=20, help="API calls per simulated second before throttling")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per API call")
+    parser.add_argument("--seed", type=int, default=0, help="seeds throttling and jitter")
+    parser.add_argument("--estimator", choices=["both", "on", "off"], default="both",
+        help="whether throttled calls wait for the RateEstimator (rate_floor)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+    if args.throttle_rate <= 0 and not args.rate_limit:
+        parser.error("nothing is throttled without a --throttle-rate or --rate-limit")
+    unknown = [s for s in args.strategies if s not in STRATEGIES]
+    if unknown:
+        parser.error(f"unknown strategies {unknown}")
+
+    estimator = {"both": [False, True], "on": [True], "off": [False]}[args.estimator]
+    results = [
+        converge(strategy, args, with_estimator)
+        for with_estimator in estimator for strategy in args.strategies or STRATEGIES
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'strategy':<14}{'estimator':>10}{'converged s':>12}{'median s':>10}{'p95 s':>9}{'invocations':>12}"
+            f"{'api calls':>10}{'throttles':>10}{'failed':>8}")
+        for m in results:
+            print(f"{m['strategy']:<14}{'on' if m['estimator'] else 'off':>10}{m['converged_sec']:>12.1f}{m['median_sec']:>10.1f}{m['p95_sec']:>9.1f}"
+                f"{m['invocations']:>12}{m['api_calls']:>10}{m['throttles']:>10}{m['failed']:>8}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
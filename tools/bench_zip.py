@@ -0,0 +1,207 @@
+"""Benchmarks create_zip on a large synthetic source tree, and checks that
+the archives it writes read back intact.
+
+    python tools/bench_zip.py --files 2000 --large-mb 64
+    python tools/bench_zip.py --check
+
+The benchmark compares create_zip with the standard library's zipfile at the
+same compression level. --check zips small trees covering multi-chunk, empty,
+stored and non-ASCII entries, once as is and once with ZIP64_LIMIT lowered so
+every zip64 path is taken, and verifies each archive with zipfile: testzip,
+names, modes, contents and the content hash against hash_tree. It exits
+non-zero if any check fails.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+import extutil
+
+WORDS = ["build", "deploy", "component", "project", "artifact", "source", "cache", "runtime", "region", "bucket"]
+
+def text(rng, size):
+    """Compressible, like source code"""
+    out, length = [], 0
+    while length < size:
+        line = " ".join(rng.choice(WORDS) for _ in range(8)) + "\n"
+        out.append(line)
+        length += len(line)
+    return "".join(out).encode("utf-8")[:size]
+
+def write(path, name, data, executable=False):
+    full_path = os.path.join(path, *name.split("/"))
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "wb") as f:
+        f.write(data)
+    os.chmod(full_path, 0o755 if executable else 0o644)
+
+def large_tree(path, args):
+    rng = random.Random(args.seed)
+    for i in range(args.files):
+        size = int(rng.expovariate(1 / (args.file_kb * 1024)))
+        if i % 10 == 9:
+            write(path, f"assets/{i // 100}/image_{i}.png", rng.randbytes(size))
+        else:
+            write(path, f"src/pkg_{i // 100}/module_{i}.py", text(rng, size))
+    for i in range(args.large_files):
+        write(path, f"data/large_{i}.csv", text(rng, args.large_mb << 20))
+
+def check_tree(path):
+    rng = random.Random(0)
+    # Sizes are in units of the 4 KiB chunks the checks zip with
+    write(path, "src/multi_chunk.py", text(rng, 10 * 4096 + 123))
+    write(path, "src/exact_chunks.py", text(rng, 3 * 4096))
+    write(path, "src/empty.py", b"")
+    write(path, "bin/run.sh", b"#!/bin/sh\necho run\n", executable=True)
+    write(path, "assets/logo.png", rng.randbytes(3 * 4096))
+    write(path, "data/random.bin", rng.randbytes(2000))
+    write(path, "données/résumé.txt", "ünïcödé ✓\n".encode("utf-8") * 50)
+    write(path, "stored/levels.txt", text(rng, 5000))
+    for i in range(40):
+        write(path, f"many/file_{i:02}.txt", text(rng, 1500))
+
+def verify(archive, path, tree_hash):
+    """Lists what is wrong with archive as a zip of the tree at path"""
+    problems = []
+    expected = extutil._zip_names(path)
+    with zipfile.ZipFile(archive) as z:
+        bad = z.testzip()
+        if bad:
+            problems.append(f"testzip failed on {bad}")
+        names = [info.filename for info in z.infolist()]
+        if names != expected:
+            problems.append(f"names {names} != {expected}")
+        for info in z.infolist():
+            if info.filename not in expected:
+                continue
+            full_path = os.path.join(path, *info.filename.split("/"))
+            with open(full_path, "rb") as f:
+                if z.read(info) != f.read():
+                    problems.append(f"{info.filename} contents differ")
+            mode = 0o755 if os.stat(full_path).st_mode & 0o111 else 0o644
+            if (info.external_attr >> 16) & 0o777 != mode:
+                problems.append(f"{info.filename} mode {oct(info.external_attr >> 16)} != {oct(mode)}")
+    if tree_hash != extutil.hash_tree(path):
+        problems.append("create_zip hash differs from hash_tree")
+    return problems
+
+def check_entry_methods(archive):
+    """Stored files must be stored and text deflated, or the checks above prove little"""
+    expected = {
+        "src/empty.py": zipfile.ZIP_STORED,
+        "assets/logo.png": zipfile.ZIP_STORED,
+        "data/random.bin": zipfile.ZIP_STORED,
+        "stored/levels.txt": zipfile.ZIP_STORED,
+        "src/multi_chunk.py": zipfile.ZIP_DEFLATED,
+        "données/résumé.txt": zipfile.ZIP_DEFLATED
+    }
+    with zipfile.ZipFile(archive) as z:
+        return [
+            f"{name} has method {z.getinfo(name).compress_type}, expected {method}"
+            for name, method in expected.items() if z.getinfo(name).compress_type != method
+        ]
+
+def run_checks():
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = os.path.join(tmp, "tree")
+        check_tree(tree)
+        cases = [("default", extutil.ZIP64_LIMIT), ("zip64", 16384)]
+        for case, limit in cases:
+            default_limit = extutil.ZIP64_LIMIT
+            extutil.ZIP64_LIMIT = limit
+            try:
+                archive = os.path.join(tmp, f"{case}.zip")
+                tree_hash = extutil.create_zip(archive, tree, chunk_size=4096, max_in_flight_bytes=16384,
+                    compression_levels={"stored/*": 0})
+                again = os.path.join(tmp, f"{case}-again.zip")
+                extutil.create_zip(again, tree, chunk_size=4096, compression_levels={"stored/*": 0})
+            finally:
+                extutil.ZIP64_LIMIT = default_limit
+            try:
+                problems = verify(archive, tree, tree_hash) + check_entry_methods(archive)
+            except (zipfile.BadZipFile, zlib.error, KeyError) as e:
+                problems = [f"unreadable archive: {e}"]
+            with open(archive, "rb") as a, open(again, "rb") as b:
+                if a.read() != b.read():
+                    problems.append("archive is not reproducible")
+            if case == "zip64" and not problems:
+                with zipfile.ZipFile(archive) as z:
+                    # The central directory starts past the lowered limit
+                    if z.start_dir < limit:
+                        problems.append("zip64 end of central directory was not exercised")
+            print(f"{case:<10}{'ok' if not problems else 'FAILED'}")
+            failures.extend(f"{case}: {p}" for p in problems)
+
+        # A chunked deflate stream inflates back to the file
+        data = text(random.Random(1), 50000)
+        chunks = [data[i:i + 4096] for i in range(0, len(data), 4096)]
+        stream = b"".join(
+            extutil._deflate_chunk(chunk, 6, chunks[i - 1][-32768:] if i else None, i == 0, i == len(chunks) - 1)[0]
+            for i, chunk in enumerate(chunks)
+        )
+        ok = zlib.decompress(stream, -15) == data
+        print(f"{'chunks':<10}{'ok' if ok else 'FAILED'}")
+        if not ok:
+            failures.append("chunks: _deflate_chunk output does not inflate to the input")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+def stdlib_zip(archive, path, level):
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED, compresslevel=level) as z:
+        for name in extutil._zip_names(path):
+            z.write(os.path.join(path, *name.split("/")), name)
+
+def run_benchmark(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = os.path.join(tmp, "tree")
+        large_tree(tree, args)
+        tree_bytes = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(tree) for f in files)
+        archive = os.path.join(tmp, "out.zip")
+
+        results = []
+        for label, run in [
+            ("hash_tree", lambda: extutil.hash_tree(tree)),
+            ("create_zip", lambda: extutil.create_zip(archive, tree, compression_level=args.level)),
+            ("zipfile", lambda: stdlib_zip(archive, tree, args.level))
+        ]:
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+            size = os.path.getsize(archive) if label != "hash_tree" else None
+            intact = zipfile.ZipFile(archive).testzip() is None if size else None
+            results.append((label, seconds, size, intact))
+
+    print(f"{tree_bytes / 1e6:.1f} MB in {args.files + args.large_files} files")
+    print(f"{'method':<12}{'seconds':>9}{'MB/s':>8}{'archive MB':>12}  testzip")
+    for label, seconds, size, intact in results:
+        archive_mb = f"{size / 1e6:.1f}" if size else "-"
+        testzip = "" if intact is None else ("ok" if intact else "FAILED")
+        print(f"{label:<12}{seconds:>9.2f}{tree_bytes / 1e6 / seconds:>8.1f}{archive_mb:>12}  {testzip}")
+    return 0 if all(intact is not False for *_, intact in results) else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="run the round trip checks instead")
+    parser.add_argument("--files", type=int, default=2000, help="small files in the tree")
+    parser.add_argument("--file-kb", type=float, default=16, help="mean small file size in KiB")
+    parser.add_argument("--large-files", type=int, default=2, help="large files in the tree")
+    parser.add_argument("--large-mb", type=int, default=32, help="size of each large file in MiB")
+    parser.add_argument("--level", type=int, default=6, help="compression level")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the tree")
+    args = parser.parse_args(argv)
+    return run_checks() if args.check else run_benchmark(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
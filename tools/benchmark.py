@@ -0,0 +1,177 @@
+"""End-to-end benchmarks of the extension lifecycle against FakeCodeBuild.
+
+Each scenario reports invocations, CodeBuild API calls, the bytes of
+arguments sent with them and simulated wall time. With throttle_rate 0 these are deterministic, so CI can compare them
+against a stored baseline and fail on regressions:
+
+    python tools/benchmark.py --write-baseline tools/baseline.json
+    python tools/benchmark.py --baseline tools/baseline.json
+
+Real seconds are reported too, but are never compared.
+"""
+import argparse
+import json
+import sys
+
+from fake_codebuild import FakeCodeBuild
+from harness import Harness
+
+def component_def(index=0, **overrides):
+    return {
+        "s3_bucket": "ck-bench-source",
+        "s3_object": f"component-{index}.zip",
+        "runtime_versions": {"python": "3.11"},
+        "build_commands": ["pip install -r requirements.txt", "python -m pytest"],
+        **overrides
+    }
+
+def create(harness):
+    return [harness.deploy("build", component_def())]
+
+def noop_redeploy(harness):
+    first = harness.deploy("build", component_def())
+    return [harness.deploy("build", component_def(), prev_state=first.prev_state)]
+
+def update(harness):
+    first = harness.deploy("build", component_def())
+    changed = component_def(environment_variables={"STAGE": "prod"})
+    return [harness.deploy("build", changed, prev_state=first.prev_state)]
+
+def rename(harness):
+    first = harness.deploy("build", component_def())
+    renamed = component_def(name="build-renamed")
+    return [harness.deploy("build", renamed, prev_state=first.prev_state)]
+
+def delete(harness):
+    first = harness.deploy("build", component_def())
+    return [harness.deploy("build", component_def(), op="delete", prev_state=first.prev_state)]
+
+def report_group_type_change(harness):
+    # CodeBuild holds a deleted group's name for a while, so the group cannot
+    # be created again under it straight away
+    harness.backend.report_group_delete_sec = 30
+    first = harness.deploy("build", component_def(report_groups={"unit": {"format": "JUNITXML", "files": ["**/*"]}}))
+    changed = component_def(report_groups={"unit": {"format": "JACOCOXML", "files": ["**/*"]}})
+    outcome = harness.deploy("build", changed, prev_state=first.prev_state)
+    if [g["type"] for g in harness.backend.report_groups.values()] != ["CODE_COVERAGE"]:
+        outcome.result = {"error": "Report group was not replaced"}
+    return [outcome]
+
+def remove_build_batch(harness):
+    batched = component_def(
+        build_batch={"maximum_builds_allowed": 2},
+        buildspec_batch={"build-list": [{"identifier": "unit"}, {"identifier": "integration"}]}
+    )
+    first = harness.deploy("build", batched)
+    outcome = harness.deploy("build", component_def(), prev_state=first.prev_state)
+    if any("buildBatchConfig" in p for p in harness.backend.projects.values()):
+        outcome.result = {"error": "Batch config was left on the project"}
+    return [outcome]
+
+def build_and_wait(harness):
+    return [harness.deploy("build", component_def(run_build=True))]
+
+def bulk_create(harness, components):
+    events = [harness.component_event(f"build{i}", component_def(i)) for i in range(components)]
+    return harness.deploy_batch(events)
+
+def bulk_noop_redeploy(harness, components):
+    first = bulk_create(harness, components)
+    events = [harness.component_event(o.component_name, o.component_def, prev_state=o.prev_state) for o in first]
+    return harness.deploy_batch(events)
+
+SCENARIOS = {
+    "create": create,
+    "noop_redeploy": noop_redeploy,
+    "update": update,
+    "rename": rename,
+    "delete": delete,
+    "report_group_type_change": report_group_type_change,
+    "remove_build_batch": remove_build_batch,
+    "build_and_wait": build_and_wait,
+    "bulk_create": bulk_create,
+    "bulk_noop_redeploy": bulk_noop_redeploy
+}
+BULK_SCENARIOS = ["bulk_create", "bulk_noop_redeploy"]
+# Compared against the baseline; real_sec varies by machine
+COMPARED_METRICS = ["invocations", "api_calls", "request_bytes", "simulated_sec"]
+
+def run_scenario(name, args):
+    backend = FakeCodeBuild(latency_sec=args.latency, throttle_rate=args.throttle_rate, seed=args.seed)
+    with Harness(backend) as harness:
+        scenario_args = [args.components] if name in BULK_SCENARIOS else []
+        # Only the last deploy is measured; any before it are setup
+        outcomes = SCENARIOS[name](harness, *scenario_args)
+
+    failed = [o.component_name for o in outcomes if not o.success]
+    return {
+        "invocations": max(o.invocations for o in outcomes),
+        "api_calls": sum(outcomes[0].calls.values()),
+        "calls_by_operation": outcomes[0].calls,
+        "request_bytes": outcomes[0].request_bytes,
+        "simulated_sec": round(outcomes[0].simulated_sec, 3),
+        "real_sec": round(outcomes[0].real_sec, 3),
+        "components": len(outcomes),
+        "failed": failed[:10],
+        "errors": sorted({o.error for o in outcomes if o.error})
+    }
+
+def compare(results, baseline, tolerance):
+    """Lists the metrics in results that are worse than baseline by more than tolerance"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric in COMPARED_METRICS:
+            expected = (baseline.get(name) or {}).get(metric)
+            if expected is None:
+                continue
+            if metrics[metric] > expected * (1 + tolerance) + 1e-9:
+                regressions.append(f"{name}.{metric}: {metrics[metric]} > baseline {expected}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+        help=f"scenarios to run, all by default: {', '.join(SCENARIOS)}")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per API call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of API calls throttled")
+    parser.add_argument("--seed", type=int, default=0, help="seeds throttling")
+    parser.add_argument("--components", type=int, default=1000, help="components in the bulk scenarios")
+    parser.add_argument("--baseline", help="fail if any scenario regresses against this file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed regression, as a fraction")
+    parser.add_argument("--write-baseline", help="write the results to this file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios {unknown}")
+
+    results = {name: run_scenario(name, args) for name in args.scenarios or SCENARIOS}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scenario':<26}{'components':>11}{'invocations':>12}{'api calls':>10}{'sent bytes':>12}"
+            f"{'simulated s':>13}{'real s':>9}  failed")
+        for name, m in results.items():
+            print(f"{name:<26}{m['components']:>11}{m['invocations']:>12}{m['api_calls']:>10}{m['request_bytes']:>12}"
+                f"{m['simulated_sec']:>13.2f}{m['real_sec']:>9.2f}  {len(m['failed']) or ''} {' '.join(m['errors'])}")
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump({name: {k: m[k] for k in COMPARED_METRICS} for name, m in results.items()}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    status = 0
+    if any(m["failed"] for m in results.values()):
+        print("Some scenarios had failing components", file=sys.stderr)
+        status = 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        status = status or (1 if regressions else 0)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
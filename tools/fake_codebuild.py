@@ -0,0 +1,341 @@
+"""An in-process stand-in for the CodeBuild API, for running the extension offline.
+
+FakeCodeBuild answers the boto3 codebuild client calls the extension makes,
+keeping projects and builds in memory. Time is simulated: every call adds
+latency_sec to the clock, and builds move through their phases as the clock
+is advanced, so whole deploys run in milliseconds. Throttling happens at
+throttle_rate, and above rate_limit calls per simulated second if one is
+given, and inject_error makes chosen calls fail.
+"""
+import datetime
+import itertools
+import json
+import random
+
+from botocore.exceptions import ClientError
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Seconds each build phase takes; BUILD is build_duration_sec
+PHASE_DURATIONS = [
+    ("SUBMITTED", 1), ("QUEUED", 2), ("PROVISIONING", 20), ("DOWNLOAD_SOURCE", 3),
+    ("INSTALL", 15), ("PRE_BUILD", 2), ("BUILD", None), ("POST_BUILD", 2),
+    ("UPLOAD_ARTIFACTS", 3), ("FINALIZING", 2)
+]
+
+class FakeCodeBuild:
+
+    def __init__(self, latency_sec=0.05, throttle_rate=0.0, build_duration_sec=60, build_status="SUCCEEDED",
+            account="123456789012", region="us-east-1", seed=0, rate_limit=None, report_group_delete_sec=0):
+        self.latency_sec = latency_sec
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        # Report groups stay DELETING, holding their name, this long
+        self.report_group_delete_sec = report_group_delete_sec
+        # A token bucket holding a second of calls at rate_limit
+        self.tokens = rate_limit or 0
+        self.refilled = 0.0
+        self.throttles = 0
+        self.build_duration_sec = build_duration_sec
+        self.build_status = build_status
+        self.account = account
+        self.region = region
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.projects = {}
+        self.builds = {}
+        self.build_batches = {}
+        self.report_groups = {}
+        self.report_group_deletions = {}
+        self.calls = {}
+        # JSON size of the arguments sent, by operation
+        self.request_bytes = {}
+        self.errors = []
+        self.ids = itertools.count(1)
+
+    # Test controls
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def inject_error(self, operation, code, count=1, message="Injected error"):
+        """Makes the next count calls to operation fail with code"""
+        self.errors.append({"operation": operation, "code": code, "count": count, "message": message})
+
+    @property
+    def api_calls(self):
+        return sum(self.calls.values())
+
+    def _call(self, operation, params=None):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        size = len(json.dumps(params or {}, default=str))
+        self.request_bytes[operation] = self.request_bytes.get(operation, 0) + size
+        self.now += self.latency_sec
+        for error in self.errors:
+            if error["operation"] == operation and error["count"] > 0:
+                error["count"] -= 1
+                self._raise(operation, error["code"], error["message"])
+        if self.throttle_rate and self.rng.random() < self.throttle_rate:
+            self.throttles += 1
+            self._raise(operation, "ThrottlingException", "Rate exceeded")
+        if self.rate_limit:
+            self.tokens = min(self.rate_limit, self.tokens + (self.now - self.refilled) * self.rate_limit)
+            self.refilled = self.now
+            if self.tokens < 1:
+                self.throttles += 1
+                self._raise(operation, "ThrottlingException", "Rate exceeded")
+            self.tokens -= 1
+
+    @staticmethod
+    def _raise(operation, code, message):
+        raise ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+    def _time(self, offset=0):
+        return EPOCH + datetime.timedelta(seconds=self.now + offset)
+
+    # Projects
+
+    def batch_get_projects(self, names):
+        self._call("BatchGetProjects", {"names": names})
+        return {
+            "projects": [json.loads(json.dumps(self.projects[n], default=str)) for n in names if n in self.projects],
+            "projectsNotFound": [n for n in names if n not in self.projects]
+        }
+
+    def create_project(self, **spec):
+        self._call("CreateProject", spec)
+        if spec["name"] in self.projects:
+            self._raise("CreateProject", "ResourceAlreadyExistsException", f"Project already exists: {spec['name']}")
+        self.projects[spec["name"]] = {
+            "timeoutInMinutes": 60,
+            "queuedTimeoutInMinutes": 480,
+            "cache": {"type": "NO_CACHE"},
+            "tags": [],
+            **spec,
+            "arn": f"arn:aws:codebuild:{self.region}:{self.account}:project/{spec['name']}",
+            "created": self._time(),
+            "lastModified": self._time(),
+            "badge": {"badgeEnabled": False}
+        }
+        return {"project": self.projects[spec["name"]]}
+
+    def update_project(self, **spec):
+        self._call("UpdateProject", spec)
+        project = self.projects.get(spec["name"])
+        if not project:
+            self._raise("UpdateProject", "ResourceNotFoundException", f"Project not found: {spec['name']}")
+        project.update(spec)
+        # Reset values clear a setting, and CodeBuild then leaves it out
+        for k, v in spec.items():
+            if v in ({}, [], "") or (k == "concurrentBuildLimit" and v == -1):
+                project.pop(k)
+        project["lastModified"] = self._time()
+        return {"project": project}
+
+    def delete_project(self, name):
+        self._call("DeleteProject", {"name": name})
+        self.projects.pop(name, None)
+        return {}
+
+    # Webhooks
+
+    def create_webhook(self, projectName, **settings):
+        self._call("CreateWebhook", {"projectName": projectName, **settings})
+        project = self._webhook_project("CreateWebhook", projectName)
+        if project.get("webhook"):
+            self._raise("CreateWebhook", "ResourceAlreadyExistsException", f"Webhook already exists: {projectName}")
+        project["webhook"] = {
+            "url": f"https://api.github.com/repos/bench/bench/hooks/{next(self.ids)}",
+            "payloadUrl": f"https://codebuild.{self.region}.amazonaws.com/webhooks",
+            **settings,
+            "lastModifiedSecret": self._time()
+        }
+        # Like CodeBuild, the secret is only ever returned here
+        return {"webhook": {**project["webhook"], "secret": "fake-secret"}}
+
+    def update_webhook(self, projectName, rotateSecret=False, **settings):
+        self._call("UpdateWebhook", {"projectName": projectName, **settings})
+        project = self._webhook_project("UpdateWebhook", projectName)
+        if not project.get("webhook"):
+            self._raise("UpdateWebhook", "ResourceNotFoundException", f"No webhook for project: {projectName}")
+        project["webhook"].update(settings)
+        return {"webhook": project["webhook"]}
+
+    def delete_webhook(self, projectName):
+        self._call("DeleteWebhook", {"projectName": projectName})
+        project = self._webhook_project("DeleteWebhook", projectName)
+        if not project.pop("webhook", None):
+            self._raise("DeleteWebhook", "ResourceNotFoundException", f"No webhook for project: {projectName}")
+        return {}
+
+    def _webhook_project(self, operation, project_name):
+        project = self.projects.get(project_name)
+        if not project:
+            self._raise(operation, "ResourceNotFoundException", f"Project not found: {project_name}")
+        return project
+
+    # Report groups
+
+    def _expire_report_groups(self):
+        for arn, deleted_at in list(self.report_group_deletions.items()):
+            if deleted_at <= self.now:
+                self.report_groups.pop(arn, None)
+                self.report_group_deletions.pop(arn)
+
+    def batch_get_report_groups(self, reportGroupArns):
+        self._call("BatchGetReportGroups", {"reportGroupArns": reportGroupArns})
+        self._expire_report_groups()
+        return {
+            "reportGroups": [self.report_groups[a] for a in reportGroupArns if a in self.report_groups],
+            "reportGroupsNotFound": [a for a in reportGroupArns if a not in self.report_groups]
+        }
+
+    def create_report_group(self, name, type, exportConfig, **_):
+        self._call("CreateReportGroup", {"name": name, "type": type, "exportConfig": exportConfig})
+        arn = f"arn:aws:codebuild:{self.region}:{self.account}:report-group/{name}"
+        self._expire_report_groups()
+        if arn in self.report_groups:
+            self._raise("CreateReportGroup", "ResourceAlreadyExistsException", f"Report group already exists: {name}")
+        self.report_groups[arn] = {
+            "arn": arn, "name": name, "type": type, "exportConfig": exportConfig,
+            "created": self._time(), "lastModified": self._time(), "status": "ACTIVE"
+        }
+        return {"reportGroup": self.report_groups[arn]}
+
+    def update_report_group(self, arn, exportConfig=None, **_):
+        self._call("UpdateReportGroup", {"arn": arn, "exportConfig": exportConfig})
+        if arn not in self.report_groups:
+            self._raise("UpdateReportGroup", "ResourceNotFoundException", f"Report group not found: {arn}")
+        if exportConfig:
+            self.report_groups[arn]["exportConfig"] = exportConfig
+        self.report_groups[arn]["lastModified"] = self._time()
+        return {"reportGroup": self.report_groups[arn]}
+
+    def delete_report_group(self, arn, deleteReports=False):
+        self._call("DeleteReportGroup", {"arn": arn, "deleteReports": deleteReports})
+        if self.report_group_delete_sec and arn in self.report_groups:
+            self.report_groups[arn]["status"] = "DELETING"
+            self.report_group_deletions.setdefault(arn, self.now + self.report_group_delete_sec)
+        else:
+            self.report_groups.pop(arn, None)
+        return {}
+
+    # Builds
+
+    def start_build(self, projectName, sourceVersion=None, environmentVariablesOverride=None, **_):
+        self._call("StartBuild", {"projectName": projectName})
+        build = self._new_build(projectName, sourceVersion)
+        self.builds[build["id"]] = build
+        return {"build": self._describe_build(build)}
+
+    def batch_get_builds(self, ids):
+        self._call("BatchGetBuilds", {"ids": ids})
+        return {
+            "builds": [self._describe_build(self.builds[i]) for i in ids if i in self.builds],
+            "buildsNotFound": [i for i in ids if i not in self.builds]
+        }
+
+    def list_builds_for_project(self, projectName, sortOrder="DESCENDING", **_):
+        self._call("ListBuildsForProject", {"projectName": projectName})
+        builds = sorted(
+            (b for b in self.builds.values() if b["projectName"] == projectName),
+            key=lambda b: b["start"], reverse=sortOrder == "DESCENDING"
+        )
+        return {"ids": [b["id"] for b in builds]}
+
+    def start_build_batch(self, projectName, sourceVersion=None, environmentVariablesOverride=None, **_):
+        self._call("StartBuildBatch", {"projectName": projectName})
+        build_batch = self._new_build(projectName, sourceVersion)
+        build_batch["groups"] = self._batch_identifiers(projectName)
+        self.build_batches[build_batch["id"]] = build_batch
+        return {"buildBatch": self._describe_build_batch(build_batch)}
+
+    def batch_get_build_batches(self, ids):
+        self._call("BatchGetBuildBatches", {"ids": ids})
+        return {
+            "buildBatches": [self._describe_build_batch(self.build_batches[i]) for i in ids if i in self.build_batches],
+            "buildBatchesNotFound": [i for i in ids if i not in self.build_batches]
+        }
+
+    def _new_build(self, project_name, source_version):
+        project = self.projects.get(project_name)
+        if not project:
+            self._raise("StartBuild", "ResourceNotFoundException", f"Project not found: {project_name}")
+        return {
+            "id": f"{project_name}:{next(self.ids):08d}",
+            "projectName": project_name,
+            "start": self.now,
+            "sourceVersion": source_version,
+            "environment": dict(project.get("environment") or {}),
+            "artifacts": project.get("artifacts") or {}
+        }
+
+    def _batch_identifiers(self, project_name):
+        try:
+            batch = json.loads((self.projects[project_name].get("source") or {}).get("buildspec") or "{}").get("batch") or {}
+        except ValueError:
+            batch = {}
+        for kind in ["build-graph", "build-list"]:
+            if kind in batch:
+                return [entry["identifier"] for entry in batch[kind]]
+        return ["build1"]
+
+    def _phases(self, build):
+        elapsed = self.now - build["start"]
+        phases, offset = [], 0
+        for phase_type, duration in PHASE_DURATIONS:
+            duration = self.build_duration_sec if duration is None else duration
+            if elapsed < offset:
+                break
+            phase = {"phaseType": phase_type, "startTime": self._time(build["start"] + offset - self.now)}
+            if elapsed >= offset + duration:
+                phase.update({
+                    "endTime": self._time(build["start"] + offset + duration - self.now),
+                    "durationInSeconds": duration,
+                    "phaseStatus": "SUCCEEDED"
+                })
+            phases.append(phase)
+            offset += duration
+        return phases, elapsed >= offset, offset
+
+    def _describe_build(self, build):
+        phases, complete, total = self._phases(build)
+        artifacts = build["artifacts"]
+        location = None
+        if artifacts.get("type") == "S3":
+            location = "arn:aws:s3:::" + "/".join(p for p in [artifacts.get("location"), artifacts.get("path"), artifacts.get("name")] if p)
+        description = {
+            "id": build["id"],
+            "arn": f"arn:aws:codebuild:{self.region}:{self.account}:build/{build['id']}",
+            "projectName": build["projectName"],
+            "startTime": self._time(build["start"] - self.now),
+            "currentPhase": "COMPLETED" if complete else phases[-1]["phaseType"],
+            "buildStatus": self.build_status if complete else "IN_PROGRESS",
+            "buildComplete": complete,
+            "sourceVersion": build["sourceVersion"],
+            "environment": build["environment"],
+            "phases": phases,
+            "artifacts": {"location": location} if location else {}
+        }
+        if complete:
+            description["endTime"] = self._time(build["start"] + total - self.now)
+        return description
+
+    def _describe_build_batch(self, build_batch):
+        build = self._describe_build(build_batch)
+        return {
+            "id": build["id"],
+            "arn": build["arn"].replace(":build/", ":build-batch/"),
+            "projectName": build["projectName"],
+            "startTime": build["startTime"],
+            "endTime": build.get("endTime"),
+            "currentPhase": "SUCCEEDED" if build["buildComplete"] else "IN_PROGRESS",
+            "buildBatchStatus": build["buildStatus"],
+            "complete": build["buildComplete"],
+            "phases": [{"phaseType": "IN_PROGRESS", "startTime": build["startTime"]}],
+            "buildGroups": [
+                {"identifier": identifier, "currentBuildSummary": {"buildStatus": build["buildStatus"]}}
+                for identifier in build_batch["groups"]
+            ],
+            "artifacts": build["artifacts"]
+        }
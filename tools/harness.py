@@ -0,0 +1,155 @@
+"""Drives the extension's lambda_handler the way CloudKommand does, offline.
+
+A deploy sends the component event, then keeps calling back with the returned
+pass_back_data after callback_sec, until the handler reports success or an
+error. The codebuild client is swapped for a FakeCodeBuild, and its simulated
+clock advances by callback_sec between invocations, so a deploy that would
+wait minutes on AWS finishes here in milliseconds.
+
+    harness = Harness(FakeCodeBuild(latency_sec=0.05))
+    outcome = harness.deploy("build", {"s3_bucket": "b", "s3_object": "o"})
+    outcome = harness.deploy("build", {...}, prev_state=outcome.prev_state)
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("codebuild_role_arn", "arn:aws:iam::123456789012:role/codebuild-role")
+
+import extutil
+import lambda_function
+
+class Context:
+    def __init__(self, account="123456789012", region="us-east-1"):
+        self.invoked_function_arn = f"arn:aws:lambda:{region}:{account}:function:codebuild-extension"
+
+class Outcome:
+    """What one deploy did, and the state to hand to the next deploy"""
+
+    def __init__(self, component_name, component_def, result, invocations, calls, request_bytes, simulated_sec, real_sec):
+        self.component_name = component_name
+        self.component_def = component_def
+        self.result = result
+        self.invocations = invocations
+        # calls, request_bytes, simulated_sec and real_sec cover the whole deploy_batch
+        self.calls = calls
+        self.request_bytes = request_bytes
+        self.simulated_sec = simulated_sec
+        self.real_sec = real_sec
+
+    @property
+    def success(self):
+        return bool(self.result.get("success"))
+
+    @property
+    def error(self):
+        return self.result.get("error")
+
+    @property
+    def prev_state(self):
+        return {
+            "props": self.result.get("props") or {},
+            "links": self.result.get("links") or {},
+            "state": self.result.get("state") or {},
+            "rendef": self.component_def
+        }
+
+class Harness:
+
+    def __init__(self, backend, project_code="bench", repo_id="github.com/cloudkommand/bench",
+            bucket="ck-bench-artifacts", invoke_overhead_sec=0.1, max_invocations=200, quiet=True):
+        self.backend = backend
+        self.project_code = project_code
+        self.repo_id = repo_id
+        self.bucket = bucket
+        self.invoke_overhead_sec = invoke_overhead_sec
+        self.max_invocations = max_invocations
+        self.quiet = quiet
+        self.context = Context(backend.account, backend.region)
+        extutil.override_client("codebuild", backend)
+        lambda_function.project_cache.clear()
+
+    def close(self):
+        extutil.override_client("codebuild")
+        lambda_function.project_cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def component_event(self, component_name, component_def, op="upsert", prev_state=None):
+        return {
+            "component_name": component_name,
+            "component_def": component_def,
+            "op": op,
+            "prev_state": prev_state or {}
+        }
+
+    def deploy(self, component_name, component_def, op="upsert", prev_state=None):
+        """Runs one component to completion through lambda_handler"""
+        return self.deploy_batch([self.component_event(component_name, component_def, op, prev_state)], batch=False)[0]
+
+    def deploy_batch(self, components, batch=True):
+        """Runs component events (see component_event) to completion. With
+        batch, each round is one batch_lambda_handler invocation carrying every
+        component still in progress; otherwise each component is run alone."""
+        pending = {c["component_name"]: dict(c) for c in components}
+        invocations = {name: 0 for name in pending}
+        results = {}
+        start_calls, start_sec, start_real = dict(self.backend.calls), self.backend.now, time.perf_counter()
+        start_bytes = sum(self.backend.request_bytes.values())
+        rounds = 0
+
+        while pending:
+            rounds += 1
+            if rounds > self.max_invocations:
+                raise RuntimeError(f"{list(pending)} did not finish in {self.max_invocations} invocations")
+            if batch:
+                returned = self._invoke({
+                    **self._shared(), "components": list(pending.values())
+                })["components"]
+            else:
+                returned = {name: self._invoke({**self._shared(), **c}) for name, c in pending.items()}
+
+            callback_sec = 0
+            for name, result in returned.items():
+                invocations[name] += 1
+                if result.get("success") or result.get("error"):
+                    results[name] = result
+                    pending.pop(name)
+                else:
+                    pending[name]["pass_back_data"] = result["pass_back_data"]
+                    callback_sec = max(callback_sec, result.get("callback_sec") or 0)
+            if pending:
+                self.backend.advance(callback_sec)
+
+        calls = {
+            operation: count - start_calls.get(operation, 0)
+            for operation, count in sorted(self.backend.calls.items()) if count > start_calls.get(operation, 0)
+        }
+        request_bytes = sum(self.backend.request_bytes.values()) - start_bytes
+        simulated_sec = self.backend.now - start_sec
+        real_sec = time.perf_counter() - start_real
+        return [
+            Outcome(c["component_name"], c["component_def"], results[c["component_name"]],
+                invocations[c["component_name"]], calls, request_bytes, simulated_sec, real_sec)
+            for c in components
+        ]
+
+    def _shared(self):
+        return {"project_code": self.project_code, "repo_id": self.repo_id, "bucket": self.bucket}
+
+    def _invoke(self, event):
+        self.backend.advance(self.invoke_overhead_sec)
+        output = io.StringIO() if self.quiet else sys.stdout
+        with contextlib.redirect_stdout(output):
+            return lambda_function.lambda_handler(event, self.context)